@@ -0,0 +1,137 @@
+"""
+Contrôle d'admission des requêtes qui modifient l'état (POST, PUT, PATCH, DELETE).
+
+Au plus `max_concurrent` écritures s'exécutent en même temps ; les suivantes attendent leur
+tour dans une file bornée (`max_queue` places, `max_wait` secondes au plus). Au-delà, la
+réponse part tout de suite au lieu d'allonger la file : 429 si la file est pleine, 503 si
+l'attente a expiré, avec un en-tête Retry-After estimé d'après la durée moyenne d'une écriture.
+
+Les lectures (GET, HEAD, OPTIONS) ne passent jamais par la file : pendant la rafale du
+dernier service, un écran qui interroge /prices n'attend pas derrière les /buy.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+import metrics
+
+WRITE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+
+wait_seconds = metrics.registry.histogram(
+    'biere_admission_wait_seconds', "Attente dans la file d'admission avant une écriture",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+rejected_total = metrics.registry.counter(
+    'biere_admission_rejected_total', "Écritures refusées par le contrôle d'admission", ('reason',))
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """File d'attente FIFO bornée ; toutes les méthodes s'appellent depuis la boucle d'événements"""
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 64, max_wait: float = 2.0):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: deque = deque()
+        self._service_time = 0.05  # Moyenne glissante de la durée d'une écriture (secondes)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Secondes avant qu'une place se libère, d'après la file et la durée moyenne d'une écriture"""
+        backlog = (len(self._waiters) + 1) * self._service_time / self.max_concurrent
+        return max(1, min(30, math.ceil(backlog)))
+
+    async def acquire(self) -> float:
+        """Attend une place ; retourne l'attente en secondes ou lève Overloaded"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded(429, 'queue_full', self.retry_after())
+
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # La place a été cédée juste à l'expiration : on la prend quand même
+                return time.perf_counter() - start
+            self._waiters.remove(waiter)
+            raise Overloaded(503, 'timeout', self.retry_after())
+        except asyncio.CancelledError:
+            # Client parti pendant l'attente : rendre la place si elle venait d'être cédée
+            if waiter.done():
+                self.release(0.0)
+            else:
+                self._waiters.remove(waiter)
+            raise
+        return time.perf_counter() - start
+
+    def release(self, held: float):
+        """Libère une place ; la première requête en attente en hérite directement"""
+        self._service_time += 0.2 * (held - self._service_time)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            'active': self.active,
+            'queued': len(self._waiters),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'max_wait': self.max_wait,
+            'avg_service_ms': round(self._service_time * 1000, 1),
+        }
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI pur : fait passer les écritures par le contrôleur, laisse passer les lectures"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope.get('method') not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            waited = await self.controller.acquire()
+        except Overloaded as e:
+            rejected_total.inc(reason=e.reason)
+            scope['biere.rejected'] = e.reason  # Pas de route : compté sous 'rejected' par MetricsMiddleware
+            body = json.dumps({'detail': 'Serveur surchargé, réessayez plus tard',
+                               'retry_after': e.retry_after}).encode('utf-8')
+            await send({'type': 'http.response.start', 'status': e.status_code,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(body)).encode()),
+                                    (b'retry-after', str(e.retry_after).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        wait_seconds.observe(waited)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - start)
@@ -0,0 +1,177 @@
+"""
+Fichiers statiques du client servis depuis la mémoire, empreintés et pré-compressés.
+
+Au démarrage, chaque fichier de client/ est lu une fois :
+- les fichiers non HTML reçoivent un nom empreinté par leur contenu (app.3f2a9c1b7d.js),
+  servi avec `Cache-Control: immutable` pour un an : un écran rechargé ne les retélécharge
+  plus tant qu'ils ne changent pas ;
+- les pages HTML sont réécrites pour pointer vers ces noms et servies en `no-cache`
+  (revalidation par ETag, réponse 304 sans corps) ;
+- les variantes gzip (et brotli si le paquet est installé) sont construites une fois pour
+  toutes et choisies selon Accept-Encoding.
+
+Les noms d'origine (app.js, style.css...) restent servis, en `no-cache`, pour les liens
+existants.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from starlette.responses import JSONResponse, RedirectResponse, Response
+
+from logs import get_logger
+
+try:
+    import brotli
+except ImportError:  # Dépendance optionnelle : gzip seul sinon
+    brotli = None
+
+log = get_logger('assets')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 512
+# Attributs src/href relatifs des pages HTML (les URLs absolues http(s):// ne sont pas touchées)
+ASSET_REF = re.compile(r'''(\b(?:src|href)=["'])(/?)([^"':?#]+)(["'])''')
+
+
+class Asset:
+    __slots__ = ('body', 'encoded', 'media_type', 'etag', 'cache_control')
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        self.encoded: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_SIZE and media_type.startswith(COMPRESSIBLE):
+            if brotli is not None:
+                self._add('br', brotli.compress(body, quality=11))
+            self._add('gzip', gzip.compress(body, compresslevel=9, mtime=0))
+
+    def _add(self, encoding: str, data: bytes):
+        if len(data) < len(self.body):
+            self.encoded[encoding] = data
+
+
+def _fingerprinted(name: str, body: bytes) -> str:
+    root, ext = os.path.splitext(name)
+    return f'{root}.{hashlib.sha256(body).hexdigest()[:10]}{ext}'
+
+
+def _accepted_encodings(header: str):
+    accepted = set()
+    for part in header.split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if any(f.replace(' ', '') in ('q=0', 'q=0.0') for f in fields[1:]):
+            continue
+        accepted.add(fields[0].lower())
+    return accepted
+
+
+class StaticAssets:
+    """Application ASGI à monter sur "/" à la place de StaticFiles"""
+
+    def __init__(self, directory: str, index: str = 'index.html', reload: bool = False):
+        self.directory = directory
+        self.index = index
+        self.reload = reload
+        self.assets: Dict[str, Asset] = {}
+        self.fingerprints: Dict[str, str] = {}  # {nom d'origine: nom empreinté}
+        self._stamp = None
+        self.build()
+
+    def _directory_stamp(self):
+        stamps = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                st = os.stat(os.path.join(root, name))
+                stamps.append((root, name, st.st_mtime_ns, st.st_size))
+        return tuple(sorted(stamps))
+
+    def build(self):
+        """Lit, empreinte et compresse tous les fichiers du dossier"""
+        assets: Dict[str, Asset] = {}
+        fingerprints: Dict[str, str] = {}
+        pages: Dict[str, bytes] = {}
+        stamp = self._directory_stamp()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    body = f.read()
+                if name.endswith('.html'):
+                    pages[rel] = body
+                    continue
+                media_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                fingerprinted = _fingerprinted(rel, body)
+                fingerprints[rel] = fingerprinted
+                assets[fingerprinted] = Asset(body, media_type, IMMUTABLE)
+                assets[rel] = Asset(body, media_type, REVALIDATE)
+
+        for rel, body in pages.items():
+            base = os.path.dirname(rel)
+
+            def replace(match):
+                target = match.group(3)
+                key = target if match.group(2) else os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+                if key not in fingerprints:
+                    return match.group(0)
+                new_target = fingerprints[key] if match.group(2) else os.path.relpath(fingerprints[key], base or '.').replace(os.sep, '/')
+                return f'{match.group(1)}{match.group(2)}{new_target}{match.group(4)}'
+
+            html = ASSET_REF.sub(replace, body.decode('utf-8'))
+            assets[rel] = Asset(html.encode('utf-8'), 'text/html; charset=utf-8', REVALIDATE)
+
+        self.assets, self.fingerprints, self._stamp = assets, fingerprints, stamp
+        raw = sum(len(a.body) for name, a in assets.items() if name not in fingerprints)
+        packed = sum(len(a.encoded.get('br') or a.encoded.get('gzip') or a.body)
+                     for name, a in assets.items() if name not in fingerprints)
+        log.info("Fichiers statiques prêts: %s fichiers, %s Ko (%s Ko compressés)",
+                 len(fingerprints) + len(pages), raw // 1024, packed // 1024)
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        path = path.lstrip('/')
+        if path == '' or path.endswith('/'):
+            path += self.index
+        return self.assets.get(path)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        if self.reload and self._directory_stamp() != self._stamp:
+            self.build()
+
+        path = scope.get('path', '/')
+        asset = self.lookup(path)
+        if asset is None and not path.endswith('/') and self.lookup(path + '/') is not None:
+            await RedirectResponse(path + '/')(scope, receive, send)
+            return
+        if asset is None or scope.get('method') not in ('GET', 'HEAD'):
+            status_code = 404 if asset is None else 405
+            await JSONResponse({'detail': 'Not Found' if asset is None else 'Method Not Allowed'},
+                               status_code=status_code)(scope, receive, send)
+            return
+
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope.get('headers', []))
+        response_headers = {'ETag': asset.etag, 'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+        if asset.etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            await Response(status_code=304, headers=response_headers)(scope, receive, send)
+            return
+
+        body = asset.body
+        accepted = _accepted_encodings(headers.get('accept-encoding', ''))
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in asset.encoded:
+                body = asset.encoded[encoding]
+                response_headers['Content-Encoding'] = encoding
+                break
+        if scope.get('method') == 'HEAD':
+            response_headers['Content-Length'] = str(len(body))
+            body = b''
+        await Response(body, media_type=asset.media_type, headers=response_headers)(scope, receive, send)
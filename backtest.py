@@ -0,0 +1,322 @@
+"""
+Rejeu d'une soirée enregistrée pour régler le marché sur des données réelles.
+
+Les ventes (fichiers de session data/session_*.csv, ou à défaut les achats de history.csv)
+et les événements de marché de history.csv (crash, boom, reset) sont rejoués en mémoire,
+bien plus vite que le temps réel. Chaque vente est un pas du modèle de prix choisi
+(--model, voir pricing.py), le même code que pour les achats de CSVDataManager :
+  - mode "immediate" (apply_buy) : tout le catalogue bouge, avec la volatilité ;
+  - mode "market" (apply_buy_simple) : seule la boisson achetée bouge.
+Un crash ou un boom est rejoué avec la variation relative enregistrée, un reset remet
+les prix de base.
+
+Toutes les combinaisons de paramètres (volatilité x paramètres du modèle, --param) sont
+simulées ensemble : l'état est un tableau (jeux de paramètres x boissons), les paramètres
+des colonnes (jeux de paramètres x 1), et chaque vente est un seul pas vectorisé numpy.
+--workers N répartit la grille sur N processus.
+
+Les ventes sont rejouées telles qu'enregistrées (la demande ne réagit pas au prix) :
+le rapport compare le chiffre d'affaires et la marge sur le prix de base que chaque
+réglage aurait produits avec la même clientèle. Les Happy Hours ne sont pas rejouées.
+
+Exemples :
+    python backtest.py --session data/session_session_20250918_030400.csv --volatility 0.5,1,1.5,2
+    python backtest.py --volatility 0.25,0.5,1,2,4 --param up=0.005,0.01,0.02 --workers 4 --output bt.json
+    python backtest.py --model inventory --param sensitivity=0.05,0.1,0.2 --param smoothing=0.2,0.5
+"""
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import pricing
+from history_store import iter_rows
+from pricing import MarketState
+
+DEFAULT_VOLATILITY = [0.5, 1.0, 1.5, 2.0]
+
+# Types d'événements rejoués
+BUY, SCALE, RESET = 0, 1, 2
+
+
+def load_drinks(path: str):
+    """Catalogue (ids, noms, prix courant, base, min, max) depuis drinks.csv"""
+    ids, names, prices, bases, mins, maxs = [], [], [], [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                ids.append(int(row['id']))
+                names.append(row['name'])
+                prices.append(float(row['price']))
+                bases.append(float(row['base_price']))
+                mins.append(float(row['min_price']))
+                maxs.append(float(row['max_price']))
+            except (ValueError, KeyError):
+                continue
+    return {
+        'ids': ids,
+        'names': names,
+        'price': np.array(prices),
+        'base': np.array(bases),
+        'min': np.array(mins),
+        'max': np.array(maxs),
+    }
+
+
+def _parse_time(value: str):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def load_session_sales(path: str):
+    """Ventes d'un fichier de session : [(epoch, drink_id, quantité)]"""
+    sales = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                drink_id = int(row['drink_id'])
+                quantity = int(float(row['quantity']))
+            except (ValueError, KeyError, TypeError):
+                continue  # Ligne de résumé ou séparateur
+            stamp = _parse_time(row.get('timestamp'))
+            if stamp is not None and quantity > 0:
+                sales.append((stamp, drink_id, quantity))
+    return sales
+
+
+def load_history_events(path: str, include_buys: bool):
+    """
+    Événements de l'historique (segments archivés puis history.csv, lus sans rien modifier :
+    le serveur peut tourner à côté) : crash/boom (variation relative), reset et éventuellement achats
+    """
+    events = []
+    for row in iter_rows(path):
+        stamp = _parse_time(row.get('timestamp'))
+        event = row.get('event', '')
+        try:
+            drink_id = int(row['drink_id'])
+            price = float(row['price'])
+            change = float(row['change'])
+            quantity = int(float(row['quantity'] or 0))
+        except (ValueError, KeyError, TypeError):
+            continue
+        if stamp is None:
+            continue
+        if event.startswith(('crash_', 'boom_')):
+            before = price - change
+            if before > 0:
+                events.append((stamp, SCALE, drink_id, price / before))
+        elif event == 'reset':
+            events.append((stamp, RESET, drink_id, 0))
+        elif event == 'buy' and include_buys and quantity > 0:
+            events.append((stamp, BUY, drink_id, quantity))
+    return events
+
+
+def build_events(drinks, sales, history_events):
+    """Fusionne et trie les événements ; les boissons inconnues du catalogue sont ignorées"""
+    index = {drink_id: i for i, drink_id in enumerate(drinks['ids'])}
+    merged = [(stamp, BUY, drink_id, quantity) for stamp, drink_id, quantity in sales] + history_events
+    merged.sort(key=lambda e: e[0])
+    kinds, columns, values, stamps = [], [], [], []
+    for stamp, kind, drink_id, value in merged:
+        if drink_id not in index:
+            continue
+        kinds.append(kind)
+        columns.append(index[drink_id])
+        values.append(value)
+        stamps.append(stamp)
+    return {
+        'kind': np.array(kinds, dtype=np.int8),
+        'column': np.array(columns, dtype=np.int64),
+        'value': np.array(values, dtype=float),
+        'stamp': np.array(stamps, dtype=float),
+    }
+
+
+def make_model(model: str, params):
+    """Modèle `model` dont chaque paramètre est une colonne (jeux de paramètres x 1) ; ValueError si invalide"""
+    names = pricing.MODELS[model].defaults if model in pricing.MODELS else {}
+    return pricing.get_model(model, {name: np.array([[p[name]] for p in params]) for name in names if name in params[0]})
+
+
+def simulate(drinks, events, params, model: str = 'classic', mode: str = 'immediate', start: str = 'base',
+             path_points: int = 0):
+    """
+    Rejoue les événements pour toutes les combinaisons de `params` à la fois.
+    params: liste de dicts {'volatility', paramètres du modèle...}
+    Retourne un résultat par combinaison (CA, marge, prix finaux, extrêmes, trajectoires).
+    """
+    n_params = len(params)
+    volatility = np.array([p['volatility'] for p in params])[:, None]
+    pricing_model = make_model(model, params)
+    base, lo, hi = drinks['base'], drinks['min'], drinks['max']
+    immediate = mode == 'immediate'
+
+    prices = np.tile(drinks['price'] if start == 'current' else base, (n_params, 1))
+    state = MarketState(prices, base, lo, hi, np.zeros(len(base)))
+    quantities = np.zeros(len(base))
+    revenue = np.zeros(n_params)
+    margin = np.zeros(n_params)
+    units = 0
+    low_seen = prices.copy()
+    high_seen = prices.copy()
+
+    n_events = len(events['kind'])
+    record_every = max(1, n_events // path_points) if path_points else 0
+    paths = []
+
+    for k in range(n_events):
+        kind = events['kind'][k]
+        i = events['column'][k]
+        if kind == BUY:
+            quantity = events['value'][k]
+            # Le client paie le prix affiché (arrondi aux 10 centimes) avant la hausse
+            charged = np.round(prices[:, i] * 10) / 10
+            revenue += charged * quantity
+            margin += (charged - base[i]) * quantity
+            units += quantity
+
+            quantities[i] = quantity
+            state.price = prices
+            prices = pricing_model.step(state, quantities, volatility, immediate)
+            quantities[i] = 0
+            state.sold[i] += quantity
+        elif kind == SCALE:
+            prices[:, i] = np.clip(prices[:, i] * events['value'][k], lo[i], hi[i])
+        else:
+            prices[:, i] = base[i]
+
+        np.minimum(low_seen, prices, out=low_seen)
+        np.maximum(high_seen, prices, out=high_seen)
+        if record_every and k % record_every == 0:
+            paths.append((events['stamp'][k], prices.copy()))
+
+    results = []
+    for p, param in enumerate(params):
+        result = {
+            'model': model,
+            **param,
+            'revenue': round(float(revenue[p]), 2),
+            'margin': round(float(margin[p]), 2),
+            'units': int(units),
+            'final_prices': {name: round(float(v), 3) for name, v in zip(drinks['names'], prices[p])},
+            'price_range': {name: [round(float(a), 3), round(float(b), 3)]
+                            for name, a, b in zip(drinks['names'], low_seen[p], high_seen[p])},
+        }
+        if path_points:
+            result['paths'] = {name: [[int(stamp * 1000), round(float(snapshot[p, j]), 3)] for stamp, snapshot in paths]
+                               for j, name in enumerate(drinks['names'])}
+        results.append(result)
+    return results
+
+
+def _simulate_chunk(args):
+    return simulate(*args)
+
+
+def run(drinks, events, grid, model='classic', mode='immediate', start='base', workers: int = 1, path_points: int = 0):
+    """Répartit la grille de paramètres sur `workers` processus (1 = dans ce processus)"""
+    if workers <= 1 or len(grid) < 2:
+        return simulate(drinks, events, grid, model, mode, start, path_points)
+    chunks = [grid[i::workers] for i in range(workers) if grid[i::workers]]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        parts = pool.map(_simulate_chunk, [(drinks, events, chunk, model, mode, start, path_points) for chunk in chunks])
+    return [result for part in parts for result in part]
+
+
+def _parse_list(value, cast=float):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def parameter_grid(model: str, volatilities, overrides):
+    """
+    Grille volatilité x paramètres du modèle ; `overrides` : ["nom=v1,v2", ...] (--param),
+    les paramètres non précisés gardent leur valeur par défaut. ValueError si invalide.
+    """
+    if model not in pricing.MODELS:
+        pricing.get_model(model)  # Message d'erreur avec les modèles disponibles
+    values = {name: [default] for name, default in pricing.MODELS[model].defaults.items()}
+    for override in overrides:
+        name, _, listed = override.partition('=')
+        if name.strip() not in values:
+            raise ValueError(f"Paramètre inconnu pour {model}: {name} (paramètres: {', '.join(values)})")
+        values[name.strip()] = _parse_list(listed)
+    grid = [{'volatility': v, **dict(zip(values, combination))}
+            for v in volatilities for combination in itertools.product(*values.values())]
+    make_model(model, grid)  # Bornes vérifiées avant de lancer la simulation
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rejeu d'une soirée et comparaison de réglages du marché")
+    parser.add_argument("--data-dir", default="data", help="Répertoire des données (drinks.csv, history.csv, sessions)")
+    parser.add_argument("--session", action="append", default=None,
+                        help="Fichier de session à rejouer (répétable) ; défaut : toutes les sessions du répertoire")
+    parser.add_argument("--history-buys", action="store_true",
+                        help="Rejouer aussi les achats de history.csv (utile sans fichier de session)")
+    parser.add_argument("--volatility", default=",".join(map(str, DEFAULT_VOLATILITY)), help="Volatilités à tester")
+    parser.add_argument("--model", default="classic", choices=sorted(pricing.MODELS), help="Modèle de prix (voir pricing.py)")
+    parser.add_argument("--param", action="append", default=[], metavar="NOM=V1,V2",
+                        help="Valeurs à tester pour un paramètre du modèle (répétable) ; défaut du modèle sinon")
+    parser.add_argument("--mode", choices=["immediate", "market"], default="immediate")
+    parser.add_argument("--start", choices=["base", "current"], default="base",
+                        help="Prix de départ : prix de base ou prix actuels de drinks.csv")
+    parser.add_argument("--workers", type=int, default=1, help="Processus pour évaluer la grille en parallèle")
+    parser.add_argument("--paths", type=int, default=0, help="Points de trajectoire de prix à inclure par réglage")
+    parser.add_argument("--output", default=None, help="Fichier où écrire le rapport JSON")
+    args = parser.parse_args()
+
+    drinks = load_drinks(os.path.join(args.data_dir, "drinks.csv"))
+    session_files = args.session if args.session is not None else sorted(
+        glob.glob(os.path.join(args.data_dir, "session_*.csv")))
+    sales = [sale for path in session_files for sale in load_session_sales(path)]
+    history_events = load_history_events(os.path.join(args.data_dir, "history.csv"),
+                                         include_buys=args.history_buys or not sales)
+    events = build_events(drinks, sales, history_events)
+
+    try:
+        grid = parameter_grid(args.model, _parse_list(args.volatility), args.param)
+    except ValueError as e:
+        parser.error(str(e))
+    names = list(pricing.MODELS[args.model].defaults)
+
+    started = time.perf_counter()
+    results = run(drinks, events, grid, args.model, args.mode, args.start, args.workers, args.paths)
+    elapsed = time.perf_counter() - started
+    results.sort(key=lambda r: r['revenue'], reverse=True)
+
+    print(f"{len(events['kind'])} événements ({len(sales)} ventes de {len(session_files)} session(s)), "
+          f"{len(grid)} réglages en {elapsed:.2f} s")
+    print(f"modèle {args.model}")
+    print(f"{'volatilité':>10} " + ' '.join(f"{name:>11}" for name in names) + f" {'CA (€)':>10} {'marge (€)':>10}")
+    for r in results:
+        print(f"{r['volatility']:>10g} " + ' '.join(f"{r[name]:>11g}" for name in names)
+              + f" {r['revenue']:>10.2f} {r['margin']:>10.2f}")
+
+    if args.output:
+        report = {
+            'model': args.model,
+            'mode': args.mode,
+            'start': args.start,
+            'events': int(len(events['kind'])),
+            'sales': len(sales),
+            'sessions': session_files,
+            'elapsed_s': round(elapsed, 3),
+            'results': results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Micro-benchmarks de la couche de données (CSVDataManager).
+
+Chaque opération est mesurée sur un jeu de données temporaire, paramétré par la taille
+du catalogue de boissons et la longueur de l'historique. Les résultats peuvent être
+enregistrés comme référence puis comparés pour repérer les régressions.
+
+Exemples :
+    python bench.py run                                  # affiche les mesures
+    python bench.py save --baseline bench_baseline.json  # enregistre la référence
+    python bench.py compare --threshold 0.2              # compare à la référence (code 1 si régression)
+    python bench.py run --sizes 10,100 --history 50 --ops get_all_prices,apply_buy
+    python bench.py startup --runs 5                     # démarrage à froid du serveur (processus neufs)
+
+apply_buy et trigger_crash ajoutent une ligne au journal puis réécrivent drinks.csv une seule
+fois par appel : leur coût croît linéairement avec la taille du catalogue.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from csv_data import CSVDataManager
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+DEFAULT_HISTORY = [50, 5000]
+DEFAULT_BASELINE = "bench_baseline.json"
+
+
+def build_dataset(data_dir: str, n_drinks: int, history_len: int) -> CSVDataManager:
+    """Crée un catalogue de n_drinks boissons et un historique de history_len lignes"""
+    os.makedirs(data_dir, exist_ok=True)
+    rng = random.Random(42)
+    with open(os.path.join(data_dir, "drinks.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "price", "base_price", "min_price", "max_price", "alcohol_degree"])
+        for drink_id in range(1, n_drinks + 1):
+            base = round(rng.uniform(2.0, 10.0), 2)
+            writer.writerow([drink_id, f"Boisson {drink_id}", base, base, round(base * 0.6, 2), round(base * 2, 2),
+                             round(rng.uniform(0, 12), 1)])
+
+    manager = CSVDataManager(data_dir)
+    start = datetime.now() - timedelta(seconds=history_len)
+    with open(manager.history_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(manager.history_fieldnames)
+        for i in range(history_len):
+            drink_id = rng.randint(1, n_drinks)
+            writer.writerow([i + 1, 1000 + i, drink_id, f"Boisson {drink_id}", 5.0, 1, 0.05, "buy",
+                             (start + timedelta(seconds=i)).isoformat()])
+    return manager
+
+
+# Chaque opération : (préparation hors chrono ou None, fonction mesurée)
+def _op_get_all_prices(manager, n):
+    return None, manager.get_all_prices
+
+
+def _op_get_drink_by_id(manager, n):
+    ids = list(range(1, n + 1))
+    return None, lambda: manager.get_drink_by_id(random.choice(ids))
+
+
+def _op_apply_buy(manager, n):
+    return None, lambda: manager.apply_buy(random.randint(1, n), 1)
+
+
+def _op_apply_buy_simple(manager, n):
+    return None, lambda: manager.apply_buy_simple(random.randint(1, n), 1)
+
+
+def _op_trigger_crash(manager, n):
+    # Prix de base remis hors chrono : sans cela, après quelques crashs tout est au minimum
+    # et les itérations suivantes ne changent plus aucun prix
+    def setup():
+        manager.reset_prices()
+    return setup, lambda: manager.trigger_crash("small")
+
+
+def _op_add_history_entry(manager, n):
+    return None, lambda: manager.add_history_entry(1, "Boisson 1", 5.0, 1, 0.05, "buy",
+                                                   int(time.time() * 1000))
+
+
+def _op_get_history(manager, n):
+    return None, lambda: manager.get_history(limit=50)
+
+
+def _op_undo_last_transaction(manager, n):
+    # Chaque annulation a besoin d'un vrai achat (pile d'annulation comprise), fait hors chrono
+    def setup():
+        manager.apply_buy(1, 1)
+    return setup, manager.undo_last_transaction
+
+
+OPERATIONS = {
+    "get_all_prices": _op_get_all_prices,
+    "get_drink_by_id": _op_get_drink_by_id,
+    "apply_buy": _op_apply_buy,
+    "apply_buy_simple": _op_apply_buy_simple,
+    "trigger_crash": _op_trigger_crash,
+    "add_history_entry": _op_add_history_entry,
+    "get_history": _op_get_history,
+    "undo_last_transaction": _op_undo_last_transaction,
+}
+
+
+def bench_key(op: str, n_drinks: int, history_len: int) -> str:
+    return f"{op}[drinks={n_drinks},history={history_len}]"
+
+
+def measure(setup, func, budget_s: float, min_iter: int, max_iter: int) -> dict:
+    """Répète func jusqu'à épuiser le budget de temps (au moins min_iter fois)"""
+    timings = []
+    spent = 0.0
+    while len(timings) < max_iter and (len(timings) < min_iter or spent < budget_s):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        spent += elapsed
+        # Une seule itération dépasse déjà le budget : inutile d'insister
+        if elapsed > budget_s:
+            break
+    return {
+        "median_us": round(statistics.median(timings) * 1e6, 1),
+        "min_us": round(min(timings) * 1e6, 1),
+        "iterations": len(timings),
+    }
+
+
+def run_suite(sizes, history_lengths, ops, budget_s=0.5, min_iter=3, max_iter=500, verbose=True) -> dict:
+    random.seed(1234)
+    results = {}
+    for n_drinks in sizes:
+        for history_len in history_lengths:
+            for op in ops:
+                workdir = tempfile.mkdtemp(prefix="biere_bench_")
+                try:
+                    manager = build_dataset(os.path.join(workdir, "data"), n_drinks, history_len)
+                    setup, func = OPERATIONS[op](manager, n_drinks)
+                    stats = measure(setup, func, budget_s, min_iter, max_iter)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                key = bench_key(op, n_drinks, history_len)
+                results[key] = {"op": op, "drinks": n_drinks, "history": history_len, **stats}
+                if verbose:
+                    print(f"{key:<55} médiane {stats['median_us']:>12.1f} µs  ({stats['iterations']} itérations)",
+                          file=sys.stderr)
+    return results
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "date": datetime.now().isoformat(),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float, metric: str = "min_us") -> dict:
+    """Compare une métrique (min par défaut, moins bruitée) ; ratio > 1 + threshold = régression"""
+    lines = []
+    regressions = 0
+    for key, ref in baseline.items():
+        now = current.get(key)
+        if now is None:
+            continue
+        ratio = now[metric] / ref[metric] if ref[metric] else float("inf")
+        if ratio > 1 + threshold:
+            verdict = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            verdict = "amélioration"
+        else:
+            verdict = "stable"
+        lines.append({"benchmark": key, "baseline_us": ref[metric], "current_us": now[metric],
+                      "ratio": round(ratio, 3), "verdict": verdict})
+    return {"threshold": threshold, "metric": metric, "regressions": regressions, "comparisons": lines}
+
+
+# Exécuté dans un processus neuf : import du serveur, lifespan, premier chargement de la page admin
+_STARTUP_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import server
+from fastapi.testclient import TestClient
+t1 = time.perf_counter()
+with TestClient(server.app) as client:
+    t2 = time.perf_counter()
+    status = client.get('/admin/initial-data', auth=(server.ADMIN_USERNAME, server.ADMIN_PASSWORD)).status_code
+    t3 = time.perf_counter()
+print(json.dumps({'status': status, 'import_ms': (t1 - t0) * 1000, 'lifespan_ms': (t2 - t1) * 1000,
+                  'first_admin_ms': (t3 - t2) * 1000, 'startup_ms': server.startup_seconds * 1000}))
+"""
+
+
+def measure_startup(n_drinks: int, history_len: int, runs: int = 5, verbose=True) -> dict:
+    """Démarrage à froid, en millisecondes (min et médiane sur `runs` processus)"""
+    samples = {}
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as tmp:
+        build_dataset(os.path.join(tmp, "data"), n_drinks, history_len)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)),
+                   BIERE_LOG_FILE=os.path.join(tmp, "server.log"))
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT], cwd=tmp, env=env,
+                                 capture_output=True, text=True, check=True).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            for key, value in result.items():
+                if key.endswith("_ms"):
+                    samples.setdefault(key, []).append(value)
+    results = {key: {"min_ms": round(min(values), 1), "median_ms": round(statistics.median(values), 1)}
+               for key, values in samples.items()}
+    if verbose:
+        print("  ".join(f"{key} {r['median_ms']:.0f}" for key, r in results.items()), file=sys.stderr)
+    return {"drinks": n_drinks, "history": history_len, "runs": runs, "results": results}
+
+
+def _parse_list(value, cast=int):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de CSVDataManager")
+    parser.add_argument("command", choices=["run", "save", "compare", "startup"])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Tailles de catalogue, séparées par des virgules")
+    parser.add_argument("--history", default=",".join(map(str, DEFAULT_HISTORY)),
+                        help="Longueurs d'historique, séparées par des virgules")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="Opérations à mesurer")
+    parser.add_argument("--budget", type=float, default=0.5, help="Temps de mesure par benchmark (s)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Fichier de référence")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Écart relatif toléré avant régression")
+    parser.add_argument("--metric", choices=["min_us", "median_us"], default="min_us",
+                        help="Mesure comparée à la référence")
+    parser.add_argument("--runs", type=int, default=5, help="Processus lancés pour la mesure du démarrage")
+    parser.add_argument("--output", default=None, help="Écrire aussi le résultat JSON dans ce fichier")
+    args = parser.parse_args()
+
+    ops = _parse_list(args.ops, str)
+    unknown = [op for op in ops if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"Opérations inconnues : {', '.join(unknown)}")
+
+    if args.command == "startup":
+        # Plus petit catalogue et plus long historique demandés
+        output = {"environment": environment(),
+                  **measure_startup(min(_parse_list(args.sizes)), max(_parse_list(args.history)), args.runs)}
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        # Rejouer exactement la matrice de la référence (filtrée par --ops)
+        sizes = sorted({r["drinks"] for r in baseline.values()})
+        history_lengths = sorted({r["history"] for r in baseline.values()})
+        ops = [op for op in ops if any(r["op"] == op for r in baseline.values())]
+        current = run_suite(sizes, history_lengths, ops, budget_s=args.budget)
+        output = {"environment": environment(), **compare(baseline, current, args.threshold, args.metric)}
+    else:
+        results = run_suite(_parse_list(args.sizes), _parse_list(args.history), ops, budget_s=args.budget)
+        output = {"environment": environment(), "results": results}
+        if args.command == "save":
+            with open(args.baseline, "w", encoding="utf-8") as f:
+                json.dump(output, f, indent=2, ensure_ascii=False)
+            print(f"Référence enregistrée dans {args.baseline}", file=sys.stderr)
+
+    text = json.dumps(output, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    if args.command == "compare" and output["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
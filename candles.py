@@ -0,0 +1,166 @@
+"""
+Bougies OHLC (open/high/low/close/volume) maintenues côté serveur.
+
+Chaque changement de prix met à jour en O(1) la bougie en cours de chaque résolution
+(1, 5 et 15 minutes par défaut). Quand un prix tombe dans une nouvelle période, la
+bougie précédente est close : elle rejoint la liste des bougies de la soirée (en
+mémoire) et la file d'écriture vers candles.csv (flush() par lots, comme PriceStore).
+
+L'ouverture d'une bougie reprend la clôture de la précédente, pour que les bougies
+s'enchaînent sans trou même quand le prix ne bouge qu'une fois par période.
+"""
+import csv
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from iostats import tracked_open
+from logs import get_logger
+
+log = get_logger('candles')
+
+DEFAULT_RESOLUTIONS = (60, 300, 900)
+FIELDNAMES = ['drink_id', 'resolution', 'start', 'open', 'high', 'low', 'close', 'volume']
+
+
+class CandleStore:
+    def __init__(self, path: str, resolutions=DEFAULT_RESOLUTIONS, retention_hours: float = 24.0):
+        self.path = path
+        self.resolutions = tuple(resolutions)
+        self.retention_seconds = retention_hours * 3600
+        # Bougie en cours : [début, open, high, low, close, volume]
+        self._current: Dict[Tuple[int, int], List] = {}
+        # Bougies closes, triées par début ; `_starts` sert à la recherche dichotomique
+        self._closed: Dict[Tuple[int, int], List[Tuple]] = {}
+        self._starts: Dict[Tuple[int, int], List[float]] = {}
+        self._pending: List[Tuple] = []
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Recharge les bougies closes de la fenêtre de rétention"""
+        with self._lock:
+            self._current.clear()
+            self._closed.clear()
+            self._starts.clear()
+            if not os.path.exists(self.path):
+                return
+            cutoff = time.time() - self.retention_seconds
+            count = 0
+            try:
+                with tracked_open(self.path, 'r', encoding='utf-8') as f:
+                    for row in csv.DictReader(f):
+                        try:
+                            key = (int(row['drink_id']), int(row['resolution']))
+                            candle = (float(row['start']), float(row['open']), float(row['high']),
+                                      float(row['low']), float(row['close']), int(row['volume']))
+                        except (ValueError, KeyError, TypeError):
+                            continue
+                        if candle[0] < cutoff or key[1] not in self.resolutions:
+                            continue
+                        self._append_closed(key, candle)
+                        count += 1
+            except OSError as e:
+                log.error("Erreur lors du chargement des bougies: %s", e)
+                return
+            log.info("Bougies chargées: %s", count)
+
+    def update(self, drink_id: int, price: float, quantity: int = 0, stamp: Optional[float] = None):
+        """Intègre un nouveau prix (et le volume vendu) dans la bougie en cours de chaque résolution"""
+        stamp = time.time() if stamp is None else stamp
+        price = float(price)
+        with self._lock:
+            for resolution in self.resolutions:
+                key = (drink_id, resolution)
+                start = stamp - stamp % resolution
+                candle = self._current.get(key)
+                if candle is not None and start < candle[0]:
+                    # Prix horodaté dans une période déjà close (horloge qui recule) : bougie en cours
+                    start = candle[0]
+                if candle is None and self._starts.get(key) and self._starts[key][-1] == start:
+                    # Bougie écrite à l'arrêt du serveur : on la reprend là où elle en était
+                    self._starts[key].pop()
+                    candle = self._current[key] = list(self._closed[key].pop())
+                if candle is None or start != candle[0]:
+                    previous_close = price
+                    if candle is not None:
+                        self._close(key, candle)
+                        previous_close = candle[4]
+                    elif self._closed.get(key):
+                        previous_close = self._closed[key][-1][4]
+                    candle = self._current[key] = [start, previous_close, max(previous_close, price),
+                                                   min(previous_close, price), price, 0]
+                else:
+                    if price > candle[2]:
+                        candle[2] = price
+                    if price < candle[3]:
+                        candle[3] = price
+                    candle[4] = price
+                candle[5] = max(0, candle[5] + int(quantity))  # Négatif : achat annulé
+
+    def flush(self, include_current: bool = False) -> int:
+        """
+        Écrit les bougies closes en attente en un seul ajout.
+        include_current=True (arrêt du serveur) écrit aussi les bougies en cours.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if include_current:
+                pending += [(key[0], key[1], f'{candle[0]:.0f}', *candle[1:]) for key, candle in self._current.items()]
+            if not pending:
+                return 0
+            try:
+                is_new = not os.path.exists(self.path)
+                with tracked_open(self.path, 'a', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    if is_new:
+                        writer.writerow(FIELDNAMES)
+                    writer.writerows(pending)
+            except OSError as e:
+                self._pending = pending + self._pending
+                log.error("Erreur lors de la sauvegarde des bougies: %s", e)
+                return 0
+            return len(pending)
+
+    def drink_ids(self) -> List[int]:
+        with self._lock:
+            return sorted({drink_id for drink_id, _ in self._current} | {drink_id for drink_id, _ in self._closed})
+
+    def query(self, drink_id: int, resolution: int, start: Optional[float] = None, end: Optional[float] = None,
+              limit: Optional[int] = None) -> List[Tuple]:
+        """Bougies (closes puis en cours) dont le début est dans [start, end], les `limit` dernières"""
+        key = (drink_id, resolution)
+        with self._lock:
+            closed = self._closed.get(key, [])
+            starts = self._starts.get(key, [])
+            lo = 0 if start is None else bisect_left(starts, start - resolution + 1e-9)
+            hi = len(closed) if end is None else bisect_right(starts, end)
+            candles = closed[lo:hi]
+            current = self._current.get(key)
+            if current is not None and (start is None or current[0] + resolution > start) \
+                    and (end is None or current[0] <= end):
+                candles.append(tuple(current))
+        if limit:
+            candles = candles[-limit:]
+        return candles
+
+    def _close(self, key: Tuple[int, int], candle: List):
+        closed = tuple(candle)
+        self._append_closed(key, closed)
+        self._pending.append((key[0], key[1], f'{closed[0]:.0f}', *closed[1:]))
+
+    def _append_closed(self, key: Tuple[int, int], candle: Tuple):
+        closed = self._closed.setdefault(key, [])
+        starts = self._starts.setdefault(key, [])
+        if not starts or candle[0] > starts[-1]:
+            closed.append(candle)
+            starts.append(candle[0])
+        else:
+            index = bisect_left(starts, candle[0])
+            if index < len(starts) and starts[index] == candle[0]:
+                closed[index] = candle
+            else:
+                closed.insert(index, candle)
+                starts.insert(index, candle[0])
@@ -1285,6 +1285,27 @@ async function undoTransaction() {
     }
 }
 
+async function redoTransaction() {
+    try {
+        const res = await fetch(`${API_BASE}/admin/history/redo`, {
+            method: 'POST',
+            headers: { 'Authorization': 'Basic ' + authToken }
+        });
+
+        if (res.ok) {
+            const data = await res.json();
+            showMessage('history-message', `✅ Transaction pour ${data.details.drink_name || ''} rétablie.`, 'success');
+            await loadHistory();
+            await updatePurchaseTablePricesFromAPI();
+        } else {
+            const err = await res.json();
+            showMessage('history-message', `Erreur: ${err.detail}`, 'error');
+        }
+    } catch (e) {
+        showMessage('history-message', 'Erreur réseau lors du rétablissement.', 'error');
+    }
+}
+
 // Mettre à jour le prix d'une boisson
 async function updatePrice(drinkId) {
     const priceInput = document.getElementById(`price-${drinkId}`);
@@ -1427,6 +1448,7 @@ function updateConnectionStatus(connected) {
 function initCharts() {
   if (typeof WallStreetCharts !== 'undefined') {
     wallStreetCharts = new WallStreetCharts();
+    wallStreetCharts.loadHistoryFromServer();
   }
 }
 
@@ -1820,16 +1842,89 @@ function populatePurchaseTablePrices(drinks) {
     setTimeout(() => cleanupPriceDisplay(), 100);
 }
 
+// ===========================================
+// VENTES HORS LIGNE (coupure Wi-Fi)
+// ===========================================
+
+const OFFLINE_SALES_KEY = 'offline-sales-queue';
+let offlineFlushInProgress = false;
+
+// Clé d'idempotence générée par la tablette : un renvoi de la même vente n'est compté qu'une fois
+function newIdempotencyKey() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+        return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+function readOfflineSales() {
+    try {
+        return JSON.parse(localStorage.getItem(OFFLINE_SALES_KEY)) || [];
+    } catch (e) {
+        return [];
+    }
+}
+
+function queueOfflineSale(sale) {
+    const queue = readOfflineSales();
+    queue.push(sale);
+    localStorage.setItem(OFFLINE_SALES_KEY, JSON.stringify(queue));
+    return queue.length;
+}
+
+// Rejouer toutes les ventes en attente en un seul appel à /buy/batch
+async function flushOfflineSales() {
+    const queue = readOfflineSales();
+    if (queue.length === 0 || offlineFlushInProgress) return;
+    offlineFlushInProgress = true;
+
+    try {
+        const response = await fetch(`${API_BASE}/buy/batch`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ sales: queue })
+        });
+        if (!response.ok) return;
+
+        const result = await response.json();
+        // Retirer de la file les ventes envoyées (celles ajoutées entre-temps restent en attente)
+        const sentKeys = new Set(queue.map(sale => sale.idempotency_key));
+        const remaining = readOfflineSales().filter(sale => !sentKeys.has(sale.idempotency_key));
+        localStorage.setItem(OFFLINE_SALES_KEY, JSON.stringify(remaining));
+
+        showMessage('buy-message', `📶 ${result.applied} vente(s) hors ligne synchronisée(s)` +
+            (result.errors ? ` - ${result.errors} en erreur` : ''), result.errors ? 'error' : 'success');
+        await updatePurchaseTablePricesFromAPI();
+        await loadHistory();
+        localStorage.setItem('purchaseUpdate', Date.now());
+    } catch (error) {
+        console.warn('Synchronisation des ventes hors ligne impossible, nouvel essai plus tard', error);
+    } finally {
+        offlineFlushInProgress = false;
+    }
+}
+
+window.addEventListener('online', flushOfflineSales);
+setInterval(flushOfflineSales, 15000);
+
 // Fonction pour enregistrer un achat
 async function recordPurchase(drinkId, drinkName, drinkPrice) {
     // Sauvegarder la position de scroll avant l'achat
     const scrollPosition = window.pageYOffset || document.documentElement.scrollTop;
+    const sale = {
+        drink_id: drinkId,
+        quantity: 1,
+        timestamp: new Date().toISOString(),
+        idempotency_key: newIdempotencyKey(),
+        unit_price: Math.round(drinkPrice * 10) / 10
+    };
     
     try {
         const response = await fetch(`${API_BASE}/buy`, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': sale.idempotency_key
             },
             body: JSON.stringify({
                 drink_id: drinkId,
@@ -1839,6 +1934,7 @@ async function recordPurchase(drinkId, drinkName, drinkPrice) {
 
         if (response.ok) {
             const result = await response.json();
+            flushOfflineSales();
             showMessage('buy-message', `✅ Achat enregistré: ${drinkName} - ${drinkPrice.toFixed(2)}€`, 'success');
             
             // Mettre à jour seulement les prix dans le tableau (sans recharger tout)
@@ -1863,8 +1959,10 @@ async function recordPurchase(drinkId, drinkName, drinkPrice) {
         }
         
     } catch (error) {
+        // Réseau indisponible : garder la vente pour la rejouer dès le retour de la connexion
         console.error('Erreur lors de l\'enregistrement de l\'achat:', error);
-        showMessage('buy-message', '❌ Erreur de connexion lors de l\'achat', 'error');
+        const pending = queueOfflineSale(sale);
+        showMessage('buy-message', `📴 Hors ligne : ${drinkName} mis en attente (${pending} vente(s) à synchroniser)`, 'error');
     }
 }
 
@@ -10,6 +10,9 @@ const API_CONFIG = {
     timeout: 10000
 };
 
+// Les prix sont demandés en MessagePack (plus compact), le serveur répond en JSON s'il ne le gère pas
+const BINARY_FETCH_OPTIONS = { headers: { 'Accept': MsgPack.ACCEPT } };
+
 // Throttling pour les animations
 let animationQueue = [];
 let isAnimating = false;
@@ -209,6 +212,50 @@ const drinkPriceHistory = new Map();
 // Mapping des boissons vers leurs couleurs
 const drinkColorMap = new Map();
 
+// Nombre de points demandés au serveur par boisson (les graphiques en gardent 10)
+const SERVER_HISTORY_POINTS = 10;
+let serverHistoryLoaded = false;
+
+// Bougies OHLC maintenues par le serveur, par boisson : {x, o, h, l, c}
+const serverCandles = new Map();
+const SERVER_CANDLE_RESOLUTION = '1m';
+const SERVER_CANDLE_LIMIT = 10;
+
+// Une seule requête pour les bougies de toutes les boissons
+async function loadServerCandles() {
+    try {
+        const response = await fetchWithRetry(`/prices/candles?resolution=${SERVER_CANDLE_RESOLUTION}&limit=${SERVER_CANDLE_LIMIT}`, BINARY_FETCH_OPTIONS);
+        if (!response.ok) return;
+        const data = await MsgPack.readResponse(response);
+        (data.series || []).forEach(series => {
+            serverCandles.set(series.drink_id, series.candles.map(([x, o, h, l, c]) => ({ x, o, h, l, c })));
+        });
+    } catch (error) {
+        console.warn('⚠️ Bougies serveur indisponibles, reconstruction locale:', error);
+    }
+}
+
+// Pré-remplir l'historique des graphiques avec les prix enregistrés par le serveur,
+// pour qu'un écran rechargé en cours de soirée ne reparte pas de zéro
+async function loadPriceHistoryFromServer() {
+    serverHistoryLoaded = true;
+    try {
+        const response = await fetchWithRetry(`/prices/history?points=${SERVER_HISTORY_POINTS}`, BINARY_FETCH_OPTIONS);
+        if (!response.ok) return;
+        const data = await MsgPack.readResponse(response);
+        (data.series || []).forEach(series => {
+            if (!series.points || series.points.length === 0 || drinkPriceHistory.has(series.drink_id)) return;
+            // Même convention que les graphiques : timestamps en mode immédiat, index sinon
+            drinkPriceHistory.set(series.drink_id, series.points.map(([t, price], index) => ({
+                x: isImmediateMode() ? t : index,
+                y: price
+            })));
+        });
+    } catch (error) {
+        console.warn('⚠️ Historique des prix indisponible, graphiques démarrés à vide:', error);
+    }
+}
+
 // Nettoyage automatique toutes les 10 minutes pour éviter l'accumulation
 setInterval(() => {
     cleanupCache();
@@ -797,6 +844,11 @@ async function fetchPrices() {
     
     isRefreshing = true;
     try {
+        // Au premier chargement, reprendre l'historique de la soirée depuis le serveur
+        if (!serverHistoryLoaded) {
+            await loadPriceHistoryFromServer();
+        }
+
         // Créer les graphiques des nouvelles boissons ajoutées au cycle précédent
         if (pendingNewDrinks.length > 0) {
             console.log(`📊 Création des graphiques pour ${pendingNewDrinks.length} nouvelle(s) boisson(s)`);
@@ -811,15 +863,16 @@ async function fetchPrices() {
             pendingNewDrinks = [];
         }
         
-        // Récupérer les prix et les Happy Hours en parallèle avec retry
+        // Récupérer les prix, les Happy Hours (et les bougies serveur) en parallèle avec retry
         const [pricesRes, happyHoursRes] = await Promise.all([
-            fetchWithRetry(`${API_BASE}/prices`),
-            fetchWithRetry(`${API_BASE}/happy-hour/active`)
+            fetchWithRetry(`${API_BASE}/prices`, BINARY_FETCH_OPTIONS),
+            fetchWithRetry(`${API_BASE}/happy-hour/active`),
+            currentChartType === 'candlestick' ? loadServerCandles() : Promise.resolve()
         ]);
         
         if (!pricesRes.ok) throw new Error(`HTTP ${pricesRes.status}`);
         
-        const data = await pricesRes.json();
+        const data = await MsgPack.readResponse(pricesRes);
         
         // Mettre à jour les données de synchronisation timer si disponibles
         if (data.timer_remaining_ms !== undefined) {
@@ -940,12 +993,12 @@ async function refreshDrinkDisplay(drinkId) {
     try {
         // Récupérer les données actualisées
         const [pricesRes, happyHoursRes] = await Promise.all([
-            fetch('/prices'),
+            fetch('/prices', BINARY_FETCH_OPTIONS),
             fetch('/happy-hour/active')
         ]);
         
         if (pricesRes.ok && happyHoursRes.ok) {
-            const pricesData = await pricesRes.json();
+            const pricesData = await MsgPack.readResponse(pricesRes);
             const happyHoursData = await happyHoursRes.json();
             
             // Mettre à jour activeHappyHours
@@ -1409,102 +1462,109 @@ function createCandlestickChart(drink, canvas) {
     const timestamp = Date.now();
     const currentPrice = drink.price;
     
-    // Convertir les données linéaires en OHLC si nécessaire SANS PERDRE L'HISTORIQUE
     let ohlcHistory = [];
-    
-    if (history.length > 0 && history[0].y !== undefined) {
-        // Convertir les points simples en candlesticks en préservant les données
-        for (let i = 0; i < history.length; i++) {
-            const point = history[i];
-            const prevPrice = i > 0 ? history[i-1].y : point.y;
-            // Variation fixe basée sur l'ID de la boisson pour la cohérence
-            const variation = (drink.id % 10) * 0.01;
+    const candlesFromServer = serverCandles.get(drink.id);
+
+    if (candlesFromServer && candlesFromServer.length > 0) {
+        // Bougies calculées par le serveur (/prices/candles) : rien à reconstruire
+        ohlcHistory = candlesFromServer.map(candle => ({ ...candle }));
+    } else {
+        // Convertir les données linéaires en OHLC si nécessaire SANS PERDRE L'HISTORIQUE
+    
+        if (history.length > 0 && history[0].y !== undefined) {
+            // Convertir les points simples en candlesticks en préservant les données
+            for (let i = 0; i < history.length; i++) {
+                const point = history[i];
+                const prevPrice = i > 0 ? history[i-1].y : point.y;
+                // Variation fixe basée sur l'ID de la boisson pour la cohérence
+                const variation = (drink.id % 10) * 0.01;
             
-            ohlcHistory.push({
-                x: point.x,
-                o: prevPrice,
-                h: Math.max(prevPrice, point.y) + variation,
-                l: Math.min(prevPrice, point.y) - variation,
-                c: point.y
-            });
+                ohlcHistory.push({
+                    x: point.x,
+                    o: prevPrice,
+                    h: Math.max(prevPrice, point.y) + variation,
+                    l: Math.min(prevPrice, point.y) - variation,
+                    c: point.y
+                });
+            }
+        } else {
+            // Copier les données OHLC existantes
+            ohlcHistory = [...history];
         }
-    } else {
-        // Copier les données OHLC existantes
-        ohlcHistory = [...history];
-    }
     
-    // Si on a moins de points, créer des données aléatoires de départ SEULEMENT LA PREMIÈRE FOIS
-    if (ohlcHistory.length < 1) {
-        // Créer quelques candlesticks aléatoires de départ
-        const basePrice = currentPrice;
-        const numCandles = 3 + Math.floor(Math.random() * 5); // 3-7 bougies
+        // Si on a moins de points, créer des données aléatoires de départ SEULEMENT LA PREMIÈRE FOIS
+        if (ohlcHistory.length < 1) {
+            // Créer quelques candlesticks aléatoires de départ
+            const basePrice = currentPrice;
+            const numCandles = 3 + Math.floor(Math.random() * 5); // 3-7 bougies
         
-        for (let i = 0; i < numCandles; i++) {
-            // En mode manuel, utiliser des timestamps, sinon des index
-            const x = isImmediateMode() ? 
-                Date.now() - (numCandles - i) * 60000 + Math.random() * 10000 : // Timestamps espacés en mode manuel 
-                i; // Index simple en mode automatique
+            for (let i = 0; i < numCandles; i++) {
+                // En mode manuel, utiliser des timestamps, sinon des index
+                const x = isImmediateMode() ? 
+                    Date.now() - (numCandles - i) * 60000 + Math.random() * 10000 : // Timestamps espacés en mode manuel 
+                    i; // Index simple en mode automatique
             
-            // Variation aléatoire mais cohérente
-            const variation = (Math.random() - 0.5) * 0.3;
-            const open = Math.max(0.5, basePrice + variation * (i / numCandles));
-            const close = Math.max(0.5, basePrice + variation * ((i + 1) / numCandles));
-            const high = Math.max(open, close) + Math.random() * 0.1;
-            const low = Math.min(open, close) - Math.random() * 0.1;
+                // Variation aléatoire mais cohérente
+                const variation = (Math.random() - 0.5) * 0.3;
+                const open = Math.max(0.5, basePrice + variation * (i / numCandles));
+                const close = Math.max(0.5, basePrice + variation * ((i + 1) / numCandles));
+                const high = Math.max(open, close) + Math.random() * 0.1;
+                const low = Math.min(open, close) - Math.random() * 0.1;
             
+                ohlcHistory.push({
+                    x: x,
+                    o: Math.max(0.5, open),
+                    h: Math.max(0.5, high),
+                    l: Math.max(0.5, low),
+                    c: Math.max(0.5, close)
+                });
+            }
+        
+            // Sauvegarder immédiatement ces données initiales
+            drinkPriceHistory.set(drink.id, ohlcHistory);
+        }
+    
+        // Ajouter un nouveau candlestick SEULEMENT si le prix actuel est différent du dernier prix enregistré
+        const lastCandle = ohlcHistory[ohlcHistory.length - 1];
+        const lastRecordedPrice = lastCandle ? lastCandle.c : null;
+    
+        // Vérifier si c'est un vrai changement de prix ou juste un changement de mode
+        const isRealPriceChange = lastRecordedPrice === null || Math.abs(currentPrice - lastRecordedPrice) > 0.001;
+    
+        if (isRealPriceChange) {
+            // En mode manuel (timer = 0), utiliser un timestamp unique, sinon un index
+            const transactionIndex = isImmediateMode() ? 
+                Date.now() + Math.random() * 1000 : // Timestamp unique en mode manuel
+                (lastCandle ? lastCandle.x + 1 : 0); // Index séquentiel en mode automatique
+        
+            // Ajouter une nouvelle bougie car il y a eu une vraie transaction
+            const open = lastCandle ? lastCandle.c : currentPrice;
+            const variation = (Math.random() - 0.5) * 0.2;
+            const close = currentPrice;
+            const high = Math.max(open, close) + Math.random() * 0.05;
+            const low = Math.min(open, close) - Math.random() * 0.05;
+        
             ohlcHistory.push({
-                x: x,
+                x: transactionIndex,
                 o: Math.max(0.5, open),
                 h: Math.max(0.5, high),
                 l: Math.max(0.5, low),
                 c: Math.max(0.5, close)
             });
         }
-        
-        // Sauvegarder immédiatement ces données initiales
-        drinkPriceHistory.set(drink.id, ohlcHistory);
-    }
     
-    // Ajouter un nouveau candlestick SEULEMENT si le prix actuel est différent du dernier prix enregistré
-    const lastCandle = ohlcHistory[ohlcHistory.length - 1];
-    const lastRecordedPrice = lastCandle ? lastCandle.c : null;
-    
-    // Vérifier si c'est un vrai changement de prix ou juste un changement de mode
-    const isRealPriceChange = lastRecordedPrice === null || Math.abs(currentPrice - lastRecordedPrice) > 0.001;
+        // Garder seulement les 10 dernières bougies pour éviter les lags
+        if (ohlcHistory.length > 10) {
+            ohlcHistory.splice(0, ohlcHistory.length - 10);
+        }
     
-    if (isRealPriceChange) {
-        // En mode manuel (timer = 0), utiliser un timestamp unique, sinon un index
-        const transactionIndex = isImmediateMode() ? 
-            Date.now() + Math.random() * 1000 : // Timestamp unique en mode manuel
-            (lastCandle ? lastCandle.x + 1 : 0); // Index séquentiel en mode automatique
-        
-        // Ajouter une nouvelle bougie car il y a eu une vraie transaction
-        const open = lastCandle ? lastCandle.c : currentPrice;
-        const variation = (Math.random() - 0.5) * 0.2;
-        const close = currentPrice;
-        const high = Math.max(open, close) + Math.random() * 0.05;
-        const low = Math.min(open, close) - Math.random() * 0.05;
-        
-        ohlcHistory.push({
-            x: transactionIndex,
-            o: Math.max(0.5, open),
-            h: Math.max(0.5, high),
-            l: Math.max(0.5, low),
-            c: Math.max(0.5, close)
-        });
-    }
+        // Trier par timestamp
+        ohlcHistory.sort((a, b) => a.x - b.x);
     
-    // Garder seulement les 10 dernières bougies pour éviter les lags
-    if (ohlcHistory.length > 10) {
-        ohlcHistory.splice(0, ohlcHistory.length - 10);
+        // Sauvegarder l'historique au format OHLC (important pour préserver lors du changement de mode)
+        drinkPriceHistory.set(drink.id, ohlcHistory);
     }
     
-    // Trier par timestamp
-    ohlcHistory.sort((a, b) => a.x - b.x);
-    
-    // Sauvegarder l'historique au format OHLC (important pour préserver lors du changement de mode)
-    drinkPriceHistory.set(drink.id, ohlcHistory);
-    
     // Calculer le padding pour l'axe X pour éviter que les graphiques soient coupés
     const xValues = ohlcHistory.map(p => p.x);
     const minX = Math.min(...xValues);
@@ -268,6 +268,27 @@ class WallStreetCharts {
         this.priceChart.update('none'); // Pas d'animation pour éviter les scintillements
     }
 
+    // Charger une plage de l'historique des prix, déjà réduite côté serveur à maxDataPoints points
+    async loadHistoryFromServer(from = null, to = null) {
+        if (!this.priceChart) return;
+        const params = new URLSearchParams({ points: this.maxDataPoints });
+        if (from !== null) params.set('from', from);
+        if (to !== null) params.set('to', to);
+        try {
+            const response = await fetch(`/prices/history?${params}`);
+            if (!response.ok) return;
+            const data = await response.json();
+            this.priceHistory.clear();
+            (data.series || []).forEach(series => {
+                if (!series.name || !series.points.length) return;
+                this.priceHistory.set(series.name, series.points.map(([time, price]) => ({ time, price })));
+            });
+            this.updatePriceChart(null);
+        } catch (error) {
+            console.warn('Historique des prix indisponible:', error);
+        }
+    }
+
     updateVolumeChart(historyData) {
         const labels = [];
         const datasets = [];
@@ -0,0 +1,125 @@
+// File: msgpack.js
+/**
+ * Décodeur MessagePack minimal pour les réponses binaires du serveur
+ * (Accept: application/msgpack). Couvre les types produits par le serveur :
+ * nil, booléens, entiers, flottants, chaînes, binaires, tableaux, maps et
+ * l'extension "table" (wire.py) qui est redéveloppée en liste d'objets.
+ */
+
+const MsgPack = (() => {
+    const textDecoder = new TextDecoder('utf-8');
+    const TABLE_EXT = 1;
+
+    // [clés, lignes] -> [{clé: valeur}, ...]
+    function expandTable([keys, rows]) {
+        return rows.map(row => {
+            const item = {};
+            for (let i = 0; i < keys.length; i++) item[keys[i]] = row[i];
+            return item;
+        });
+    }
+
+    function decode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        let offset = 0;
+
+        function str(length) {
+            const value = textDecoder.decode(bytes.subarray(offset, offset + length));
+            offset += length;
+            return value;
+        }
+
+        function bin(length) {
+            const value = bytes.slice(offset, offset + length);
+            offset += length;
+            return value;
+        }
+
+        function array(length) {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) value[i] = read();
+            return value;
+        }
+
+        function ext(length) {
+            const type = view.getInt8(offset);
+            offset += 1;
+            const data = bytes.subarray(offset, offset + length);
+            offset += length;
+            if (type === TABLE_EXT) return expandTable(decode(data));
+            throw new Error(`MessagePack: extension ${type} non supportée`);
+        }
+
+        function map(length) {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        }
+
+        function read() {
+            const type = bytes[offset++];
+            if (type <= 0x7f) return type;                          // positive fixint
+            if (type <= 0x8f) return map(type & 0x0f);              // fixmap
+            if (type <= 0x9f) return array(type & 0x0f);            // fixarray
+            if (type <= 0xbf) return str(type & 0x1f);              // fixstr
+            if (type >= 0xe0) return type - 0x100;                  // negative fixint
+
+            let value;
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: value = view.getUint8(offset); offset += 1; return bin(value);
+                case 0xc5: value = view.getUint16(offset); offset += 2; return bin(value);
+                case 0xc6: value = view.getUint32(offset); offset += 4; return bin(value);
+                case 0xc7: value = view.getUint8(offset); offset += 1; return ext(value);
+                case 0xc8: value = view.getUint16(offset); offset += 2; return ext(value);
+                case 0xc9: value = view.getUint32(offset); offset += 4; return ext(value);
+                case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+                case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+                case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+                case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+                case 0xce: value = view.getUint32(offset); offset += 4; return value;
+                case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+                case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+                case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+                case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+                case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+                case 0xd4: return ext(1);
+                case 0xd5: return ext(2);
+                case 0xd6: return ext(4);
+                case 0xd7: return ext(8);
+                case 0xd8: return ext(16);
+                case 0xd9: value = view.getUint8(offset); offset += 1; return str(value);
+                case 0xda: value = view.getUint16(offset); offset += 2; return str(value);
+                case 0xdb: value = view.getUint32(offset); offset += 4; return str(value);
+                case 0xdc: value = view.getUint16(offset); offset += 2; return array(value);
+                case 0xdd: value = view.getUint32(offset); offset += 4; return array(value);
+                case 0xde: value = view.getUint16(offset); offset += 2; return map(value);
+                case 0xdf: value = view.getUint32(offset); offset += 4; return map(value);
+                default:
+                    throw new Error(`MessagePack: type 0x${type.toString(16)} non supporté`);
+            }
+        }
+
+        return read();
+    }
+
+    // En-tête Accept : MessagePack de préférence, JSON sinon (serveur sans msgpack)
+    const ACCEPT = 'application/msgpack, application/json;q=0.9';
+
+    // Lire une réponse fetch quel que soit le format renvoyé par le serveur
+    async function readResponse(response) {
+        const contentType = response.headers.get('content-type') || '';
+        if (contentType.includes('msgpack')) {
+            return decode(await response.arrayBuffer());
+        }
+        return response.json();
+    }
+
+    return { decode, readResponse, ACCEPT };
+})();
@@ -1,24 +1,145 @@
 import csv
+import functools
+import heapq
 import os
-import json
 from datetime import datetime
 from typing import List, Dict, Optional
 import random
+import threading
+import time
+from types import MappingProxyType
+import numpy as np
+from iostats import atomic_open, tracked_open
+from journal import Journal
+from history_store import HistoryStore
+from logs import get_logger, bind as bind_log_context
+from pricing import MarketState, get_model
+from undo import UndoLog
+
+log = get_logger('data')
+
+DRINK_FIELDNAMES = ['id', 'name', 'price', 'base_price', 'min_price', 'max_price', 'alcohol_degree']
+
+
+class Drink:
+    """Fiche d'une boisson : champs numériques convertis une seule fois, à la lecture de drinks.csv"""
+    __slots__ = tuple(DRINK_FIELDNAMES)
+
+    def __init__(self, id: int, name: str, price: float, base_price: float, min_price: float, max_price: float,
+                 alcohol_degree: float = 0.0):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.base_price = base_price
+        self.min_price = min_price
+        self.max_price = max_price
+        self.alcohol_degree = alcohol_degree
+
+    @classmethod
+    def from_row(cls, row: Dict) -> 'Drink':
+        """Ligne de csv.DictReader (ou du journal) -> Drink ; ValueError/KeyError si illisible"""
+        return cls(int(row['id']), row['name'], float(row['price']), float(row['base_price']),
+                   float(row['min_price']), float(row['max_price']),
+                   float(row.get('alcohol_degree') or 0))  # Degré d'alcool avec gestion des valeurs vides
+
+    def copy(self) -> 'Drink':
+        return Drink(self.id, self.name, self.price, self.base_price, self.min_price, self.max_price, self.alcohol_degree)
+
+    def as_row(self, fieldnames: List[str]) -> List:
+        """Valeurs dans l'ordre des colonnes, pour csv.writer"""
+        return [getattr(self, key) for key in fieldnames]
+
+    def as_record(self, fieldnames: List[str]) -> Dict[str, str]:
+        """Format texte de drinks.csv, pour le journal et l'instantané"""
+        return {key: str(getattr(self, key)) for key in fieldnames}
+
+
+class MarketSnapshot:
+    """
+    Carte du marché figée : fiches, colonnes de drinks.csv, heure du dernier prix de chaque
+    boisson (pour le retour au prix de base) et Happy Hours actives. Jamais modifiée une fois publiée, fiches comprises :
+    un écrivain construit la carte suivante à partir de copies et remplace la référence d'un coup.
+    Un lecteur qui garde une carte voit donc un marché cohérent, crash et boom compris.
+    """
+    __slots__ = ('version', 'drinks', 'by_id', 'fieldnames', 'file_stamp', 'price_stamps', 'default_price_stamp',
+                 'happy_hours')
+
+    def __init__(self, version: int, drinks: List[Drink], fieldnames: List[str], file_stamp,
+                 price_stamps: Dict[int, float], default_price_stamp: float, happy_hours: Dict[int, Dict]):
+        self.version = version
+        self.drinks = tuple(drinks)
+        self.by_id = MappingProxyType({drink.id: drink for drink in self.drinks})
+        self.fieldnames = tuple(fieldnames)
+        self.file_stamp = file_stamp
+        self.price_stamps = MappingProxyType(dict(price_stamps))
+        self.default_price_stamp = default_price_stamp
+        self.happy_hours = MappingProxyType(dict(happy_hours))
+
+
+def _writer(method):
+    """Méthode qui modifie le marché : un seul écrivain à la fois. Les lecteurs ne prennent jamais ce verrou."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class CSVDataManager:
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", fsync: bool = True):
         self.data_dir = data_dir
         self.drinks_file = os.path.join(data_dir, "drinks.csv")
         self.history_file = os.path.join(data_dir, "history.csv")
-        self.undone_file = os.path.join(data_dir, "undone_transactions.json")
         self.history_fieldnames = ['id', 'transaction_id', 'drink_id', 'name', 'price', 'quantity', 'change', 'event', 'timestamp']
         
         self.volatility = 1.0
-        # Structure pour gérer les Happy Hours actives
-        self.active_happy_hours = {}  # {drink_id: {'start_time': datetime, 'duration': int}}
+        # Retour des prix vers le prix de base : demi-vie en secondes (0 = désactivé).
+        # Calculé à la lecture depuis l'heure du dernier prix écrit, sans aucune écriture périodique.
+        self.decay_half_life = 0.0
+        self._price_stamps = {}  # {drink_id: epoch du dernier prix écrit}
+        # Structure pour gérer les Happy Hours actives, et celles programmées pour plus tard
+        self.active_happy_hours = {}  # {drink_id: {'start_time': datetime, 'duration': int, 'drink_name': str}}
+        self.scheduled_happy_hours = {}  # idem, start_time dans le futur
+        # Échéances (epoch, 'end' | 'start', drink_id) dans un tas, traitées par un seul minuteur.
+        # Une entrée périmée (Happy Hour arrêtée ou remplacée) est simplement ignorée au dépilage.
+        self._happy_hour_events = []
+        self._happy_hour_timer = None  # (epoch visé, threading.Timer)
+
+        # Carte du marché publiée (voir MarketSnapshot) : remplacée à chaque écriture, relue si
+        # drinks.csv change sur disque. Les écrivains passent par _write_lock (voir _writer).
+        self._snapshot: Optional[MarketSnapshot] = None
+        self._version = 0
+        self._write_lock = threading.RLock()
+        self.cache_stats = {'drinks': {'hits': 0, 'misses': 0}}
+
+        # Modèle de prix des achats (voir pricing.py) et unités vendues par boisson depuis le démarrage
+        self.pricing_model = get_model('classic')
+        self.units_sold = {}
+
+        # Source unique des numéros de transaction et de ligne d'historique (voir _new_id)
+        self._last_id = 0
+        self._id_lock = threading.Lock()
+
+        # Fonctions appelées à chaque changement de prix : (drink_id, prix, quantité, epoch)
+        self._price_listeners = []
+        # Fonctions appelées à chaque carte publiée : (carte, événement, {drink_id: événement} pour les achats)
+        self._market_listeners = []
         
         os.makedirs(data_dir, exist_ok=True)
         self._init_files()
+        # Historique segmenté : history.csv est le segment courant (voir history_store.py)
+        self.history = HistoryStore(self.history_file, self.history_fieldnames)
+        # Les numéros repartent au-dessus des derniers écrits, même si l'horloge a reculé
+        for entry in self.get_history(limit=100):
+            self._last_id = max(self._last_id, entry['id'], entry['transaction_id'])
+        # Heure des prix sans heure connue (pas d'instantané) : celle du fichier
+        self._default_price_stamp = os.path.getmtime(self.drinks_file)
+        # Pile annuler / rétablir (voir undo.py)
+        self.undo_log = UndoLog(os.path.join(data_dir, "undo_log.jsonl"))
+        # Journal des mutations + instantanés (voir journal.py) ; reprise après un arrêt brutal
+        self.journal = Journal(data_dir, fsync=fsync)
+        self._recover()
+        self._reschedule_happy_hours()
     
     @staticmethod
     def round_to_ten_cents(price: float) -> float:
@@ -27,9 +148,9 @@ class CSVDataManager:
     
     def _init_files(self):
         if not os.path.exists(self.drinks_file):
-            with open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
+            with tracked_open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
-                writer.writerow(['id', 'name', 'price', 'base_price', 'min_price', 'max_price', 'alcohol_degree'])
+                writer.writerow(DRINK_FIELDNAMES)
                 drinks = [
                     [1, 'Pilsner', 5.0, 5.0, 3.0, 10.0, 5.0],
                     [2, 'IPA', 6.0, 6.0, 4.0, 12.0, 6.5],
@@ -40,216 +161,378 @@ class CSVDataManager:
                 writer.writerows(drinks)
         
         if not os.path.exists(self.history_file):
-            with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
+            with tracked_open(self.history_file, 'w', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
                 writer.writerow(self.history_fieldnames)
     
-    def get_all_prices(self) -> List[Dict]:
+    @staticmethod
+    def _file_stamp(path: str):
+        """Signature (mtime, taille) d'un fichier pour savoir s'il a changé depuis la dernière lecture"""
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def add_price_listener(self, listener):
+        """
+        Enregistre une fonction appelée après chaque prix écrit dans drinks.csv :
+        listener(drink_id, prix, quantité vendue, heure), quantité négative pour un achat annulé
+        """
+        self._price_listeners.append(listener)
+
+    def add_market_listener(self, listener):
+        """Enregistre une fonction appelée (avec _write_lock) à chaque carte publiée"""
+        self._market_listeners.append(listener)
+
+    def _notify_price_change(self, drink_id: int, price: float, quantity: int = 0):
+        stamp = self._price_stamps.get(drink_id) or time.time()
+        for listener in self._price_listeners:
+            try:
+                listener(drink_id, price, quantity, stamp)
+            except Exception as e:
+                log.exception("Erreur dans un listener de prix: %s", e)
+
+    # --- Journal et instantanés (voir journal.py) ---
+
+    def _journal(self, op: str, **fields):
+        with self._write_lock:
+            if self.journal.snapshot_due:
+                self.checkpoint()
+            self.journal.append(op, **fields)
+
+    def _editable_drinks(self) -> List[Drink]:
+        """Copie des fiches, à modifier puis passer à _save_drinks"""
+        return [drink.copy() for drink in self._read_drinks()]
+
+    def _save_drinks(self, drinks: List[Drink], changed: List[Drink] = (), deleted: List[int] = (), sold: Optional[Dict] = None,
+                     now: Optional[float] = None, event: str = 'update', causes: Optional[Dict[int, str]] = None):
+        """
+        Journalise les fiches modifiées (et les unités vendues) puis réécrit drinks.csv atomiquement.
+        drinks.csv se reconstruit depuis le journal : inutile d'attendre le disque pour lui.
+        Les fiches écrites sont publiées telles quelles : pas de relecture après une écriture.
+        """
+        fieldnames = self.get_drink_fieldnames()
+        with self._write_lock:
+            self._journal('drinks', upsert=[drink.as_record(fieldnames) for drink in changed],
+                          delete=list(deleted), sold=sold or {})
+            # En cas d'échec, l'ancien fichier et la carte publiée restent en place
+            with atomic_open(self.drinks_file, 'w', fsync=False, newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(fieldnames)
+                writer.writerows(drink.as_row(fieldnames) for drink in drinks)
+            self._publish(drinks, fieldnames, now, event, causes)
+
+    @staticmethod
+    def _happy_hour_record(info: Dict) -> Dict:
+        return {'start_time': info['start_time'].isoformat(), 'duration': info['duration'], 'drink_name': info['drink_name']}
+
+    def checkpoint(self):
+        """Instantané complet (boissons, Happy Hours, unités vendues, heures des prix) ; vide le journal"""
+        with self._write_lock:
+            fieldnames = self.get_drink_fieldnames()
+            rows = [drink.as_record(fieldnames) for drink in self._read_drinks()]
+            self.journal.write_snapshot({
+                'fieldnames': fieldnames,
+                'drinks': rows,
+                'drinks_stamp': list(self._file_stamp(self.drinks_file)),
+                'default_price_stamp': self._default_price_stamp,
+                'price_stamps': self._price_stamps,
+                'units_sold': self.units_sold,
+                'happy_hours': {drink_id: self._happy_hour_record(info) for drink_id, info in self.active_happy_hours.items()},
+                'scheduled_happy_hours': {drink_id: self._happy_hour_record(info)
+                                          for drink_id, info in self.scheduled_happy_hours.items()},
+            })
+
+    @_writer
+    def _recover(self):
+        """Recharge l'instantané, rejoue la queue du journal et reconstruit drinks.csv si besoin"""
+        started = time.perf_counter()
+        snapshot, tail = self.journal.load()
+        if snapshot is not None:
+            self._default_price_stamp = snapshot.get('default_price_stamp', self._default_price_stamp)
+            self._price_stamps = {int(k): v for k, v in snapshot.get('price_stamps', {}).items()}
+            self.units_sold = {int(k): v for k, v in snapshot.get('units_sold', {}).items()}
+            for drink_id, info in snapshot.get('happy_hours', {}).items():
+                self.active_happy_hours[int(drink_id)] = {**info, 'start_time': datetime.fromisoformat(info['start_time'])}
+            for drink_id, info in snapshot.get('scheduled_happy_hours', {}).items():
+                self.scheduled_happy_hours[int(drink_id)] = {**info, 'start_time': datetime.fromisoformat(info['start_time'])}
+
+        if snapshot is not None and tail:
+            # Arrêt brutal : drinks.csv peut être en retard ou coupé, on le reconstruit
+            rows = {row['id']: row for row in snapshot['drinks']}
+            for record in tail:
+                op = record['op']
+                if op == 'drinks':
+                    for row in record.get('upsert', []):
+                        rows[row['id']] = row
+                        self._price_stamps[int(row['id'])] = record['t']
+                    for drink_id in record.get('delete', []):
+                        rows.pop(str(drink_id), None)
+                    for drink_id, quantity in record.get('sold', {}).items():
+                        self.units_sold[int(drink_id)] = self.units_sold.get(int(drink_id), 0) + quantity
+                elif op in ('happy_hour', 'happy_hour_scheduled'):
+                    target = self.active_happy_hours if op == 'happy_hour' else self.scheduled_happy_hours
+                    target[record['drink_id']] = {
+                        'start_time': datetime.fromisoformat(record['start_time']),
+                        'duration': record['duration'],
+                        'drink_name': record['drink_name'],
+                    }
+                    if op == 'happy_hour':
+                        self.scheduled_happy_hours.pop(record['drink_id'], None)
+                elif op in ('happy_hour_end', 'happy_hour_unscheduled'):
+                    target = self.active_happy_hours if op == 'happy_hour_end' else self.scheduled_happy_hours
+                    if record['drink_id'] is None:
+                        target.clear()
+                    else:
+                        target.pop(record['drink_id'], None)
+            with atomic_open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=snapshot['fieldnames'], extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(rows.values())
+            log.warning("Reprise après arrêt brutal: %s opérations rejouées en %.1f ms, %s Happy Hour(s) restaurée(s)",
+                        len(tail), (time.perf_counter() - started) * 1000,
+                        len(self.active_happy_hours) + len(self.scheduled_happy_hours))
+        elif snapshot is not None and list(self._file_stamp(self.drinks_file)) != snapshot.get('drinks_stamp'):
+            log.info("drinks.csv modifié hors du serveur, il est repris tel quel")
+        self._reload_drinks()
+        self.checkpoint()
+
+    def _publish(self, drinks: List[Drink], fieldnames: List[str], now: Optional[float] = None,
+                 event: str = 'update', causes: Optional[Dict[int, str]] = None):
+        """
+        Publie la carte suivante (appelé avec _write_lock). Les boissons dont le prix a changé
+        repartent de maintenant pour le retour au prix de base. `event` (et `causes`, par boisson)
+        disent aux listeners de carte ce qui l'a modifiée.
+        """
+        previous = self._snapshot
+        if previous is not None:
+            now = now or time.time()
+            for drink in drinks:
+                old = previous.by_id.get(drink.id)
+                if old is None or old.price != drink.price:
+                    self._price_stamps[drink.id] = now
+        self._version += 1
+        self._snapshot = MarketSnapshot(self._version, drinks, fieldnames, self._file_stamp(self.drinks_file),
+                                        self._price_stamps, self._default_price_stamp, self.active_happy_hours)
+        for listener in self._market_listeners:
+            try:
+                listener(self._snapshot, event, causes)
+            except Exception as e:
+                log.exception("Erreur dans un listener de carte: %s", e)
+
+    def _republish(self, event: str = 'happy_hour'):
+        """Publie une nouvelle carte avec les mêmes fiches (après un changement de Happy Hours)"""
+        snapshot = self.snapshot()
+        self._publish(list(snapshot.drinks), list(snapshot.fieldnames), event=event)
+
+    def _reload_drinks(self):
+        """Relit drinks.csv et publie la carte (appelé avec _write_lock)"""
+        self.cache_stats['drinks']['misses'] += 1
+        drinks = []
+        with tracked_open(self.drinks_file, 'r', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            # Rétrocompatibilité : on n'écrit pas alcohol_degree si le fichier ne l'a pas
+            fieldnames = [key for key in DRINK_FIELDNAMES
+                          if key != 'alcohol_degree' or 'alcohol_degree' in (reader.fieldnames or DRINK_FIELDNAMES)]
+            for row in reader:
+                try:
+                    drinks.append(Drink.from_row(row))
+                except (ValueError, KeyError) as e:
+                    log.error("Erreur parsing ligne CSV drink %s: %s", row.get('id', 'unknown'), e)
+                    continue
+        self._publish(drinks, fieldnames, event='reload')
+
+    def snapshot(self) -> MarketSnapshot:
+        """
+        Carte du marché publiée, sans prendre de verrou. Si drinks.csv a été modifié hors du
+        serveur, il est relu ; pendant une écriture en cours, la carte actuelle reste servie.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if self._file_stamp(self.drinks_file) == snapshot.file_stamp:
+                self.cache_stats['drinks']['hits'] += 1
+                return snapshot
+            if not self._write_lock.acquire(blocking=False):
+                return snapshot
+        else:
+            self._write_lock.acquire()
+        try:
+            if self._snapshot is None or self._file_stamp(self.drinks_file) != self._snapshot.file_stamp:
+                self._reload_drinks()
+            return self._snapshot
+        finally:
+            self._write_lock.release()
+
+    def _read_drinks(self) -> List[Drink]:
+        """Fiches de la carte publiée : partagées, ne pas les modifier (voir _editable_drinks)"""
+        return self.snapshot().drinks
+
+    def _decayed_price(self, drink: Drink, now: Optional[float] = None, snapshot: Optional[MarketSnapshot] = None) -> float:
+        """
+        Prix après retour vers le prix de base depuis la dernière écriture :
+        base + (prix - base) * 2^(-écoulé / demi-vie). La formule étant sans mémoire,
+        réécrire le prix décru et repartir de maintenant donne exactement la même courbe.
+        """
+        if not self.decay_half_life or drink.price == drink.base_price:
+            return drink.price
+        snapshot = snapshot or self.snapshot()
+        elapsed = (now or time.time()) - snapshot.price_stamps.get(drink.id, snapshot.default_price_stamp)
+        if elapsed <= 0:
+            return drink.price
+        return drink.base_price + (drink.price - drink.base_price) * 0.5 ** (elapsed / self.decay_half_life)
+
+    @_writer
+    def set_decay_half_life(self, seconds: float):
+        """
+        Change la demi-vie. Les prix décrus avec l'ancien réglage sont d'abord écrits
+        (une réécriture de drinks.csv, sans historique) pour que le changement ne soit pas rétroactif.
+        """
+        if self.decay_half_life:
+            now = time.time()
+            drinks = self._editable_drinks()
+            changed = []
+            for drink in drinks:
+                price = self._decayed_price(drink, now)
+                if price != drink.price:
+                    drink.price = price
+                    changed.append(drink)
+            self._save_drinks(drinks, changed=changed, now=now, event='decay')
+            for drink in changed:
+                self._notify_price_change(drink.id, drink.price)
+        else:
+            # Activation : les prix actuels partent de maintenant
+            self._price_stamps = {}
+            self._default_price_stamp = time.time()
+            self._republish('decay')
+        self.decay_half_life = seconds
+
+    def _price_view(self, drink: Drink, snapshot: MarketSnapshot) -> Dict:
+        """Construit la représentation exposée d'une boisson (prix affiché, Happy Hour)"""
+        drink_id = drink.id
+        exact_price = self._decayed_price(drink, snapshot=snapshot)
+
+        # Vérifier si cette boisson est en Happy Hour
+        display_price = exact_price
+        is_happy_hour = drink_id in snapshot.happy_hours
+
+        if is_happy_hour:
+            # Pendant une Happy Hour, le prix affiché est le prix minimum
+            display_price = drink.min_price
+
+        return {
+            'id': drink_id,
+            'name': drink.name,
+            'price': exact_price,  # Prix réel (pour les calculs internes)
+            'display_price': display_price,  # Prix affiché (réduit pendant Happy Hour)
+            'price_rounded': self.round_to_ten_cents(display_price),
+            'base_price': drink.base_price,
+            'min_price': drink.min_price,
+            'max_price': drink.max_price,
+            'alcohol_degree': drink.alcohol_degree,
+            'is_happy_hour': is_happy_hour
+        }
+
+    def get_all_prices(self, snapshot: Optional[MarketSnapshot] = None) -> List[Dict]:
+        """Prix de toutes les boissons, calculés sur une seule carte (celle passée ou la carte publiée)"""
         prices = []
         try:
-            # Nettoyer les Happy Hours expirées avant de calculer les prix
-            self._clean_expired_happy_hours()
-            
-            with open(self.drinks_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        drink_id = int(row['id'])
-                        exact_price = float(row['price'])
-                        min_price = float(row['min_price'])
-                        
-                        # Vérifier si cette boisson est en Happy Hour
-                        display_price = exact_price
-                        is_happy_hour = drink_id in self.active_happy_hours
-                        
-                        if is_happy_hour:
-                            # Pendant une Happy Hour, le prix affiché est le prix minimum
-                            display_price = min_price
-                        
-                        prices.append({
-                            'id': drink_id,
-                            'name': row['name'],
-                            'price': exact_price,  # Prix réel (pour les calculs internes)
-                            'display_price': display_price,  # Prix affiché (réduit pendant Happy Hour)
-                            'price_rounded': self.round_to_ten_cents(display_price),
-                            'base_price': float(row['base_price']),
-                            'min_price': min_price,
-                            'max_price': float(row['max_price']),
-                            'alcohol_degree': float(row.get('alcohol_degree') or 0),  # Degré d'alcool avec gestion des valeurs vides
-                            'is_happy_hour': is_happy_hour
-                        })
-                    except (ValueError, KeyError) as e:
-                        print(f"Erreur parsing ligne CSV drink {row.get('id', 'unknown')}: {e}")
-                        continue
+            snapshot = snapshot or self.snapshot()
+            prices = [self._price_view(drink, snapshot) for drink in snapshot.drinks]
         except FileNotFoundError:
-            print(f"Fichier {self.drinks_file} introuvable")
+            log.error("Fichier %s introuvable", self.drinks_file)
         except Exception as e:
-            print(f"Erreur dans get_all_prices: {e}")
+            log.exception("Erreur dans get_all_prices: %s", e)
         return prices
     
     def get_drink_by_id(self, drink_id: int) -> Optional[Dict]:
-        # Nettoyer les Happy Hours expirées
-        self._clean_expired_happy_hours()
-        
-        with open(self.drinks_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if int(row['id']) == drink_id:
-                    exact_price = float(row['price'])
-                    exact_base_price = float(row['base_price'])
-                    exact_min_price = float(row['min_price'])
-                    exact_max_price = float(row['max_price'])
-                    
-                    # Vérifier si cette boisson est en Happy Hour
-                    display_price = exact_price
-                    is_happy_hour = drink_id in self.active_happy_hours
-                    
-                    if is_happy_hour:
-                        # Pendant une Happy Hour, le prix affiché est le prix minimum
-                        display_price = exact_min_price
-                    
-                    return {
-                        'id': int(row['id']),
-                        'name': row['name'],
-                        'price': exact_price,  # Prix réel (pour les calculs internes)
-                        'display_price': display_price,  # Prix affiché (réduit pendant Happy Hour)
-                        'price_rounded': self.round_to_ten_cents(display_price),
-                        'base_price': exact_base_price,
-                        'min_price': exact_min_price,
-                        'max_price': exact_max_price,
-                        'alcohol_degree': float(row.get('alcohol_degree') or 0),  # Degré d'alcool avec gestion des valeurs vides
-                        'is_happy_hour': is_happy_hour
-                    }
-        return None
+        snapshot = self.snapshot()
+        drink = snapshot.by_id.get(drink_id)
+        return self._price_view(drink, snapshot) if drink is not None else None
+
+    def get_history_size(self) -> int:
+        """Nombre d'entrées de l'historique, archive comprise"""
+        return self.history.size()
     
-    def update_drink_price(self, drink_id: int, new_price: float):
-        drinks = []
+    @_writer
+    def update_drink_price(self, drink_id: int, new_price: float, quantity: int = 0, event: str = 'manual_update'):
+        drinks = self._editable_drinks()
+        changed = []
         # Stocker le prix exact sans arrondi
-        with open(self.drinks_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if int(row['id']) == drink_id:
-                    row['price'] = str(new_price)
-                drinks.append(row)
+        for drink in drinks:
+            if drink.id == drink_id:
+                drink.price = new_price
+                changed.append(drink)
         
-        with open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=['id', 'name', 'price', 'base_price', 'min_price', 'max_price', 'alcohol_degree'])
-            writer.writeheader()
-            writer.writerows(drinks)
+        self._save_drinks(drinks, changed=changed, event=event)
+        self._notify_price_change(drink_id, new_price, quantity)
     
-    def add_history_entry(self, drink_id: int, name: str, price: float, quantity: int, change: float, event: str, transaction_id: int):
-        entry_id = int(datetime.now().timestamp() * 1000000) % 1000000
+    def _new_id(self) -> int:
+        """
+        Numéro unique et croissant (microsecondes epoch, +1 si déjà pris) pour les transactions
+        et les lignes d'historique : deux achats du même lot ou de la même milliseconde ne se
+        partagent jamais un numéro, et les lignes se modifient ou se suppriment sans ambiguïté.
+        """
+        with self._id_lock:
+            self._last_id = max(self._last_id + 1, int(time.time() * 1000000))
+            return self._last_id
+
+    def add_history_entry(self, drink_id: int, name: str, price: float, quantity: int, change: float, event: str,
+                          transaction_id: Optional[int] = None):
+        entry_id = self._new_id()
+        if transaction_id is None:
+            transaction_id = entry_id
         
         # Ajouter la nouvelle entrée
-        with open(self.history_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                entry_id,
-                transaction_id,
-                drink_id,
-                name,
-                price,
-                quantity,
-                change,
-                event,
-                datetime.now().isoformat()
-            ])
-        
-        # Nettoyage automatique si l'historique devient trop volumineux
-        self._cleanup_history_if_needed()
+        self.history.append([[
+            entry_id,
+            transaction_id,
+            drink_id,
+            name,
+            price,
+            quantity,
+            change,
+            event,
+            datetime.now().isoformat()
+        ]])
     
-    def _cleanup_history_if_needed(self):
-        """Nettoie l'historique si il dépasse 10000 entrées pour maintenir les performances"""
-        try:
-            # Compter les lignes
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                line_count = sum(1 for _ in f)
-            
-            # Si plus de 10000 lignes, garder seulement les 5000 dernières
-            if line_count > 10000:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    reader = csv.reader(f)
-                    header = next(reader)
-                    all_rows = list(reader)
-                
-                # Garder les 5000 dernières entrées
-                recent_rows = all_rows[-5000:]
-                
-                with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=self.history_fieldnames)
-                    writer.writerow(header)
-                    writer.writerows(recent_rows)
-                    
-        except Exception as e:
-            print(f"Erreur lors du nettoyage historique: {e}")
-        
-        # Limiter l'historique à 50 entrées pour avoir plus de visibilité
-        self._limit_history(50)
-    
-    def _limit_history(self, max_entries: int = 10):
-        """Limite l'historique au nombre d'entrées spécifié pour éviter l'accumulation infinie"""
-        try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                rows = list(reader)
-            
-            if len(rows) > max_entries:
-                # Garder seulement les dernières entrées
-                recent_rows = rows[-max_entries:]
-                
-                with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=self.history_fieldnames)
-                    writer.writeheader()
-                    writer.writerows(recent_rows)
-        except Exception:
-            # En cas d'erreur, ne pas faire planter le système
-            pass
-    
-    def get_history(self, limit: int = 10) -> List[Dict]:
-        history = []
-        with open(self.history_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            for row in rows[-limit:]:
-                drink_id_val = row.get('drink_id')
-                history.append({
-                    'id': int(row.get('id') or 0),
-                    'transaction_id': int(row.get('transaction_id') or 0),
-                    'drink_id': int(drink_id_val) if drink_id_val and drink_id_val.strip() else None,
-                    'name': row.get('name', ''),
-                    'price': float(row.get('price') or 0.0),
-                    'quantity': float(row.get('quantity') or 0.0),
-                    'change': float(row.get('change') or 0.0),
-                    'event': row.get('event', ''),
-                    'timestamp': row.get('timestamp', '')
-                })
-        return history
+    def _append_history(self, rows: List[List]):
+        """Ajoute un bloc de lignes à l'historique en une seule écriture"""
+        self.history.append(rows)
 
-    def update_history_entry(self, entry_id: int, quantity: Optional[int] = None, event: Optional[str] = None) -> Optional[Dict]:
-        updated_row = None
-        fieldnames = self.history_fieldnames
+    @staticmethod
+    def _history_entry(row: Dict) -> Dict:
+        drink_id_val = row.get('drink_id')
+        return {
+            'id': int(row.get('id') or 0),
+            'transaction_id': int(row.get('transaction_id') or 0),
+            'drink_id': int(drink_id_val) if drink_id_val and drink_id_val.strip() else None,
+            'name': row.get('name', ''),
+            'price': float(row.get('price') or 0.0),
+            'quantity': float(row.get('quantity') or 0.0),
+            'change': float(row.get('change') or 0.0),
+            'event': row.get('event', ''),
+            'timestamp': row.get('timestamp', '')
+        }
 
-        with open(self.history_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
+    def get_history(self, limit: int = 10) -> List[Dict]:
+        """Dernières entrées : seul le segment courant est lu, sauf si `limit` le dépasse"""
+        return [self._history_entry(row) for row in self.history.tail(limit)]
 
-        for row in rows:
-            if str(row['id']) == str(entry_id):
-                if quantity is not None:
-                    row['quantity'] = str(max(0, int(quantity)))
-                if event is not None and event != '':
-                    row['event'] = str(event)
-                updated_row = row
-                break
+    def get_history_range(self, start: Optional[str] = None, end: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Entrées entre deux dates ISO ; seuls les segments qui recoupent la plage sont ouverts"""
+        entries = [self._history_entry(row) for row in self.history.query(start, end)]
+        return entries[-limit:] if limit else entries
 
+    def update_history_entry(self, entry_id: int, quantity: Optional[int] = None, event: Optional[str] = None) -> Optional[Dict]:
+        def update(row):
+            if quantity is not None:
+                row['quantity'] = str(max(0, int(quantity)))
+            if event is not None and event != '':
+                row['event'] = str(event)
+
+        # Les ids ne sont uniques que sur une courte période : on corrige l'entrée la plus récente
+        updated_row = self.history.update_where(lambda row: str(row['id']) == str(entry_id), update)
         if updated_row is None:
             return None
 
-        with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(rows)
-
         return {
             'id': int(updated_row['id']),
             'drink_id': int(updated_row['drink_id']),
@@ -262,31 +545,11 @@ class CSVDataManager:
         }
 
     def delete_history_entry(self, entry_id: int) -> bool:
-        fieldnames = self.history_fieldnames
-        with open(self.history_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-        new_rows = [row for row in rows if str(row['id']) != str(entry_id)]
-        if len(new_rows) == len(rows):
-            return False
-        with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(new_rows)
-        return True
+        return self.history.remove_where(lambda row: str(row['id']) == str(entry_id), first_only=True) > 0
 
+    @_writer
     def revert_and_delete_history_entry(self, entry_id: int) -> bool:
-        fieldnames = self.history_fieldnames
-        with open(self.history_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-
-        target = None
-        for row in rows:
-            if str(row['id']) == str(entry_id):
-                target = row
-                break
-
+        target = self.history.find(lambda row: str(row['id']) == str(entry_id))
         if target is None:
             return False
 
@@ -302,69 +565,200 @@ class CSVDataManager:
             if abs(reverted_price - drink['price']) > 1e-9:
                 self.update_drink_price(drink_id, reverted_price)
 
-        new_rows = [row for row in rows if str(row['id']) != str(entry_id)]
-        with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(new_rows)
+        self.delete_history_entry(entry_id)
         return True
     
-    def apply_buy(self, drink_id: int, quantity: int) -> Dict:
-        drink = self.get_drink_by_id(drink_id)
-        if not drink:
-            raise ValueError('Boisson introuvable')
+    def apply_buy(self, drink_id: int, quantity: int, sold_at: Optional[float] = None) -> Dict:
+        """Achat en mode immédiat : le modèle de prix fait bouger tout le marché"""
+        outcome = self.apply_buys_batch([{'drink_id': drink_id, 'quantity': quantity, 'sold_at': sold_at}],
+                                        immediate=True)[0]
+        if 'error' in outcome:
+            raise ValueError(outcome['error'])
+        bind_log_context(transaction_id=outcome['transaction_id'])
+        return self.get_drink_by_id(drink_id)
+    
+    def apply_buy_simple(self, drink_id: int, quantity: int, sold_at: Optional[float] = None) -> Dict:
+        """Achat en mode marché : seule la boisson achetée bouge"""
+        outcome = self.apply_buys_batch([{'drink_id': drink_id, 'quantity': quantity, 'sold_at': sold_at}],
+                                        immediate=False)[0]
+        if 'error' in outcome:
+            raise ValueError(outcome['error'])
+        bind_log_context(transaction_id=outcome['transaction_id'])
+        return self.get_drink_by_id(drink_id)
 
-        transaction_id = int(datetime.now().timestamp() * 1000)
-        all_drinks = self.get_all_prices()
+    def set_pricing_model(self, name: str, params: Optional[Dict] = None):
+        """Change le modèle de prix utilisé par les achats (ValueError si inconnu)"""
+        self.pricing_model = get_model(name, params)
+        log.info("Modèle de prix: %s %s", name, self.pricing_model.params)
 
-        price_increase = max(0.01 * float(drink['base_price']) * int(quantity), 0.01) * self.volatility
-        new_price = max(drink['min_price'], min(drink['max_price'], drink['price'] + price_increase))
-        change = new_price - drink['price']
+    @_writer
+    def apply_buys_batch(self, orders: List[Dict], immediate: bool = False) -> List[Dict]:
+        """
+        Rejoue une liste d'achats (déjà triée) en une seule passe :
+        drinks.csv est lu et réécrit une seule fois, l'historique est ajouté en un seul bloc.
+        Chaque achat est un pas de marché calculé par le modèle de prix sur tout le catalogue.
+        orders: [{'drink_id': int, 'quantity': int}, ...] ; 'sold_at' (epoch) et 'unit_price' (prix payé),
+        facultatifs, sont gardés avec la vente dans la pile d'annulation (défaut : maintenant, prix affiché)
+        immediate: True pour l'effet de marché complet (apply_buy), False pour apply_buy_simple
+        Retourne pour chaque ordre le prix avant/après ou une erreur.
+        """
+        drinks = self._editable_drinks()
+        columns = {drink.id: col for col, drink in enumerate(drinks)}
+        ids = [drink.id for drink in drinks]
+        now = time.time()
+        state = MarketState(
+            np.array([self._decayed_price(drink, now) for drink in drinks]),
+            np.array([drink.base_price for drink in drinks]),
+            np.array([drink.min_price for drink in drinks]),
+            np.array([drink.max_price for drink in drinks]),
+            np.array([float(self.units_sold.get(drink_id, 0)) for drink_id in ids]),
+        )
+        volatility = self.volatility if immediate else 1.0
 
-        self.update_drink_price(drink_id, new_price)
-        self.add_history_entry(drink_id, drink['name'], new_price, quantity, change, 'buy', transaction_id)
+        history_rows = []
+        price_changes = []  # (drink_id, prix, quantité) dans l'ordre d'application
+        transactions = []  # (transaction_id, libellé, changements, lignes d'historique) pour la pile d'annulation
+        results = []
 
-        for other in all_drinks:
-            if other['id'] == drink_id:
-                continue
-            current = float(other['price'])
-            price_decrease = (0.005 * current * int(quantity)) * self.volatility
-            if price_decrease <= 0:
+        for order in orders:
+            drink_id = order['drink_id']
+            quantity = int(order['quantity'])
+            col = columns.get(drink_id)
+            if col is None:
+                results.append({'error': 'Boisson introuvable'})
                 continue
-            new_other = max(float(other['min_price']), min(float(other['max_price']), current - price_decrease))
-            change_other = new_other - current
-            if change_other != 0:
-                self.update_drink_price(other['id'], new_other)
-                self.add_history_entry(other['id'], other['name'], new_other, 0, change_other, 'balance', transaction_id)
 
-        return self.get_drink_by_id(drink_id)
-    
-    def apply_buy_simple(self, drink_id: int, quantity: int) -> Dict:
-        drink = self.get_drink_by_id(drink_id)
-        if not drink:
-            raise ValueError('Boisson introuvable')
+            transaction_id = self._new_id()
+            timestamp = datetime.now().isoformat()
+            drink = drinks[col]
+            price = float(state.price[col])
+            is_happy_hour = drink_id in self.active_happy_hours
+            display_price = float(state.min[col]) if is_happy_hour else price
 
-        step_up = max(0.01 * float(drink['base_price']) * int(quantity), 0.01)
-        new_price = max(drink['min_price'], min(drink['max_price'], drink['price'] + step_up))
-        change = new_price - drink['price']
+            quantities = np.zeros(len(ids))
+            quantities[col] = quantity
+            new_prices = self.pricing_model.step(state, quantities, volatility, immediate)
 
-        self.update_drink_price(drink_id, new_price)
-        self.add_history_entry(drink_id, drink['name'], new_price, quantity, change, 'buy', int(datetime.now().timestamp() * 1000))
+            new_price = float(new_prices[col])
+            first_row = len(history_rows)
+            price_changes.append((drink_id, new_price, quantity))
+            changes = [[drink_id, price, new_price]]
+            history_rows.append([self._new_id(), transaction_id, drink_id, drink.name, new_price,
+                                 quantity, new_price - price, 'buy', timestamp])
+            for other in np.nonzero(new_prices != state.price)[0]:
+                if other == col:
+                    continue
+                other_id = ids[other]
+                new_other = float(new_prices[other])
+                price_changes.append((other_id, new_other, 0))
+                changes.append([other_id, float(state.price[other]), new_other])
+                history_rows.append([self._new_id(), transaction_id, other_id,
+                                     drinks[other].name, new_other, 0,
+                                     new_other - float(state.price[other]), 'balance', timestamp])
+            transactions.append((transaction_id, f"{quantity} x {drink.name}", changes, history_rows[first_row:],
+                                 [[drink_id, drink.name, quantity,
+                                   order.get('unit_price') or self.round_to_ten_cents(display_price),
+                                   float(state.base[col]), order.get('sold_at') or now]]))
 
-        return self.get_drink_by_id(drink_id)
-    
-    def reset_prices(self):
-        drinks = self.get_all_prices()
+            state.price = new_prices
+            state.sold[col] += quantity
+            self.units_sold[drink_id] = self.units_sold.get(drink_id, 0) + quantity
+
+            results.append({
+                'drink_id': drink_id,
+                'name': drink.name,
+                'price_before': price,
+                'display_price': display_price,
+                'price_rounded': self.round_to_ten_cents(display_price),
+                'base_price': float(state.base[col]),
+                'new_price': new_price,
+                'transaction_id': transaction_id
+            })
+
+        if history_rows:
+            changed = []
+            for col, drink in enumerate(drinks):
+                price = float(state.price[col])
+                if price != drink.price:
+                    drink.price = price
+                    changed.append(drink)
+            sold = {}
+            for order in orders:
+                if order['drink_id'] in columns:
+                    sold[order['drink_id']] = sold.get(order['drink_id'], 0) + int(order['quantity'])
+            # Les prix décrus des autres boissons sont écrits tels quels : ils repartent de maintenant
+            self._save_drinks(drinks, changed=changed, sold=sold, now=now, event='balance',
+                              causes={drink_id: 'buy' for drink_id in sold})
+
+            self._append_history(history_rows)
+
+            # Boissons dont seul le prix décru a été écrit : prévenues aussi, avant les achats
+            moved = {drink_id for drink_id, _, _ in price_changes}
+            for drink in changed:
+                if drink.id not in moved:
+                    self._notify_price_change(drink.id, drink.price)
+            for drink_id, price, quantity in price_changes:
+                self._notify_price_change(drink_id, price, quantity)
+            for transaction in transactions:
+                self.undo_log.record(*transaction)
+
+        return results
+
+    @_writer
+    def _write_prices(self, prices: Dict[int, float], event: str = 'update', sold: Optional[Dict[int, int]] = None):
+        """
+        Écrit plusieurs prix en une seule réécriture de drinks.csv ; `sold` corrige les unités
+        vendues (négatif pour une vente annulée), journalisé avec les prix
+        """
+        drinks = self._editable_drinks()
+        changed = []
         for drink in drinks:
-            self.update_drink_price(drink['id'], drink['base_price'])
-            self.add_history_entry(drink['id'], drink['name'], drink['base_price'], 0, 0, 'reset', int(datetime.now().timestamp() * 1000))
+            if drink.id in prices:
+                drink.price = prices[drink.id]
+                changed.append(drink)
+        for drink_id, quantity in (sold or {}).items():
+            self.units_sold[drink_id] = max(0, self.units_sold.get(drink_id, 0) + quantity)
+        self._save_drinks(drinks, changed=changed, sold=sold, event=event)
+        for drink_id, price in prices.items():
+            self._notify_price_change(drink_id, price, (sold or {}).get(drink_id, 0))
+
+    @_writer
+    def _apply_market_event(self, new_prices: Dict[int, float], event: str):
+        """
+        Applique un événement touchant plusieurs boissons (reset, crash, boom) comme une seule
+        transaction : une écriture des prix, un bloc d'historique, une entrée dans la pile d'annulation.
+        """
+        drinks = self.snapshot().by_id
+        now = time.time()
+        transaction_id = self._new_id()
+        timestamp = datetime.now().isoformat()
+        changes, history_rows = [], []
+        for drink_id, new_price in new_prices.items():
+            drink = drinks[drink_id]
+            price = self._decayed_price(drink, now)
+            change = new_price - price
+            if event != 'reset' and change == 0:
+                continue
+            changes.append([drink_id, price, new_price])
+            history_rows.append([self._new_id(), transaction_id, drink_id, drink.name,
+                                 new_price, 0, change if event != 'reset' else 0, event, timestamp])
+        if not history_rows:
+            return
+        self._write_prices({drink_id: after for drink_id, _, after in changes}, event)
+        self._append_history(history_rows)
+        self.undo_log.record(transaction_id, event, changes, history_rows)
+
+    @_writer
+    def reset_prices(self):
+        self._apply_market_event({drink.id: drink.base_price for drink in self._read_drinks()}, 'reset')
     
+    @_writer
     def trigger_crash(self, level='medium'):
         """
         Déclenche un crash du marché avec différents niveaux d'intensité
         level: 'small', 'medium', 'large', 'maximum'
         """
-        drinks = self.get_all_prices()
+        drinks = self._read_drinks()
         
         # Définir les plages d'effets selon le niveau
         effect_ranges = {
@@ -377,27 +771,27 @@ class CSVDataManager:
         if level not in effect_ranges:
             level = 'medium'
             
+        new_prices = {}
         for drink in drinks:
             if level == 'maximum':
                 # Crash maximal: aller directement au prix minimum
-                new_price = drink['min_price']
+                new_price = drink.min_price
             else:
                 # Crash avec pourcentage aléatoire dans la plage
                 min_effect, max_effect = effect_ranges[level]
-                crash_effect = random.uniform(min_effect, max_effect) * drink['price']
-                new_price = max(drink['min_price'], drink['price'] + crash_effect)
-            
-            change = new_price - drink['price']
-            if change != 0:
-                self.update_drink_price(drink['id'], new_price)
-                self.add_history_entry(drink['id'], drink['name'], new_price, 0, change, f'crash_{level}', int(datetime.now().timestamp() * 1000))
+                price = self._decayed_price(drink)
+                crash_effect = random.uniform(min_effect, max_effect) * price
+                new_price = max(drink.min_price, price + crash_effect)
+            new_prices[drink.id] = new_price
+        self._apply_market_event(new_prices, f'crash_{level}')
     
+    @_writer
     def trigger_boom(self, level='medium'):
         """
         Déclenche un boom du marché avec différents niveaux d'intensité
         level: 'small', 'medium', 'large', 'maximum'
         """
-        drinks = self.get_all_prices()
+        drinks = self._read_drinks()
         
         # Définir les plages d'effets selon le niveau
         effect_ranges = {
@@ -410,27 +804,25 @@ class CSVDataManager:
         if level not in effect_ranges:
             level = 'medium'
             
+        new_prices = {}
         for drink in drinks:
             if level == 'maximum':
                 # Boom maximal: aller directement au prix maximum
-                new_price = drink['max_price']
+                new_price = drink.max_price
             else:
                 # Boom avec pourcentage aléatoire dans la plage
                 min_effect, max_effect = effect_ranges[level]
-                boom_effect = random.uniform(min_effect, max_effect) * drink['price']
-                new_price = min(drink['max_price'], drink['price'] + boom_effect)
-            
-            change = new_price - drink['price']
-            if change != 0:
-                self.update_drink_price(drink['id'], new_price)
-                self.add_history_entry(drink['id'], drink['name'], new_price, 0, change, f'boom_{level}', int(datetime.now().timestamp() * 1000))
+                price = self._decayed_price(drink)
+                boom_effect = random.uniform(min_effect, max_effect) * price
+                new_price = min(drink.max_price, price + boom_effect)
+            new_prices[drink.id] = new_price
+        self._apply_market_event(new_prices, f'boom_{level}')
     
     def _next_drink_id(self) -> int:
-        drinks = self.get_all_prices()
-        if not drinks:
-            return 1
-        return max(d['id'] for d in drinks) + 1
+        ids = self.snapshot().by_id
+        return max(ids) + 1 if ids else 1
 
+    @_writer
     def add_drink(self, name: str, base_price: float, min_price: float, max_price: float, alcohol_degree: float = 0.0) -> Dict:
         new_id = self._next_drink_id()
         base_price = float(base_price)
@@ -442,9 +834,14 @@ class CSVDataManager:
         if not (min_price <= base_price <= max_price):
             raise ValueError('base_price doit être entre min_price et max_price')
 
-        with open(self.drinks_file, 'a', newline='', encoding='utf-8') as f:
+        drink = Drink(new_id, name, base_price, base_price, min_price, max_price, alcohol_degree)
+        fieldnames = self.get_drink_fieldnames()
+        self._journal('drinks', upsert=[drink.as_record(fieldnames)])
+        with tracked_open(self.drinks_file, 'a', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
-            writer.writerow([new_id, name, base_price, base_price, min_price, max_price, alcohol_degree])
+            writer.writerow(drink.as_row(fieldnames))
+        self._publish(list(self._snapshot.drinks) + [drink], fieldnames, event='drink_added')
+        self._notify_price_change(new_id, base_price)
         return {
             'id': new_id,
             'name': name,
@@ -455,136 +852,233 @@ class CSVDataManager:
             'alcohol_degree': alcohol_degree,
         }
 
+    @_writer
     def update_drink_fields(self, drink_id: int, name: Optional[str] = None,
                              base_price: Optional[float] = None,
                              min_price: Optional[float] = None,
                              max_price: Optional[float] = None,
                              price: Optional[float] = None,
                              alcohol_degree: Optional[float] = None) -> Optional[Dict]:
-        updated = None
-        with open(self.drinks_file, 'r', encoding='utf-8') as f:
-            rows = list(csv.DictReader(f))
-
-        for row in rows:
-            if int(row['id']) == drink_id:
-                new_name = name if name is not None else row['name']
-                new_base = float(base_price) if base_price is not None else float(row['base_price'])
-                new_min = float(min_price) if min_price is not None else float(row['min_price'])
-                new_max = float(max_price) if max_price is not None else float(row['max_price'])
-                new_price = float(price) if price is not None else float(row['price'])
-                new_alcohol = float(alcohol_degree) if alcohol_degree is not None else float(row.get('alcohol_degree', 0))
-
-                if not (new_min <= new_base <= new_max):
-                    raise ValueError('base_price doit être entre min_price et max_price')
-                if not (new_min <= new_price <= new_max):
-                    raise ValueError('price doit être entre min_price et max_price')
-
-                row['name'] = new_name
-                row['base_price'] = str(new_base)
-                row['min_price'] = str(new_min)
-                row['max_price'] = str(new_max)
-                row['price'] = str(new_price)
-                row['alcohol_degree'] = str(new_alcohol)
-
-                updated = row
-                break
-
+        drinks = self._editable_drinks()
+        updated = next((drink for drink in drinks if drink.id == drink_id), None)
         if updated is None:
             return None
 
-        with open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.get_drink_fieldnames())
-            writer.writeheader()
-            writer.writerows(rows)
+        new_base = float(base_price) if base_price is not None else updated.base_price
+        new_min = float(min_price) if min_price is not None else updated.min_price
+        new_max = float(max_price) if max_price is not None else updated.max_price
+        new_price = float(price) if price is not None else updated.price
+        price_changed = new_price != updated.price
+
+        if not (new_min <= new_base <= new_max):
+            raise ValueError('base_price doit être entre min_price et max_price')
+        if not (new_min <= new_price <= new_max):
+            raise ValueError('price doit être entre min_price et max_price')
+
+        if name is not None:
+            updated.name = name
+        updated.base_price = new_base
+        updated.min_price = new_min
+        updated.max_price = new_max
+        updated.price = new_price
+        if alcohol_degree is not None:
+            updated.alcohol_degree = float(alcohol_degree)
+
+        self._save_drinks(drinks, changed=[updated], event='manual_update')
+        if price_changed:
+            self._notify_price_change(drink_id, updated.price)
 
         return {
-            'id': int(updated['id']),
-            'name': updated['name'],
-            'price': float(updated['price']),
-            'base_price': float(updated['base_price']),
-            'min_price': float(updated['min_price']),
-            'max_price': float(updated['max_price']),
+            'id': updated.id,
+            'name': updated.name,
+            'price': updated.price,
+            'base_price': updated.base_price,
+            'min_price': updated.min_price,
+            'max_price': updated.max_price,
         }
 
+    @_writer
     def delete_drink(self, drink_id: int) -> bool:
-        with open(self.drinks_file, 'r', encoding='utf-8') as f:
-            rows = list(csv.DictReader(f))
-        new_rows = [r for r in rows if int(r['id']) != drink_id]
-        if len(new_rows) == len(rows):
+        drinks = self._read_drinks()
+        kept = [drink.copy() for drink in drinks if drink.id != drink_id]
+        if len(kept) == len(drinks):
             return False
-        with open(self.drinks_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.get_drink_fieldnames())
-            writer.writeheader()
-            writer.writerows(new_rows)
+        self._save_drinks(kept, deleted=[drink_id], event='drink_deleted')
         return True
 
     def clear_history(self) -> None:
-        with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.history_fieldnames)
-            writer.writeheader()
+        self.history.clear()
+
+    # --- Happy Hours : un tas des échéances et un seul minuteur ---
+
+    @staticmethod
+    def _happy_hour_end(info: Dict) -> float:
+        return info['start_time'].timestamp() + info['duration']
+
+    def _event_is_current(self, when: float, action: str, drink_id: int) -> bool:
+        if action == 'end':
+            info = self.active_happy_hours.get(drink_id)
+            return info is not None and self._happy_hour_end(info) == when
+        info = self.scheduled_happy_hours.get(drink_id)
+        return info is not None and info['start_time'].timestamp() == when
+
+    def _schedule_happy_hour_event(self, when: float, action: str, drink_id: int):
+        heapq.heappush(self._happy_hour_events, (when, action, drink_id))
+        self._arm_happy_hour_timer()
+
+    def _arm_happy_hour_timer(self):
+        """Programme le minuteur sur la prochaine échéance valide du tas (appelé avec _write_lock)"""
+        events = self._happy_hour_events
+        while events and not self._event_is_current(*events[0]):
+            heapq.heappop(events)
+        when = events[0][0] if events else None
+        if self._happy_hour_timer is not None:
+            if self._happy_hour_timer[0] == when:
+                return
+            self._happy_hour_timer[1].cancel()
+            self._happy_hour_timer = None
+        if when is not None:
+            timer = threading.Timer(max(0.0, when - time.time()), self._on_happy_hour_timer)
+            timer.daemon = True
+            self._happy_hour_timer = (when, timer)
+            timer.start()
+
+    @_writer
+    def _on_happy_hour_timer(self):
+        self._happy_hour_timer = None
+        self._process_happy_hours(time.time())
 
-    def start_happy_hour(self, drink_id: int, duration_seconds: int) -> Dict:
-        """Démarre une Happy Hour pour une boisson spécifique"""
+    def _process_happy_hours(self, now: float):
+        """
+        Démarre et termine les Happy Hours arrivées à échéance : une ligne d'historique par
+        événement (à l'heure de l'échéance), un seul ajout à l'historique, une nouvelle carte publiée.
+        """
+        events = self._happy_hour_events
+        history_rows = []
+        while events and events[0][0] <= now:
+            when, action, drink_id = heapq.heappop(events)
+            if not self._event_is_current(when, action, drink_id):
+                continue
+            transaction_id = self._new_id()
+            timestamp = datetime.fromtimestamp(when).isoformat()
+            if action == 'end':
+                info = self.active_happy_hours.pop(drink_id)
+                self._journal('happy_hour_end', drink_id=drink_id)
+                # Le prix n'est pas pertinent ici
+                history_rows.append([self._new_id(), transaction_id, drink_id,
+                                     info.get('drink_name', f'Drink {drink_id}'), 0, 0, 0, 'happy_hour_expired', timestamp])
+            else:
+                info = self.scheduled_happy_hours.pop(drink_id)
+                self.active_happy_hours[drink_id] = info
+                self._journal('happy_hour', drink_id=drink_id, **self._happy_hour_record(info))
+                drink = self.snapshot().by_id.get(drink_id)
+                history_rows.append([self._new_id(), transaction_id, drink_id, info['drink_name'],
+                                     self._decayed_price(drink) if drink else 0, 0, 0,
+                                     f"happy_hour_start_{info['duration']}s", timestamp])
+                heapq.heappush(events, (self._happy_hour_end(info), 'end', drink_id))
+        if history_rows:
+            self._append_history(history_rows)
+            self._republish()
+        self._arm_happy_hour_timer()
+
+    @_writer
+    def _reschedule_happy_hours(self):
+        """Reconstruit le tas au démarrage ; les échéances passées pendant l'arrêt sont traitées tout de suite"""
+        self._happy_hour_events = [(self._happy_hour_end(info), 'end', drink_id)
+                                   for drink_id, info in self.active_happy_hours.items()]
+        self._happy_hour_events += [(info['start_time'].timestamp(), 'start', drink_id)
+                                    for drink_id, info in self.scheduled_happy_hours.items()]
+        heapq.heapify(self._happy_hour_events)
+        self._republish()
+        self._process_happy_hours(time.time())
+
+    @_writer
+    def start_happy_hour(self, drink_id: int, duration_seconds: int, start_at: Optional[datetime] = None) -> Dict:
+        """Démarre une Happy Hour pour une boisson spécifique, tout de suite ou à start_at"""
         drink = self.get_drink_by_id(drink_id)
         if not drink:
             raise ValueError('Boisson introuvable')
-        
-        # Nettoyer les Happy Hours expirées
-        self._clean_expired_happy_hours()
-        
-        # Ajouter la nouvelle Happy Hour
-        self.active_happy_hours[drink_id] = {
-            'start_time': datetime.now(),
+
+        now = datetime.now()
+        info = {
+            'start_time': start_at if start_at is not None and start_at > now else now,
             'duration': duration_seconds,
             'drink_name': drink['name']
         }
-        
-        # Ajouter à l'historique
-        self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, f'happy_hour_start_{duration_seconds}s', int(datetime.now().timestamp() * 1000))
+        scheduled = info['start_time'] > now
+        if scheduled:
+            # Programmée : le minuteur la démarrera (et l'inscrira dans l'historique) à l'heure dite
+            self.scheduled_happy_hours[drink_id] = info
+            self._journal('happy_hour_scheduled', drink_id=drink_id, **self._happy_hour_record(info))
+            self._schedule_happy_hour_event(info['start_time'].timestamp(), 'start', drink_id)
+        else:
+            self.active_happy_hours[drink_id] = info
+            self._journal('happy_hour', drink_id=drink_id, **self._happy_hour_record(info))
+            self._republish()
+            self._schedule_happy_hour_event(self._happy_hour_end(info), 'end', drink_id)
+
+            # Ajouter à l'historique
+            self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, f'happy_hour_start_{duration_seconds}s')
         
         return {
             'drink_id': drink_id,
             'drink_name': drink['name'],
             'duration': duration_seconds,
-            'start_time': datetime.now().isoformat()
+            'start_time': info['start_time'].isoformat(),
+            'scheduled': scheduled
         }
     
+    @_writer
     def stop_happy_hour(self, drink_id: int) -> bool:
-        """Arrête une Happy Hour pour une boisson spécifique"""
+        """Arrête la Happy Hour d'une boisson et annule celle qui était programmée"""
+        stopped = False
         if drink_id in self.active_happy_hours:
-            drink_info = self.active_happy_hours[drink_id]
             drink = self.get_drink_by_id(drink_id)
             
             if drink:
-                self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, 'happy_hour_stop', int(datetime.now().timestamp() * 1000))
+                self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, 'happy_hour_stop')
             
             del self.active_happy_hours[drink_id]
-            return True
-        return False
+            self._journal('happy_hour_end', drink_id=drink_id)
+            self._republish()
+            stopped = True
+        if drink_id in self.scheduled_happy_hours:
+            del self.scheduled_happy_hours[drink_id]
+            self._journal('happy_hour_unscheduled', drink_id=drink_id)
+            stopped = True
+        if stopped:
+            self._arm_happy_hour_timer()
+        return stopped
     
+    @_writer
     def stop_all_happy_hours(self) -> int:
-        """Arrête toutes les Happy Hours actives"""
-        count = len(self.active_happy_hours)
+        """Arrête toutes les Happy Hours actives et annule celles programmées"""
+        count = len(self.active_happy_hours) + len(self.scheduled_happy_hours)
         
         # Ajouter à l'historique pour chaque Happy Hour arrêtée
-        for drink_id, happy_hour_info in self.active_happy_hours.items():
+        for drink_id in self.active_happy_hours:
             drink = self.get_drink_by_id(drink_id)
             if drink:
-                self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, 'happy_hour_stop_all', int(datetime.now().timestamp() * 1000))
+                self.add_history_entry(drink_id, drink['name'], drink['price'], 0, 0, 'happy_hour_stop_all')
         
-        self.active_happy_hours.clear()
+        if self.active_happy_hours:
+            self.active_happy_hours.clear()
+            self._journal('happy_hour_end', drink_id=None)
+            self._republish()
+        if self.scheduled_happy_hours:
+            self.scheduled_happy_hours.clear()
+            self._journal('happy_hour_unscheduled', drink_id=None)
+        self._arm_happy_hour_timer()
         return count
     
     def get_active_happy_hours(self) -> List[Dict]:
-        """Retourne la liste des Happy Hours actives"""
-        # Nettoyer les Happy Hours expirées
-        self._clean_expired_happy_hours()
-        
+        """Retourne la liste des Happy Hours actives (lecture de la carte publiée, sans effet de bord)"""
         active_hours = []
-        for drink_id, happy_hour_info in self.active_happy_hours.items():
+        now = datetime.now()
+        for drink_id, happy_hour_info in self.snapshot().happy_hours.items():
             start_time = happy_hour_info['start_time']
             duration = happy_hour_info['duration']
-            elapsed = (datetime.now() - start_time).total_seconds()
+            elapsed = (now - start_time).total_seconds()
             remaining = max(0, duration - elapsed)
             
             active_hours.append({
@@ -597,92 +1091,71 @@ class CSVDataManager:
             })
         
         return active_hours
-    
-    def _clean_expired_happy_hours(self):
-        """Nettoie automatiquement les Happy Hours expirées"""
-        current_time = datetime.now()
-        expired_drinks = []
-        
-        for drink_id, happy_hour_info in self.active_happy_hours.items():
-            start_time = happy_hour_info['start_time']
-            duration = happy_hour_info['duration']
-            
-            if (current_time - start_time).total_seconds() >= duration:
-                expired_drinks.append(drink_id)
-        
-        # Supprimer les Happy Hours expirées
-        for drink_id in expired_drinks:
-            happy_hour_info = self.active_happy_hours[drink_id]
-            drink_name = happy_hour_info.get('drink_name', f'Drink {drink_id}')
-            # Éviter la récursion en ne cherchant pas le drink par ID
-            # Utiliser les infos stockées dans happy_hour_info. Le prix n'est pas pertinent ici.
-            self.add_history_entry(drink_id, drink_name, 0, 0, 0, 'happy_hour_expired', int(datetime.now().timestamp() * 1000))
-            del self.active_happy_hours[drink_id]
+
+    def get_scheduled_happy_hours(self) -> List[Dict]:
+        """Happy Hours programmées, de la plus proche à la plus lointaine"""
+        scheduled = sorted(dict(self.scheduled_happy_hours).items(), key=lambda item: item[1]['start_time'])
+        return [{
+            'drink_id': drink_id,
+            'drink_name': info['drink_name'],
+            'start_time': info['start_time'].isoformat(),
+            'duration': info['duration'],
+            'starts_in': max(0, int((info['start_time'] - datetime.now()).total_seconds()))
+        } for drink_id, info in scheduled]
     
     def is_drink_in_happy_hour(self, drink_id: int) -> bool:
         """Vérifie si une boisson est actuellement en Happy Hour"""
-        self._clean_expired_happy_hours()
-        return drink_id in self.active_happy_hours
+        return drink_id in self.snapshot().happy_hours
 
     def get_drink_fieldnames(self) -> List[str]:
         """Retourne les noms de colonnes pour drinks.csv, gère la rétrocompatibilité."""
-        # Par défaut, inclure la nouvelle colonne
-        fieldnames = ['id', 'name', 'price', 'base_price', 'min_price', 'max_price', 'alcohol_degree']
         try:
-            with open(self.drinks_file, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                header = next(reader)
-                # Si la colonne n'existe pas dans le fichier, ne pas l'inclure pour l'écriture
-                if 'alcohol_degree' not in header:
-                    fieldnames.remove('alcohol_degree')
-        except (FileNotFoundError, StopIteration):
-            # Le fichier n'existe pas ou est vide, utiliser les nouveaux fieldnames
-            pass
-        return fieldnames
-
-    def _read_undone_stack(self) -> List:
-        if not os.path.exists(self.undone_file):
-            return []
-        try:
-            with open(self.undone_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+            return list(self.snapshot().fieldnames)
+        except FileNotFoundError:
+            # Le fichier n'existe pas, utiliser les nouveaux fieldnames
+            return list(DRINK_FIELDNAMES)
 
-    def _write_undone_stack(self, stack: List):
-        with open(self.undone_file, 'w', encoding='utf-8') as f:
-            json.dump(stack, f)
+    def _remove_history_transaction(self, transaction_id: int):
+        """Retire de l'historique les lignes d'une transaction (seuls les segments qui la contiennent sont ouverts)"""
+        self.history.remove_where(lambda row: row.get('transaction_id') == str(transaction_id), transaction_id=transaction_id)
 
+    def _transaction_summary(self, tx: Dict) -> Dict:
+        buy_row = next((row for row in tx['history'] if row[7] == 'buy'), None)
+        return {
+            'transaction_id': tx['transaction_id'],
+            'label': tx['label'],
+            'drink_name': buy_row[3] if buy_row else tx['label'],
+            'drinks': len(tx['changes']),
+            'sales': tx.get('sales', []),
+        }
+
+    @staticmethod
+    def _sold_by_drink(tx: Dict, sign: int) -> Dict[int, int]:
+        sold = {}
+        for drink_id, _, quantity, *_ in tx.get('sales', []):
+            sold[drink_id] = sold.get(drink_id, 0) + sign * quantity
+        return sold
+
+    @_writer
     def undo_last_transaction(self) -> Optional[Dict]:
-        with open(self.history_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-        
-        if not rows:
+        """Annule la dernière transaction : tous les prix touchés reviennent en une écriture"""
+        tx = self.undo_log.undo()
+        if tx is None:
             return None
+        self._write_prices({drink_id: before for drink_id, before, _ in tx['changes']}, 'undo',
+                           sold=self._sold_by_drink(tx, -1))
+        self._remove_history_transaction(tx['transaction_id'])
+        summary = self._transaction_summary(tx)
+        return {"undone_transaction_id": tx['transaction_id'], **summary}
 
-        last_transaction_id = rows[-1].get('transaction_id')
-        if not last_transaction_id:
+    @_writer
+    def redo_last_transaction(self) -> Optional[Dict]:
+        """Rétablit la dernière transaction annulée"""
+        tx = self.undo_log.redo()
+        if tx is None:
             return None
-
-        transaction_entries = [row for row in rows if row.get('transaction_id') == last_transaction_id]
-        remaining_entries = [row for row in rows if row.get('transaction_id') != last_transaction_id]
-
-        for entry in reversed(transaction_entries):
-            drink_id = int(entry['drink_id'])
-            change = float(entry['change'])
-            current_price = float(entry['price'])
-            reverted_price = current_price - change
-            self.update_drink_price(drink_id, reverted_price)
-
-        undone_stack = self._read_undone_stack()
-        undone_stack.append(transaction_entries)
-        self._write_undone_stack(undone_stack)
-
-        with open(self.history_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.history_fieldnames)
-            writer.writeheader()
-            writer.writerows(remaining_entries)
-
-        buy_entry = next((e for e in transaction_entries if e['event'] == 'buy'), None)
-        return {"undone_transaction_id": last_transaction_id, "drink_name": buy_entry['name'] if buy_entry else "N/A"}
+        self._write_prices({drink_id: after for drink_id, _, after in tx['changes']}, 'redo',
+                           sold=self._sold_by_drink(tx, 1))
+        self._append_history(tx['history'])
+        summary = self._transaction_summary(tx)
+        return {"redone_transaction_id": tx['transaction_id'], **summary}
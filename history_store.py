@@ -0,0 +1,282 @@
+"""
+Historique des transactions en segments de taille fixe, sans jamais rien jeter.
+
+- Le segment courant est history.csv lui-même, en ajout seul (les outils qui le lisent
+  continuent de fonctionner) ; ses lignes sont gardées en mémoire tant que le fichier ne
+  change pas.
+- Dès qu'il atteint `segment_size` lignes, il est scellé : compressé en gzip dans
+  data/history/NNNNNN.csv.gz puis vidé.
+- data/history/index.json décrit chaque segment scellé : nombre de lignes, plage de
+  dates et plage de transaction_id.
+
+Les dernières entrées (get_history) se lisent dans le segment courant, puis dans les
+segments scellés les plus récents seulement si nécessaire. Une requête par plage de dates
+n'ouvre que les segments qui la recoupent.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterator, List, Optional
+
+from iostats import atomic_open, repair_tail, tracked_open
+from logs import get_logger
+
+log = get_logger('history')
+
+
+def iter_rows(path: str) -> Iterator[Dict]:
+    """
+    Toutes les lignes, segments scellés (via index.json) puis history.csv, en lecture seule :
+    pour les outils hors ligne qui tournent à côté du serveur. Rien n'est réparé ni écrit ;
+    une dernière ligne sans fin de ligne (ajout en cours) est ignorée.
+    """
+    archive_dir = os.path.join(os.path.dirname(path), 'history')
+    index_path = os.path.join(archive_dir, 'index.json')
+    segments = []
+    if os.path.exists(index_path):
+        with tracked_open(index_path, 'r', encoding='utf-8') as f:
+            segments = json.load(f)
+    for segment in segments:
+        try:
+            with tracked_open(os.path.join(archive_dir, segment['file']), 'rb') as f:
+                data = gzip.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            continue  # Segment vidé par le serveur entre-temps
+        yield from csv.DictReader(io.StringIO(data))
+    if os.path.exists(path):
+        with tracked_open(path, 'r', newline='', encoding='utf-8') as f:
+            text = f.read()
+        yield from csv.DictReader(io.StringIO(text[:text.rfind('\n') + 1]))
+
+
+class HistoryStore:
+    def __init__(self, path: str, fieldnames: List[str], segment_size: int = 1000):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.segment_size = segment_size
+        self.archive_dir = os.path.join(os.path.dirname(path), 'history')
+        self.index_path = os.path.join(self.archive_dir, 'index.json')
+        self.segments: List[Dict] = []  # Segments scellés, du plus ancien au plus récent
+        self._cache = None  # (signature du fichier, [lignes du segment courant])
+        self._lock = threading.RLock()
+        size, removed = repair_tail(self.path)
+        if removed:
+            log.warning("%s: dernière ligne incomplète retirée", self.path)
+        if not size:
+            self._write_current([])
+        if os.path.exists(self.index_path):
+            with tracked_open(self.index_path, 'r', encoding='utf-8') as f:
+                self.segments = json.load(f)
+
+    @staticmethod
+    def _file_stamp(path: str):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    # --- Segment courant ---
+
+    def _current(self) -> List[Dict]:
+        stamp = self._file_stamp(self.path)
+        if self._cache is not None and self._cache[0] == stamp:
+            return self._cache[1]
+        with tracked_open(self.path, 'r', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self._cache = (stamp, rows)
+        return rows
+
+    def _write_current(self, rows: List[Dict]):
+        with atomic_open(self.path, 'w', fsync=False, newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+        self._cache = (self._file_stamp(self.path), list(rows))
+
+    def append(self, rows: List[List]):
+        """Ajoute un bloc de lignes (listes dans l'ordre des colonnes) ; un bloc n'est jamais coupé entre deux segments"""
+        with self._lock:
+            current = self._current()
+            with tracked_open(self.path, 'a', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(rows)
+            current.extend(dict(zip(self.fieldnames, map(str, row))) for row in rows)
+            self._cache = (self._file_stamp(self.path), current)
+            if len(current) >= self.segment_size:
+                self._seal(current)
+
+    # --- Segments scellés ---
+
+    def _segment_path(self, segment: Dict) -> str:
+        return os.path.join(self.archive_dir, segment['file'])
+
+    @staticmethod
+    def _describe(rows: List[Dict]) -> Dict:
+        stamps = [row['timestamp'] for row in rows if row.get('timestamp')]
+        transactions = [int(row['transaction_id']) for row in rows if (row.get('transaction_id') or '').isdigit()]
+        return {
+            'count': len(rows),
+            'start': min(stamps) if stamps else None,
+            'end': max(stamps) if stamps else None,
+            'first_transaction': min(transactions) if transactions else None,
+            'last_transaction': max(transactions) if transactions else None,
+        }
+
+    def _write_segment(self, name: str, rows: List[Dict]):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+        with atomic_open(os.path.join(self.archive_dir, name), 'wb') as f:
+            f.write(gzip.compress(buffer.getvalue().encode('utf-8'), mtime=0))
+
+    def _read_segment(self, segment: Dict) -> List[Dict]:
+        with tracked_open(self._segment_path(segment), 'rb') as f:
+            data = gzip.decompress(f.read()).decode('utf-8')
+        return list(csv.DictReader(io.StringIO(data)))
+
+    def _save_index(self):
+        with atomic_open(self.index_path, 'w', encoding='utf-8') as f:
+            json.dump(self.segments, f, indent=1)
+
+    def _seal(self, rows: List[Dict]):
+        """Compresse le segment courant dans l'archive puis le vide"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        number = self.segments[-1]['number'] + 1 if self.segments else 0
+        segment = {'number': number, 'file': f'{number:06d}.csv.gz', **self._describe(rows)}
+        self._write_segment(segment['file'], rows)
+        self.segments.append(segment)
+        self._save_index()
+        self._write_current([])
+        log.info("Segment d'historique %s scellé (%s lignes, %s → %s)",
+                 segment['file'], segment['count'], segment['start'], segment['end'])
+
+    def _rewrite_segment(self, position: int, rows: List[Dict]):
+        segment = self.segments[position]
+        if rows:
+            self._write_segment(segment['file'], rows)
+            segment.update(self._describe(rows))
+        else:
+            os.remove(self._segment_path(segment))
+            del self.segments[position]
+        self._save_index()
+
+    # --- Lectures ---
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(segment['count'] for segment in self.segments) + len(self._current())
+
+    def tail(self, limit: int) -> List[Dict]:
+        """Les `limit` dernières lignes ; les segments scellés ne sont ouverts que si le courant ne suffit pas"""
+        with self._lock:
+            rows = self._current()[-limit:] if limit > 0 else []
+            for segment in reversed(self.segments):
+                if len(rows) >= limit:
+                    break
+                rows = self._read_segment(segment)[-(limit - len(rows)):] + rows
+            return rows
+
+    def query(self, start: Optional[str] = None, end: Optional[str] = None) -> Iterator[Dict]:
+        """Lignes dont l'horodatage ISO est dans [start, end], en n'ouvrant que les segments concernés"""
+        def inside(stamp):
+            return bool(stamp) and (start is None or stamp >= start) and (end is None or stamp <= end)
+
+        with self._lock:
+            segments = [s for s in self.segments
+                        if s['start'] is not None and (end is None or s['start'] <= end) and (start is None or s['end'] >= start)]
+            current = list(self._current())
+        for segment in segments:
+            for row in self._read_segment(segment):
+                if inside(row.get('timestamp')):
+                    yield row
+        for row in current:
+            if inside(row.get('timestamp')):
+                yield row
+
+    def find(self, match: Callable[[Dict], bool]) -> Optional[Dict]:
+        """Ligne la plus récente qui correspond (segment courant d'abord)"""
+        with self._lock:
+            for row in reversed(self._current()):
+                if match(row):
+                    return dict(row)
+            for position in self._candidates():
+                for row in reversed(self._read_segment(self.segments[position])):
+                    if match(row):
+                        return row
+        return None
+
+    # --- Modifications (rares : corrections de l'admin, annulation) ---
+
+    def _candidates(self, transaction_id: Optional[int] = None) -> Iterator[int]:
+        """Positions des segments scellés à examiner, du plus récent au plus ancien"""
+        for position in range(len(self.segments) - 1, -1, -1):
+            segment = self.segments[position]
+            if transaction_id is not None and segment['first_transaction'] is not None and not (
+                    segment['first_transaction'] <= transaction_id <= segment['last_transaction']):
+                continue
+            yield position
+
+    def update_where(self, match: Callable[[Dict], bool], update: Callable[[Dict], None],
+                     transaction_id: Optional[int] = None) -> Optional[Dict]:
+        """Modifie la ligne la plus récente qui correspond ; réécrit seulement son segment"""
+        with self._lock:
+            current = [dict(row) for row in self._current()]
+            for row in reversed(current):
+                if match(row):
+                    update(row)
+                    self._write_current(current)
+                    return row
+            for position in self._candidates(transaction_id):
+                rows = self._read_segment(self.segments[position])
+                for row in reversed(rows):
+                    if match(row):
+                        update(row)
+                        self._rewrite_segment(position, rows)
+                        return row
+        return None
+
+    def remove_where(self, match: Callable[[Dict], bool], transaction_id: Optional[int] = None,
+                     first_only: bool = False) -> int:
+        """
+        Retire les lignes qui correspondent. Avec transaction_id, seuls les segments dont la
+        plage de transactions le contient sont ouverts.
+        """
+        removed = 0
+        with self._lock:
+            current = self._current()
+            kept = [row for row in current if not match(row)]
+            if len(kept) != len(current):
+                if first_only:
+                    kept = list(current)
+                    kept.remove(next(row for row in reversed(current) if match(row)))
+                removed += len(current) - len(kept)
+                self._write_current(kept)
+                if first_only:
+                    return removed
+            for position in list(self._candidates(transaction_id)):
+                rows = self._read_segment(self.segments[position])
+                kept = [row for row in rows if not match(row)]
+                if len(kept) == len(rows):
+                    continue
+                if first_only:
+                    kept = list(rows)
+                    kept.remove(next(row for row in reversed(rows) if match(row)))
+                removed += len(rows) - len(kept)
+                self._rewrite_segment(position, kept)
+                if first_only:
+                    break
+        return removed
+
+    def clear(self):
+        """Efface tout l'historique, archive comprise"""
+        with self._lock:
+            for segment in self.segments:
+                try:
+                    os.remove(self._segment_path(segment))
+                except FileNotFoundError:
+                    pass
+            self.segments = []
+            if os.path.exists(self.index_path):
+                self._save_index()
+            self._write_current([])
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from iostats import tracked_open
+from logs import get_logger
+
+log = get_logger('idempotency')
+
+
+class IdempotencyIndex:
+    """
+    Index borné des clés d'idempotence déjà traitées par /buy et /buy/batch.
+
+    Les clés sont gardées dans l'ordre d'arrivée (OrderedDict) avec la réponse renvoyée,
+    dans une fenêtre limitée en nombre d'entrées et en durée. Une clé en cours de traitement
+    est réservée (claim) : une deuxième requête avec la même clé attend la réponse de la
+    première au lieu d'appliquer la vente une deuxième fois. L'index est persisté en
+    ajout seul (une ligne JSON par clé) et compacté au chargement ou quand le fichier
+    grossit trop, pour survivre à un redémarrage du serveur pendant les rejeux.
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000, window_seconds: int = 12 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.window_seconds = window_seconds
+        self._entries = OrderedDict()  # {key: (epoch, result)}
+        self._in_flight: Dict[str, threading.Event] = {}  # Clés réservées, pas encore de réponse
+        self._lock = threading.Lock()
+        self._lines_on_disk = 0
+        self.load()
+
+    def load(self):
+        """Charger l'index depuis le disque en ne gardant que la fenêtre valide"""
+        with self._lock:
+            self._entries.clear()
+            if not os.path.exists(self.path):
+                return
+            try:
+                with tracked_open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            key, stamp, result = json.loads(line)
+                        except (ValueError, TypeError):
+                            continue
+                        self._entries[key] = (stamp, result)
+                        self._entries.move_to_end(key)
+            except OSError as e:
+                log.error("Erreur lors du chargement de l'index d'idempotence: %s", e)
+                return
+            self._evict(time.time())
+            self._compact()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Retourne la réponse déjà envoyée pour cette clé, ou None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.window_seconds:
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def claim(self, key: str, timeout: float = 10.0) -> Optional[Dict]:
+        """
+        Réserve une clé avant d'appliquer la vente. Retourne la réponse déjà envoyée (rien à faire),
+        ou None : l'appelant détient la clé et doit appeler remember() ou release().
+        Si la clé est en cours de traitement ailleurs, attend la fin ; TimeoutError au-delà de `timeout`.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.time() - entry[0] <= self.window_seconds:
+                    return entry[1]
+                done = self._in_flight.get(key)
+                if done is None:
+                    self._in_flight[key] = threading.Event()
+                    return None
+            # Le détenteur a répondu (remember) ou abandonné (release) : on revérifie
+            if not done.wait(max(0.0, deadline - time.monotonic())):
+                raise TimeoutError(key)
+
+    def release(self, key: str):
+        """
+        Libère une clé réservée sans réponse (échec) ; sans effet si remember() a été appelé.
+        À n'appeler que par le détenteur (claim() a retourné None), sinon sa réservation saute.
+        """
+        with self._lock:
+            done = self._in_flight.pop(key, None)
+        if done is not None:
+            done.set()
+
+    def remember(self, key: str, result: Dict):
+        """Enregistre la réponse associée à une clé"""
+        self.remember_many({key: result})
+
+    def remember_many(self, results: Dict[str, Dict]):
+        """Enregistre plusieurs clés en un seul ajout disque"""
+        if not results:
+            return
+        now = time.time()
+        with self._lock:
+            lines = []
+            for key, result in results.items():
+                self._entries[key] = (now, result)
+                self._entries.move_to_end(key)
+                lines.append(json.dumps([key, now, result]))
+                done = self._in_flight.pop(key, None)
+                if done is not None:
+                    done.set()
+            self._evict(now)
+            try:
+                with tracked_open(self.path, 'a', encoding='utf-8') as f:
+                    f.write('\n'.join(lines) + '\n')
+                self._lines_on_disk += len(lines)
+            except OSError as e:
+                log.error("Erreur lors de la sauvegarde de l'index d'idempotence: %s", e)
+            if self._lines_on_disk > 2 * self.max_entries:
+                self._compact()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        while self._entries:
+            key, (stamp, _) = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_entries or now - stamp > self.window_seconds:
+                del self._entries[key]
+            else:
+                break
+
+    def _compact(self):
+        try:
+            tmp_path = self.path + '.tmp'
+            with tracked_open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, (stamp, result) in self._entries.items():
+                    f.write(json.dumps([key, stamp, result]) + '\n')
+            os.replace(tmp_path, self.path)
+            self._lines_on_disk = len(self._entries)
+        except OSError as e:
+            log.error("Erreur lors du compactage de l'index d'idempotence: %s", e)
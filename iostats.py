@@ -0,0 +1,235 @@
+"""
+Comptabilité des entrées/sorties fichiers par requête.
+
+Les accès aux fichiers de données passent par tracked_open(), qui compte pour la
+requête en cours (ContextVar posée par IOAccountingMiddleware) les ouvertures, les
+octets lus et écrits et les réécritures complètes (ouverture en mode 'w').
+
+Pour rester quasi gratuit, aucun appel read/write n'est intercepté : les octets sont
+déduits de la taille du fichier (avant/après pour les écritures ; taille totale pour les
+lectures, ces fichiers étant toujours lus en entier).
+"""
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+
+class IOStats:
+    __slots__ = ('opens', 'bytes_read', 'bytes_written', 'rewrites', 'appends', 'files')
+
+    def __init__(self):
+        self.opens = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.rewrites = 0
+        self.appends = 0
+        self.files = {}  # {nom de fichier: ouvertures}
+
+    def as_dict(self) -> Dict:
+        return {
+            'opens': self.opens,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'rewrites': self.rewrites,
+            'appends': self.appends,
+            'files': dict(self.files),
+        }
+
+
+_current: ContextVar[Optional[IOStats]] = ContextVar('io_stats', default=None)
+
+# Les accès hors requête (thread de sauvegarde périodique, démarrage) sont regroupés ici
+_background = IOStats()
+_background_lock = threading.Lock()
+
+
+def current_stats() -> IOStats:
+    stats = _current.get()
+    return stats if stats is not None else _background
+
+
+def _size(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class _TrackedFile:
+    """Enveloppe minimale d'un fichier ouvert : la comptabilité se fait à la fermeture"""
+
+    def __init__(self, path, mode, handle, size_before):
+        self._path = path
+        self._mode = mode
+        self._handle = handle
+        self._size_before = size_before
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._handle, name)
+
+    def __iter__(self):
+        return iter(self._handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._handle.close()
+        if 'r' in self._mode and '+' not in self._mode:
+            return
+        stats = current_stats()
+        written = _size(self._path) - (self._size_before if 'a' in self._mode else 0)
+        stats.bytes_written += max(0, written)
+
+
+def tracked_open(path, mode='r', *args, **kwargs):
+    """open() comptabilisé pour la requête en cours"""
+    stats = current_stats()
+    size_before = _size(path) if ('a' in mode or 'r' in mode) else 0
+    handle = open(path, mode, *args, **kwargs)
+
+    stats.opens += 1
+    name = os.path.basename(path)
+    stats.files[name] = stats.files.get(name, 0) + 1
+    if 'r' in mode and '+' not in mode:
+        stats.bytes_read += size_before
+    elif 'w' in mode:
+        stats.rewrites += 1
+    elif 'a' in mode:
+        stats.appends += 1
+    return _TrackedFile(path, mode, handle, size_before)
+
+
+@contextmanager
+def atomic_open(path, mode='w', fsync: bool = True, **kwargs):
+    """
+    Réécriture atomique comptabilisée : on écrit dans path.tmp puis os.replace, si bien qu'un
+    arrêt brutal laisse l'ancien fichier ou le nouveau, jamais un fichier à moitié écrit.
+    fsync=False quand le fichier peut être reconstruit (ex. drinks.csv depuis le journal).
+    """
+    tmp = f'{path}.tmp'
+    f = tracked_open(tmp, mode, **kwargs)
+    try:
+        yield f
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    except BaseException:
+        f.close()
+        os.remove(tmp)
+        raise
+    f.close()
+    os.replace(tmp, path)
+
+
+def repair_tail(path) -> Tuple[int, int]:
+    """
+    Coupe une dernière ligne incomplète (arrêt brutal pendant un ajout), sans quoi le prochain
+    ajout se collerait à elle. Retourne (taille du fichier, octets retirés).
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    size = os.path.getsize(path)
+    if not size:
+        return 0, 0
+    with tracked_open(path, 'rb+') as f:
+        f.seek(max(0, size - 65536))
+        tail = f.read()
+        if tail.endswith(b'\n'):
+            return size, 0
+        removed = len(tail) - tail.rfind(b'\n') - 1
+        f.truncate(size - removed)
+        return size - removed, removed
+
+
+class IOAccounting:
+    """Agrégats par route : totaux, moyennes, maximum par requête et dépassements de budget"""
+
+    def __init__(self, opens_budget: Optional[int] = None):
+        self.opens_budget = opens_budget
+        self._routes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, route: str, stats: IOStats):
+        with self._lock:
+            agg = self._routes.get(route)
+            if agg is None:
+                agg = self._routes[route] = {
+                    'requests': 0, 'opens': 0, 'bytes_read': 0, 'bytes_written': 0,
+                    'rewrites': 0, 'appends': 0, 'max_opens': 0, 'over_budget': 0,
+                }
+            agg['requests'] += 1
+            agg['opens'] += stats.opens
+            agg['bytes_read'] += stats.bytes_read
+            agg['bytes_written'] += stats.bytes_written
+            agg['rewrites'] += stats.rewrites
+            agg['appends'] += stats.appends
+            agg['max_opens'] = max(agg['max_opens'], stats.opens)
+            if self.opens_budget and stats.opens > self.opens_budget:
+                agg['over_budget'] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            routes = {route: dict(agg) for route, agg in self._routes.items()}
+        for agg in routes.values():
+            n = agg['requests'] or 1
+            agg['avg_opens'] = round(agg['opens'] / n, 2)
+            agg['avg_bytes_read'] = round(agg['bytes_read'] / n, 1)
+            agg['avg_bytes_written'] = round(agg['bytes_written'] / n, 1)
+            agg['avg_rewrites'] = round(agg['rewrites'] / n, 2)
+        with _background_lock:
+            background = _background.as_dict()
+        return {'opens_budget': self.opens_budget, 'routes': routes, 'background': background}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+class IOAccountingMiddleware:
+    """
+    Middleware ASGI : ouvre un compteur par requête, l'agrège par route et,
+    en mode debug, ajoute les en-têtes X-IO-* à la réponse.
+    """
+
+    def __init__(self, app, accounting: IOAccounting, debug: bool = False):
+        self.app = app
+        self.accounting = accounting
+        self.debug = debug
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = IOStats()
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if self.debug and message['type'] == 'http.response.start':
+                headers = list(message.get('headers', []))
+                headers += [
+                    (b'x-io-opens', str(stats.opens).encode()),
+                    (b'x-io-bytes-read', str(stats.bytes_read).encode()),
+                    (b'x-io-bytes-written', str(stats.bytes_written).encode()),
+                    (b'x-io-rewrites', str(stats.rewrites).encode()),
+                ]
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get('route'), 'path', None) or 'static'
+            self.accounting.record(route, stats)
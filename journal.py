@@ -0,0 +1,88 @@
+"""
+Journal d'écriture anticipée (WAL) des mutations du marché, avec instantanés compacts.
+
+Chaque mutation (prix et fiches des boissons, unités vendues, Happy Hours) est ajoutée à
+data/wal.jsonl, une ligne JSON numérotée et synchronisée sur disque, AVANT la réécriture de
+drinks.csv. Régulièrement (toutes les `snapshot_every` opérations, à la sauvegarde périodique
+et à l'arrêt), l'état complet est écrit atomiquement dans data/snapshot.json et le journal est
+vidé.
+
+Au démarrage, on charge l'instantané et on ne rejoue que la queue du journal : après une
+coupure de courant, la reprise coûte au plus `snapshot_every` lignes, et drinks.csv (qui a pu
+être coupé en pleine écriture) est reconstruit. Les Happy Hours actives sont restaurées.
+
+Une ligne de fin de journal tronquée par la coupure est ignorée : l'opération correspondante
+n'avait pas été confirmée.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from iostats import atomic_open, tracked_open
+from logs import get_logger
+
+log = get_logger('journal')
+
+
+class Journal:
+    def __init__(self, data_dir: str, snapshot_every: int = 500, fsync: bool = True):
+        self.wal_path = os.path.join(data_dir, 'wal.jsonl')
+        self.snapshot_path = os.path.join(data_dir, 'snapshot.json')
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.seq = 0  # Numéro de la dernière opération journalisée
+        self.pending = 0  # Opérations journalisées depuis le dernier instantané
+
+    def load(self) -> Tuple[Optional[Dict], List[Dict]]:
+        """(instantané ou None, opérations postérieures à l'instantané)"""
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            try:
+                with tracked_open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except ValueError as e:
+                log.error("Instantané illisible (%s), reprise depuis les fichiers: %s", self.snapshot_path, e)
+        snapshot_seq = snapshot['seq'] if snapshot else 0
+
+        tail = []
+        if os.path.exists(self.wal_path):
+            with tracked_open(self.wal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning("Ligne de journal tronquée ignorée")
+                        continue
+                    if record['seq'] > snapshot_seq:
+                        tail.append(record)
+        self.seq = max([snapshot_seq] + [record['seq'] for record in tail])
+        self.pending = len(tail)
+        return snapshot, tail
+
+    def append(self, op: str, **fields) -> Dict:
+        """Ajoute une opération et la synchronise sur disque avant de rendre la main"""
+        self.seq += 1
+        record = {'seq': self.seq, 't': time.time(), 'op': op, **fields}
+        with tracked_open(self.wal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending += 1
+        return record
+
+    @property
+    def snapshot_due(self) -> bool:
+        return self.pending >= self.snapshot_every
+
+    def write_snapshot(self, state: Dict):
+        """
+        Écrit l'état complet puis vide le journal. Si l'arrêt survient entre les deux, les
+        opérations encore présentes ont un numéro <= celui de l'instantané et sont ignorées.
+        """
+        with atomic_open(self.snapshot_path, 'w', fsync=self.fsync, encoding='utf-8') as f:
+            json.dump({'seq': self.seq, 'written_at': time.time(), **state}, f, separators=(',', ':'))
+        with atomic_open(self.wal_path, 'w', fsync=self.fsync, encoding='utf-8'):
+            pass
+        self.pending = 0
@@ -0,0 +1,151 @@
+"""
+Classements tenus à jour au fil de l'eau pour les écrans et la page admin : plus fortes hausses
+et baisses depuis l'ouverture, boissons les plus commandées sur les 15 dernières minutes.
+
+Chaque classement est une liste triée de (score, drink_id) : un changement de prix ou une vente
+déplace une seule entrée (bisect), et les k premiers se lisent en O(k) sans rien recalculer.
+Les ventes de la fenêtre glissante sont dans une file (deque) : celles qui sortent de la
+fenêtre sont retirées au fur et à mesure, chacune une seule fois. Un achat annulé arrive avec
+une quantité négative et retire la vente correspondante de la fenêtre.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+
+class RankedScores:
+    """Scores par boisson, gardés triés"""
+
+    def __init__(self):
+        self._order = []  # [(score, drink_id)] trié
+        self._scores: Dict[int, float] = {}
+
+    def set(self, drink_id: int, score: float):
+        old = self._scores.get(drink_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._order[bisect_left(self._order, (old, drink_id))]
+        insort(self._order, (score, drink_id))
+        self._scores[drink_id] = score
+
+    def discard(self, drink_id: int):
+        old = self._scores.pop(drink_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (old, drink_id))]
+
+    def clear(self):
+        self._order.clear()
+        self._scores.clear()
+
+    def highest(self, k: int, keep: Callable[[int], bool], above: float = 0.0) -> List[tuple]:
+        """Les k meilleurs scores strictement supérieurs à `above`, du plus haut au plus bas"""
+        result = []
+        for score, drink_id in reversed(self._order):
+            if len(result) >= k or score <= above:
+                break
+            if keep(drink_id):
+                result.append((drink_id, score))
+        return result
+
+    def lowest(self, k: int, keep: Callable[[int], bool], below: float = 0.0) -> List[tuple]:
+        """Les k plus bas scores strictement inférieurs à `below`, du plus bas au plus haut"""
+        result = []
+        for score, drink_id in self._order:
+            if len(result) >= k or score >= below:
+                break
+            if keep(drink_id):
+                result.append((drink_id, score))
+        return result
+
+
+class Leaderboards:
+    def __init__(self, window_seconds: float = 900.0):
+        self.window_seconds = window_seconds
+        self.opened_at = time.time()
+        self._open: Dict[int, float] = {}  # {drink_id: prix à l'ouverture}
+        self._prices: Dict[int, float] = {}
+        self._moves = RankedScores()  # Variation relative depuis l'ouverture
+        self._sales = deque()  # (epoch, drink_id, quantité), dans l'ordre d'arrivée
+        self._traded: Dict[int, int] = {}  # {drink_id: quantité dans la fenêtre}
+        self._volume = RankedScores()
+        self._lock = threading.Lock()
+
+    def reset_open(self, open_prices: Dict[int, float], prices: Dict[int, float], opened_at: Optional[float] = None):
+        """Nouvelle ouverture (démarrage, début de session) : prix d'ouverture et prix actuels"""
+        with self._lock:
+            self.opened_at = opened_at or time.time()
+            self._open = dict(open_prices)
+            self._prices = {}
+            self._moves.clear()
+            for drink_id, price in prices.items():
+                self._move(drink_id, price)
+
+    def _move(self, drink_id: int, price: float):
+        self._prices[drink_id] = price
+        # Boisson ajoutée après l'ouverture : elle ouvre à son premier prix
+        open_price = self._open.setdefault(drink_id, price)
+        self._moves.set(drink_id, (price - open_price) / open_price if open_price else 0.0)
+
+    def on_price(self, drink_id: int, price: float, quantity: int = 0, stamp: Optional[float] = None):
+        """Listener de prix de CSVDataManager : déplace la boisson dans les classements"""
+        with self._lock:
+            self._move(drink_id, price)
+            if quantity > 0:
+                self._record_sale(drink_id, quantity, stamp or time.time())
+            elif quantity < 0:
+                self._cancel_sale(drink_id, -quantity)
+
+    def record_sale(self, drink_id: int, quantity: int, stamp: float):
+        """Vente passée (reprise au démarrage depuis l'historique), dans l'ordre chronologique"""
+        with self._lock:
+            self._record_sale(drink_id, quantity, stamp)
+
+    def _record_sale(self, drink_id: int, quantity: int, stamp: float):
+        self._sales.append((stamp, drink_id, quantity))
+        self._traded[drink_id] = self._traded.get(drink_id, 0) + quantity
+        self._volume.set(drink_id, self._traded[drink_id])
+
+    def _cancel_sale(self, drink_id: int, quantity: int):
+        """Retire la dernière vente correspondante (achat annulé) ; rien si elle est déjà sortie de la fenêtre"""
+        for i in range(len(self._sales) - 1, -1, -1):
+            if self._sales[i][1:] == (drink_id, quantity):
+                del self._sales[i]
+                self._remove_traded(drink_id, quantity)
+                return
+
+    def _remove_traded(self, drink_id: int, quantity: int):
+        remaining = self._traded[drink_id] - quantity
+        if remaining > 0:
+            self._traded[drink_id] = remaining
+            self._volume.set(drink_id, remaining)
+        else:
+            del self._traded[drink_id]
+            self._volume.discard(drink_id)
+
+    def _expire(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._sales and self._sales[0][0] <= cutoff:
+            _, drink_id, quantity = self._sales.popleft()
+            self._remove_traded(drink_id, quantity)
+
+    def top(self, k: int = 5, keep: Callable[[int], bool] = lambda drink_id: True) -> Dict:
+        """Les k plus fortes hausses, baisses et ventes ; `keep` écarte les boissons supprimées"""
+        with self._lock:
+            self._expire(time.time())
+            gainers = self._moves.highest(k, keep)
+            losers = self._moves.lowest(k, keep)
+            traded = self._volume.highest(k, keep)
+            return {
+                'opened_at': self.opened_at,
+                'window_seconds': self.window_seconds,
+                'gainers': [self._move_entry(drink_id, change) for drink_id, change in gainers],
+                'losers': [self._move_entry(drink_id, change) for drink_id, change in losers],
+                'most_traded': [{'drink_id': drink_id, 'quantity': int(quantity)} for drink_id, quantity in traded],
+            }
+
+    def _move_entry(self, drink_id: int, change: float) -> Dict:
+        return {'drink_id': drink_id, 'open_price': self._open[drink_id], 'price': self._prices[drink_id],
+                'change_pct': change * 100}
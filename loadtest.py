@@ -0,0 +1,299 @@
+"""
+Générateur de charge HTTP pour dimensionner le serveur avant un événement.
+
+Lance server:app dans un répertoire de données temporaire (ou cible un serveur existant
+avec --url) et simule :
+  - N terminaux de commande qui enchaînent des POST /buy
+  - M écrans d'affichage qui interrogent /prices, /sync/timer et /happy-hour/active
+  - un poste admin qui interroge /admin/session/current
+
+Le rapport (JSON) donne par endpoint le débit, les latences p50/p95/p99 et le taux d'erreur.
+
+Le serveur est lancé avec un seul worker uvicorn : la pile d'annulation, l'index d'idempotence
+et la carte publiée vivent dans le processus, plusieurs workers ne fonctionneraient pas correctement.
+
+Exemple :
+    python loadtest.py --terminals 8 --boards 20 --duration 60 --output rapport.json
+"""
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ADMIN_AUTH = "Basic " + base64.b64encode(b"admin:admin").decode()
+BOARD_ENDPOINTS = ["/prices", "/sync/timer", "/happy-hour/active"]
+
+
+class Recorder:
+    """Collecte les latences et erreurs par endpoint (partagé entre les threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # {endpoint: [ms, ...]}
+        self.errors = {}  # {endpoint: {raison: nombre}}
+
+    def record(self, endpoint: str, elapsed_ms: float, error: str = None):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed_ms)
+            if error:
+                per_endpoint = self.errors.setdefault(endpoint, {})
+                per_endpoint[error] = per_endpoint.get(error, 0) + 1
+
+    def report(self, duration_s: float) -> dict:
+        endpoints = {}
+        total_requests = 0
+        total_errors = 0
+        with self._lock:
+            for endpoint, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                errors = sum(self.errors.get(endpoint, {}).values())
+                total_requests += len(values)
+                total_errors += errors
+                endpoints[endpoint] = {
+                    "requests": len(values),
+                    "throughput_rps": round(len(values) / duration_s, 2),
+                    "latency_ms": {
+                        "p50": percentile(values, 50),
+                        "p95": percentile(values, 95),
+                        "p99": percentile(values, 99),
+                        "max": round(values[-1], 2) if values else None,
+                        "mean": round(sum(values) / len(values), 2) if values else None,
+                    },
+                    "errors": errors,
+                    "error_rate": round(errors / len(values), 4) if values else 0.0,
+                    "error_breakdown": dict(self.errors.get(endpoint, {})),
+                }
+        return {
+            "duration_s": round(duration_s, 2),
+            "total_requests": total_requests,
+            "total_throughput_rps": round(total_requests / duration_s, 2),
+            "total_errors": total_errors,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(sorted_values, pct):
+    """Percentile par rang le plus proche sur une liste déjà triée"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[rank], 2)
+
+
+class Client:
+    """Connexion HTTP keep-alive d'un terminal simulé, reconnectée en cas d'erreur"""
+
+    def __init__(self, base_url: str, recorder: Recorder, timeout: float = 10.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.recorder = recorder
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method: str, path: str, body: dict = None, headers: dict = None, label: str = None):
+        label = label or path.split("?")[0]
+        payload = json.dumps(body).encode() if body is not None else None
+        all_headers = {"Connection": "keep-alive"}
+        if payload is not None:
+            all_headers["Content-Type"] = "application/json"
+        all_headers.update(headers or {})
+
+        start = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(method, path, body=payload, headers=all_headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            error = None if response.status < 400 else f"http_{response.status}"
+            self.recorder.record(label, elapsed_ms, error)
+            return response.status, data
+        except (OSError, http.client.HTTPException) as e:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.recorder.record(label, elapsed_ms, type(e).__name__)
+            self.close()
+            return None, None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def terminal_worker(base_url, recorder, stop_event, drink_ids, think_time):
+    client = Client(base_url, recorder)
+    while not stop_event.is_set():
+        client.request("POST", "/buy", {"drink_id": random.choice(drink_ids), "quantity": random.choice([1, 1, 1, 2])})
+        if think_time:
+            stop_event.wait(random.uniform(0.5, 1.5) * think_time)
+    client.close()
+
+
+def board_worker(base_url, recorder, stop_event, interval):
+    client = Client(base_url, recorder)
+    # Décaler les écrans pour éviter qu'ils interrogent tous en même temps
+    stop_event.wait(random.uniform(0, interval))
+    while not stop_event.is_set():
+        for endpoint in BOARD_ENDPOINTS:
+            client.request("GET", endpoint)
+        stop_event.wait(interval)
+    client.close()
+
+
+def admin_worker(base_url, recorder, stop_event, interval):
+    client = Client(base_url, recorder)
+    while not stop_event.is_set():
+        client.request("GET", "/admin/session/current", headers={"Authorization": ADMIN_AUTH})
+        stop_event.wait(interval)
+    client.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(base_url: str, timeout: float = 30.0):
+    parts = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Le serveur {base_url} n'a pas démarré en {timeout}s")
+
+
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    """Démarre server:app avec le répertoire temporaire comme répertoire courant (donc data/ isolé)"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = repo_dir + os.pathsep + env.get("PYTHONPATH", "")
+    cmd = [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(cmd, cwd=workdir, env=env)
+
+
+def fetch_drink_ids(base_url: str) -> list:
+    client = Client(base_url, Recorder())
+    status, data = client.request("GET", "/prices")
+    client.close()
+    if status != 200:
+        raise RuntimeError("Impossible de lire /prices avant le test")
+    return [drink["id"] for drink in json.loads(data)["prices"]] or [1]
+
+
+def run(args) -> dict:
+    workdir = None
+    server = None
+    base_url = args.url
+    try:
+        if base_url is None:
+            workdir = tempfile.mkdtemp(prefix="biere_loadtest_")
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            server = start_server(workdir, port)
+        wait_until_ready(base_url)
+
+        setup = Client(base_url, Recorder())
+        if args.start_session:
+            setup.request("POST", "/admin/session/start", {"session_name": "loadtest"},
+                          headers={"Authorization": ADMIN_AUTH})
+        if args.immediate:
+            setup.request("POST", "/config/interval", {"interval_ms": 0}, headers={"Authorization": ADMIN_AUTH})
+        setup.close()
+        drink_ids = fetch_drink_ids(base_url)
+
+        recorder = Recorder()
+        stop_event = threading.Event()
+        threads = []
+        for _ in range(args.terminals):
+            threads.append(threading.Thread(target=terminal_worker, daemon=True,
+                                            args=(base_url, recorder, stop_event, drink_ids, args.think_time)))
+        for _ in range(args.boards):
+            threads.append(threading.Thread(target=board_worker, daemon=True,
+                                            args=(base_url, recorder, stop_event, args.board_interval)))
+        if args.admin:
+            threads.append(threading.Thread(target=admin_worker, daemon=True,
+                                            args=(base_url, recorder, stop_event, args.admin_interval)))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=15)
+        elapsed = time.perf_counter() - started
+
+        report = recorder.report(elapsed)
+        report["config"] = {
+            "target": base_url,
+            "terminals": args.terminals,
+            "boards": args.boards,
+            "admin": args.admin,
+            "think_time_s": args.think_time,
+            "board_interval_s": args.board_interval,
+            "admin_interval_s": args.admin_interval,
+            "immediate_mode": args.immediate,
+            "drinks": len(drink_ids),
+        }
+        return report
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir and not args.keep_data:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge HTTP du serveur Cours de la Bière")
+    parser.add_argument("--terminals", type=int, default=4, help="Nombre de terminaux de commande (POST /buy)")
+    parser.add_argument("--boards", type=int, default=10, help="Nombre d'écrans d'affichage")
+    parser.add_argument("--no-admin", dest="admin", action="store_false", help="Ne pas simuler le poste admin")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée du test en secondes")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Pause moyenne entre deux commandes d'un terminal (s), 0 = au maximum")
+    parser.add_argument("--board-interval", type=float, default=1.0, help="Intervalle de rafraîchissement des écrans (s)")
+    parser.add_argument("--admin-interval", type=float, default=2.0, help="Intervalle d'interrogation admin (s)")
+    parser.add_argument("--immediate", action="store_true", help="Passer le marché en mode immédiat (interval 0)")
+    parser.add_argument("--no-session", dest="start_session", action="store_false",
+                        help="Ne pas démarrer de session (les ventes ne sont pas enregistrées)")
+    parser.add_argument("--url", default=None, help="Cibler un serveur déjà lancé au lieu d'en démarrer un")
+    parser.add_argument("--keep-data", action="store_true", help="Conserver le répertoire de données temporaire")
+    parser.add_argument("--output", default=None, help="Fichier où écrire le rapport JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
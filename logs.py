@@ -0,0 +1,211 @@
+"""
+Journalisation structurée (JSON) et non bloquante.
+
+Les handlers de requêtes ne font qu'ajouter l'enregistrement dans une file en mémoire
+(QueueHandler) ; un thread QueueListener se charge du formatage JSON et des écritures
+dans server.log et sur la console. Le contexte de la requête (request_id, route,
+drink_id, transaction_id...) est porté par une ContextVar et recopié dans chaque ligne.
+
+Les erreurs répétées (même message, même logger) sont limitées : au plus `burst`
+lignes par fenêtre de `window` secondes, le nombre de lignes supprimées étant indiqué
+sur la ligne suivante autorisée.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+
+_context: ContextVar[Dict] = ContextVar('log_context', default={})
+_listener: Optional[logging.handlers.QueueListener] = None
+_exc_formatter = logging.Formatter()
+
+
+def bind(**fields):
+    """Ajoute des champs au contexte de log de la requête en cours"""
+    _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+
+
+def get_context() -> Dict:
+    return _context.get()
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'biere.{name}')
+
+
+class ContextFilter(logging.Filter):
+    """Recopie le contexte dans l'enregistrement, dans le thread appelant (avant la file)"""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Limite les messages identiques de niveau >= WARNING"""
+
+    def __init__(self, burst: int = 5, window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._state = {}  # {(logger, message): [début de fenêtre, émis, supprimés]}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self._state[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+
+def _exception_text(record) -> Optional[str]:
+    """Trace mise en texte avant la file (voir _QueueHandler.prepare), ou à partir de exc_info"""
+    exc = getattr(record, 'exc', None)
+    if exc is None and record.exc_info:
+        exc = _exc_formatter.formatException(record.exc_info)
+    return exc
+
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'context', 'message', 'suppressed', 'exc'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'context', {}) or {})
+        # Champs passés via extra={...}
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed_repeats'] = record.suppressed
+        exc = _exception_text(record)
+        if exc:
+            entry['exc'] = exc
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Format lisible pour la console : message puis contexte compact"""
+
+    def format(self, record):
+        line = f"{datetime.fromtimestamp(record.created).strftime('%H:%M:%S')} {record.levelname:<7} {record.getMessage()}"
+        context = getattr(record, 'context', None)
+        if context:
+            line += '  [' + ' '.join(f'{k}={v}' for k, v in context.items()) + ']'
+        if getattr(record, 'suppressed', 0):
+            line += f' (+{record.suppressed} répétitions supprimées)'
+        exc = _exception_text(record)
+        if exc:
+            line += '\n' + exc
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Comme QueueHandler.prepare : message et trace mis en texte dans le thread appelant, sans
+        # garder les arguments (objets qui peuvent encore changer) ni l'exception (et ses frames).
+        # Le formatage JSON / console reste au thread d'écriture.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.exc = _exception_text(record) or record.exc_text
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.context = getattr(record, 'context', None)
+        return record
+
+
+def setup_logging(log_file: str = 'server.log', level: int = logging.INFO, console: bool = True):
+    """Installe la file de logs et son thread d'écriture (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+    handlers = []
+    try:
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    except OSError:
+        pass
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(ConsoleFormatter())
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger('biere')
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """Middleware ASGI : attribue un request_id (ou reprend X-Request-ID) et le renvoie dans la réponse"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get('headers', []):
+            if name == b'x-request-id':
+                request_id = value.decode('latin-1')[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:12]
+        token = _context.set({'request_id': request_id, 'method': scope.get('method'), 'path': scope.get('path')})
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': list(message.get('headers', [])) + [(b'x-request-id', request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _context.reset(token)
@@ -0,0 +1,220 @@
+"""
+Métriques au format texte Prometheus, sans dépendance externe.
+
+Les compteurs et histogrammes sont de simples dictionnaires protégés par un verrou :
+une observation coûte une recherche dichotomique et deux additions, ce qui reste
+négligeable devant le travail d'une requête. Les jauges peuvent être calculées à la
+demande (callback) au moment de la collecte.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bornes des histogrammes de latence, en secondes
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        return self._values.get(key, 0.0)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}'
+                                for key, v in items]
+
+
+class Gauge(Metric):
+    """Jauge fixée explicitement, ou calculée par un callback au moment de la collecte"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                result = self.callback()
+            except Exception:
+                return self.header()
+            # Le callback renvoie soit une valeur, soit {(labels...): valeur}
+            items = list(result.items()) if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}'
+                                for key, v in items if v is not None]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # {labels: [compte par borne..., +Inf, somme]}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+
+http_requests_total = registry.counter(
+    'biere_http_requests_total', 'Nombre de requêtes HTTP par route, méthode et code', ('route', 'method', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'biere_http_request_duration_seconds', 'Latence des requêtes HTTP par route', ('route', 'method'))
+buys_total = registry.counter('biere_buys_total', 'Achats enregistrés', ('mode', 'source'))
+market_events_total = registry.counter('biere_market_events_total', 'Événements de marché déclenchés', ('event', 'level'))
+happy_hours_total = registry.counter('biere_happy_hours_total', 'Actions sur les Happy Hours', ('action',))
+
+
+def route_label(scope, status: int) -> str:
+    """Nom de route stable (gabarit de chemin) pour éviter l'explosion des séries"""
+    path = getattr(scope.get('route'), 'path', None)
+    if path is None:
+        if scope.get('biere.rejected'):
+            # Refusée par le contrôle d'admission avant le routage (voir admission.py)
+            return 'rejected'
+        # Hors routes API : fichiers statiques servis par le montage "/" ou 404
+        return 'unmatched' if status == 404 else 'static'
+    return path
+
+
+class MetricsMiddleware:
+    """Middleware ASGI pur (pas de BaseHTTPMiddleware) qui chronomètre chaque requête HTTP"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status_holder[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_label(scope, status_holder[0])
+            method = scope.get('method', '')
+            http_request_duration_seconds.observe(time.perf_counter() - start, route=route, method=method)
+            http_requests_total.inc(route=route, method=method, status=status_holder[0])
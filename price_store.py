@@ -0,0 +1,184 @@
+"""
+Historique des prix indexé par le temps, pour tracer une soirée entière côté écran.
+
+Chaque boisson a deux tableaux parallèles (horodatages epoch et prix) triés par temps :
+une plage [from, to] se trouve par recherche dichotomique (bisect), puis est réduite
+au nombre de points demandé avec LTTB (Largest-Triangle-Three-Buckets), qui garde
+l'allure de la courbe (pics et creux) bien mieux qu'un échantillonnage régulier.
+
+Les points sont gardés en mémoire et ajoutés à price_ticks.csv par lots
+(flush() depuis la sauvegarde périodique et à l'arrêt).
+"""
+import csv
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from iostats import tracked_open
+from logs import get_logger
+
+log = get_logger('price_store')
+
+
+def lttb(times, values, threshold: int) -> List[Tuple[float, float]]:
+    """Réduit une série à `threshold` points (Largest-Triangle-Three-Buckets)"""
+    n = len(times)
+    if threshold >= n:
+        return list(zip(times, values))
+    if threshold < 3:
+        # Pas de seau entre les deux extrémités : on garde seulement celles-ci
+        return [(times[0], values[0]), (times[-1], values[-1])]
+
+    sampled = [(times[0], values[0])]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # Point retenu dans le seau précédent
+    for i in range(threshold - 2):
+        # Moyenne du seau suivant (troisième sommet du triangle)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        count = next_end - next_start
+        avg_t = sum(times[next_start:next_end]) / count
+        avg_v = sum(values[next_start:next_end]) / count
+
+        # Dans le seau courant, garder le point qui forme le plus grand triangle
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        at, av = times[a], values[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((at - avg_t) * (values[j] - av) - (at - times[j]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append((times[best], values[best]))
+        a = best
+
+    sampled.append((times[-1], values[-1]))
+    return sampled
+
+
+class PriceStore:
+    def __init__(self, path: str, retention_hours: float = 24.0):
+        self.path = path
+        self.retention_seconds = retention_hours * 3600
+        self._series: Dict[int, Tuple[array, array]] = {}  # {drink_id: (horodatages, prix)}
+        self._pending: List[Tuple[int, float, float]] = []
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Recharge les points encore dans la fenêtre de rétention (compacte le fichier si besoin)"""
+        with self._lock:
+            self._series.clear()
+            if not os.path.exists(self.path):
+                return
+            cutoff = time.time() - self.retention_seconds
+            kept = dropped = 0
+            try:
+                with tracked_open(self.path, 'r', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    next(reader, None)
+                    for row in reader:
+                        try:
+                            drink_id, stamp, price = int(row[0]), float(row[1]), float(row[2])
+                        except (ValueError, IndexError):
+                            continue
+                        if stamp < cutoff:
+                            dropped += 1
+                            continue
+                        self._insert(drink_id, stamp, price)
+                        kept += 1
+            except OSError as e:
+                log.error("Erreur lors du chargement de l'historique des prix: %s", e)
+                return
+            if dropped:
+                self._rewrite()
+            log.info("Historique des prix chargé: %s points (%s expirés)", kept, dropped)
+
+    def record(self, drink_id: int, price: float, stamp: Optional[float] = None):
+        stamp = time.time() if stamp is None else stamp
+        with self._lock:
+            self._insert(drink_id, stamp, float(price))
+            self._pending.append((drink_id, stamp, float(price)))
+
+    def flush(self) -> int:
+        """Écrit les points en attente en un seul ajout ; retourne le nombre de points écrits"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                is_new = not os.path.exists(self.path)
+                with tracked_open(self.path, 'a', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    if is_new:
+                        writer.writerow(['drink_id', 'timestamp', 'price'])
+                    writer.writerows((d, f'{t:.3f}', p) for d, t, p in pending)
+            except OSError as e:
+                self._pending = pending + self._pending
+                log.error("Erreur lors de la sauvegarde de l'historique des prix: %s", e)
+                return 0
+            return len(pending)
+
+    def drink_ids(self) -> List[int]:
+        with self._lock:
+            return sorted(self._series)
+
+    def last(self, drink_id: int) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            series = self._series.get(drink_id)
+            if not series or not series[0]:
+                return None
+            return series[0][-1], series[1][-1]
+
+    def query(self, drink_id: int, start: Optional[float] = None, end: Optional[float] = None,
+              points: Optional[int] = None) -> Dict:
+        """
+        Points de la boisson entre start et end (epoch), réduits à `points` si besoin.
+        Le dernier prix connu avant `start` est ramené à `start` pour que la courbe
+        commence au bord de la fenêtre.
+        """
+        with self._lock:
+            series = self._series.get(drink_id)
+            if series is None:
+                return {'total': 0, 'points': []}
+            times, prices = series
+            lo = 0 if start is None else bisect_left(times, start)
+            hi = len(times) if end is None else bisect_right(times, end)
+            t_slice = times[lo:hi].tolist()
+            p_slice = prices[lo:hi].tolist()
+            if lo > 0 and start is not None and (not t_slice or t_slice[0] > start):
+                t_slice.insert(0, start)
+                p_slice.insert(0, prices[lo - 1])
+
+        total = len(t_slice)
+        sampled = lttb(t_slice, p_slice, points) if points else list(zip(t_slice, p_slice))
+        return {'total': total, 'points': sampled}
+
+    def _insert(self, drink_id: int, stamp: float, price: float):
+        series = self._series.get(drink_id)
+        if series is None:
+            series = self._series[drink_id] = (array('d'), array('d'))
+        times, prices = series
+        if not times or stamp >= times[-1]:
+            times.append(stamp)
+            prices.append(price)
+        else:
+            # Horloge qui recule ou points rechargés dans le désordre : rare, insertion triée
+            index = bisect_right(times, stamp)
+            times.insert(index, stamp)
+            prices.insert(index, price)
+
+    def _rewrite(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with tracked_open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['drink_id', 'timestamp', 'price'])
+                for drink_id, (times, prices) in self._series.items():
+                    writer.writerows((drink_id, f'{t:.3f}', p) for t, p in zip(times, prices))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("Erreur lors du compactage de l'historique des prix: %s", e)
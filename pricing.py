@@ -0,0 +1,186 @@
+"""
+Modèles de prix interchangeables.
+
+Un modèle calcule en un seul appel vectorisé (numpy) les nouveaux prix de toutes les
+boissons pour un pas de marché, à partir de l'état du marché sous forme de tableaux
+et des quantités achetées pendant ce pas. Aucun modèle ne boucle sur les boissons en
+Python : un modèle plus riche ne coûte pas plus cher sur le chemin d'un achat.
+
+Les calculs se font sur le dernier axe, si bien que les mêmes modèles servent au
+backtest (backtest.simulate, --model) sur un état (jeux de paramètres x boissons),
+les paramètres étant alors des colonnes (jeux de paramètres x 1).
+
+Les modèles sont enregistrés par nom (@register_model) et choisis sans modifier le code :
+par lieu dans data/pricing.json, par session au démarrage, ou via /admin/pricing.
+
+    {
+        "default": {"model": "classic"},
+        "venues": {"bar-du-port": {"model": "mean_reverting", "params": {"reversion": 0.05}}}
+    }
+"""
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from logs import get_logger
+
+log = get_logger('pricing')
+
+MODELS: Dict[str, type] = {}
+
+
+def register_model(cls):
+    """Décorateur : rend un modèle disponible sous cls.name"""
+    MODELS[cls.name] = cls
+    return cls
+
+
+def available_models() -> Dict[str, Dict]:
+    return {name: {'description': cls.description, 'params': dict(cls.defaults)} for name, cls in MODELS.items()}
+
+
+def get_model(name: str, params: Optional[Dict] = None) -> 'PricingModel':
+    cls = MODELS.get(name)
+    if cls is None:
+        raise ValueError(f"Modèle de prix inconnu: {name} (disponibles: {', '.join(sorted(MODELS))})")
+    return cls(**(params or {}))
+
+
+class MarketState:
+    """État du marché en tableaux alignés (une case par boisson)"""
+    __slots__ = ('price', 'base', 'min', 'max', 'sold')
+
+    def __init__(self, price, base, min_price, max_price, sold=None):
+        self.price = price
+        self.base = base
+        self.min = min_price
+        self.max = max_price
+        self.sold = sold if sold is not None else np.zeros_like(price)  # Unités vendues depuis le début
+
+
+class PricingModel:
+    name = ''
+    description = ''
+    defaults: Dict[str, float] = {}
+    bounds: Dict[str, Tuple[float, float]] = {}  # Bornes incluses par paramètre ; [0, +inf[ sinon
+
+    def __init__(self, **params):
+        unknown = set(params) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Paramètres inconnus pour {self.name}: {', '.join(sorted(unknown))}")
+        self.params = {key: self._check(key, value) for key, value in {**self.defaults, **params}.items()}
+        for key, value in self.params.items():
+            setattr(self, key, value)
+
+    def _check(self, key: str, value):
+        """Nombre fini dans les bornes (ValueError sinon) ; les colonnes numpy du backtest restent des tableaux"""
+        try:
+            value = np.asarray(value, dtype=float) if isinstance(value, (list, np.ndarray)) else float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Paramètre {key} de {self.name} non numérique: {value!r}")
+        low, high = self.bounds.get(key, (0.0, np.inf))
+        if not np.all(np.isfinite(value)) or np.any(value < low) or np.any(value > high):
+            shown = value.ravel().tolist() if isinstance(value, np.ndarray) else value
+            raise ValueError(f"Paramètre {key} de {self.name} hors bornes [{low}, {high}]: {shown}")
+        return value
+
+    def describe(self) -> Dict:
+        return {'model': self.name, 'params': {k: (v.tolist() if isinstance(v, np.ndarray) else v)
+                                               for k, v in self.params.items()}}
+
+    def compute(self, state: MarketState, quantities, volatility):
+        """Nouveaux prix (non bornés) ; à définir par chaque modèle"""
+        raise NotImplementedError
+
+    def step(self, state: MarketState, quantities, volatility=1.0, immediate: bool = True):
+        """
+        Un pas de marché. quantities : unités achetées par boisson pendant ce pas.
+        En mode marché (immediate=False), seules les boissons achetées bougent et la
+        volatilité ne s'applique pas, comme apply_buy_simple.
+        """
+        if not immediate:
+            volatility = 1.0
+        new_prices = self.compute(state, quantities, volatility)
+        if not immediate:
+            new_prices = np.where(quantities > 0, new_prices, state.price)
+        return np.clip(new_prices, state.min, state.max)
+
+
+def _others(quantities):
+    """Unités achetées sur les autres boissons, pour chaque boisson"""
+    return np.sum(quantities, axis=-1, keepdims=True) - quantities
+
+
+@register_model
+class ClassicModel(PricingModel):
+    name = 'classic'
+    description = "Règle historique : +up du prix de base par unité achetée, -down du prix courant par unité achetée ailleurs"
+    defaults = {'up': 0.01, 'down': 0.005}
+
+    def compute(self, state, quantities, volatility):
+        step_up = np.where(quantities > 0, np.maximum(self.up * state.base * quantities, 0.01), 0.0)
+        step_down = self.down * state.price * _others(quantities)
+        return state.price + (step_up - step_down) * volatility
+
+
+@register_model
+class ElasticityModel(PricingModel):
+    name = 'elasticity'
+    description = "Prix multiplicatif selon l'écart de la demande de chaque boisson à la demande moyenne du pas"
+    defaults = {'elasticity': 0.02}
+
+    def compute(self, state, quantities, volatility):
+        mean_demand = np.mean(quantities, axis=-1, keepdims=True)
+        return state.price * np.exp(self.elasticity * volatility * (quantities - mean_demand))
+
+
+@register_model
+class MeanRevertingModel(PricingModel):
+    name = 'mean_reverting'
+    description = "Règle classique plus un rappel d'une fraction `reversion` de l'écart au prix de base à chaque pas"
+    defaults = {'up': 0.01, 'down': 0.005, 'reversion': 0.02}
+    bounds = {'reversion': (0.0, 1.0)}
+
+    def compute(self, state, quantities, volatility):
+        step_up = np.where(quantities > 0, np.maximum(self.up * state.base * quantities, 0.01), 0.0)
+        step_down = self.down * state.price * _others(quantities)
+        pull = self.reversion * (state.base - state.price)
+        return state.price + (step_up - step_down) * volatility + pull
+
+
+@register_model
+class InventoryAwareModel(PricingModel):
+    name = 'inventory'
+    description = ("Vise un prix de base majoré selon la part des ventes cumulées de la boisson "
+                   "par rapport à la moyenne (les boissons qui partent vite restent chères)")
+    defaults = {'sensitivity': 0.1, 'smoothing': 0.3, 'up': 0.01}
+    bounds = {'smoothing': (0.0, 1.0)}
+
+    def compute(self, state, quantities, volatility):
+        sold = state.sold + quantities
+        mean_sold = np.mean(sold, axis=-1, keepdims=True)
+        target = state.base * (1 + self.sensitivity * volatility * (sold - mean_sold) / (mean_sold + 1))
+        step_up = np.where(quantities > 0, self.up * state.base * quantities * volatility, 0.0)
+        return state.price + self.smoothing * (target - state.price) + step_up
+
+
+def load_config(path: str, venue: Optional[str] = None) -> Tuple[str, Dict]:
+    """(nom du modèle, paramètres) pour le lieu demandé, ou le modèle par défaut"""
+    if not os.path.exists(path):
+        return 'classic', {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        log.error("Configuration des prix illisible (%s), modèle classique utilisé: %s", path, e)
+        return 'classic', {}
+    entry = config.get('default', {})
+    if venue:
+        venue_entry = config.get('venues', {}).get(venue)
+        if venue_entry is None:
+            log.warning("Lieu '%s' absent de %s, modèle par défaut utilisé", venue, path)
+        else:
+            entry = venue_entry
+    return entry.get('model', 'classic'), entry.get('params', {})
@@ -0,0 +1,209 @@
+"""
+Profileur par échantillonnage pour le serveur en production.
+
+Un thread dédié relève périodiquement la pile de tous les threads Python
+(sys._current_frames), y compris periodic_save_thread et les workers du threadpool,
+et agrège les piles au format "collapsed" (une ligne "thread;f1;f2;f3 N") que
+flamegraph.pl, speedscope ou inferno savent transformer en flamegraph.
+
+Le coût est celui d'un parcours de piles toutes les `interval` secondes (5 ms par
+défaut) ; rien n'est instrumenté quand aucune capture n'est en cours.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from logs import get_logger
+
+log = get_logger('profiler')
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(';', ':')
+
+
+class SamplingProfiler:
+    """Une seule capture à la fois ; start()/stop() sont appelables depuis n'importe quel thread"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._samples: Counter = Counter()
+        self._sample_count = 0
+        self._started_at = None
+        self.reason = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, reason: str = 'manual') -> bool:
+        """Démarre une capture ; retourne False si une capture est déjà en cours"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._samples = Counter()
+            self._sample_count = 0
+            self._started_at = time.time()
+            self.reason = reason
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> Dict:
+        """Arrête la capture en cours et retourne les piles agrégées"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return {'samples': 0, 'duration_s': 0.0, 'stacks': Counter(), 'reason': None}
+            self._stop_event.set()
+            thread.join()
+            self._thread = None
+            return {
+                'samples': self._sample_count,
+                'duration_s': round(time.time() - self._started_at, 3),
+                'stacks': self._samples,
+                'reason': self.reason,
+                'interval_s': self.interval,
+            }
+
+    def capture(self, seconds: float, reason: str = 'manual') -> Optional[Dict]:
+        """Capture bloquante de `seconds` secondes (à appeler hors de la boucle asyncio)"""
+        if not self.start(reason):
+            return None
+        self._stop_event.wait(seconds)
+        return self.stop()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                depth = 0
+                while frame is not None and depth < self.max_depth:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                    depth += 1
+                stack.append(names.get(ident, f'thread-{ident}').replace(';', ':'))
+                self._samples[';'.join(reversed(stack))] += 1
+            self._sample_count += 1
+            self._stop_event.wait(self.interval)
+
+
+def to_collapsed(result: Dict) -> str:
+    """Format 'collapsed stacks' (entrée de flamegraph.pl / speedscope)"""
+    return ''.join(f'{stack} {count}\n' for stack, count in result['stacks'].most_common())
+
+
+class SlowRequestTrigger:
+    """
+    Lance automatiquement une capture quand une route dépasse un seuil de latence.
+    La capture couvre les `capture_seconds` suivantes (la lenteur se prolonge en général
+    pendant un rush) et est écrite dans `output_dir`. Un délai de grâce évite d'enchaîner
+    les captures.
+    """
+
+    def __init__(self, profiler: SamplingProfiler, output_dir: str, threshold_ms: Optional[float] = None,
+                 capture_seconds: float = 10.0, cooldown_seconds: float = 300.0, max_files: int = 20):
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.threshold_ms = threshold_ms
+        self.capture_seconds = capture_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.max_files = max_files
+        self._last_trigger = 0.0
+        self.triggered = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms is not None and self.threshold_ms > 0
+
+    def config(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold_ms,
+            'capture_seconds': self.capture_seconds,
+            'cooldown_seconds': self.cooldown_seconds,
+            'triggered': self.triggered,
+            'profiler_running': self.profiler.running,
+        }
+
+    def observe(self, route: str, elapsed_ms: float):
+        if not self.enabled or elapsed_ms < self.threshold_ms:
+            return
+        now = time.time()
+        if now - self._last_trigger < self.cooldown_seconds or self.profiler.running:
+            return
+        self._last_trigger = now
+        self.triggered += 1
+        threading.Thread(target=self._capture_to_file, args=(route, elapsed_ms), daemon=True,
+                         name='slow-request-profile').start()
+
+    def _capture_to_file(self, route: str, elapsed_ms: float):
+        result = self.profiler.capture(self.capture_seconds, reason=f'slow:{route}:{elapsed_ms:.0f}ms')
+        if result is None:
+            return
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            safe_route = ''.join(c if c.isalnum() else '_' for c in route).strip('_') or 'root'
+            filename = f"slow_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{safe_route}.collapsed"
+            with open(os.path.join(self.output_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(to_collapsed(result))
+            self._prune()
+        except OSError as e:
+            log.error("Erreur lors de l'écriture du profil: %s", e)
+
+    def _prune(self):
+        files = sorted(list_captures(self.output_dir), key=lambda c: c['created_at'])
+        for capture in files[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.output_dir, capture['filename']))
+            except OSError:
+                pass
+
+
+def list_captures(output_dir: str):
+    if not os.path.isdir(output_dir):
+        return []
+    captures = []
+    for name in os.listdir(output_dir):
+        if name.endswith('.collapsed'):
+            path = os.path.join(output_dir, name)
+            captures.append({
+                'filename': name,
+                'size': os.path.getsize(path),
+                'created_at': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+            })
+    return sorted(captures, key=lambda c: c['created_at'], reverse=True)
+
+
+class SlowRequestMiddleware:
+    """Middleware ASGI qui signale au déclencheur la latence de chaque requête"""
+
+    def __init__(self, app, trigger: SlowRequestTrigger):
+        self.app = app
+        self.trigger = trigger
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.trigger.enabled:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get('route'), 'path', None) or scope.get('path', '')
+            self.trigger.observe(route, (time.perf_counter() - start) * 1000)
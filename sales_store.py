@@ -0,0 +1,182 @@
+"""
+Ventes de la session en cours, stockées en colonnes compactes.
+
+Une vente occupe une case dans chaque tableau (array) : id de boisson, index du nom
+(les noms sont internés : une seule chaîne par boisson), quantité, prix affiché, prix de base
+et horodatage epoch en millisecondes. Le total et le gain/perte sont dérivés. Soit ~36 octets
+par vente au lieu d'un dictionnaire de huit clés avec sa date ISO (~1,5 Ko), ce qui compte pour
+une session de festival à 20 000 ventes.
+
+Les dictionnaires de l'ancien format ne sont construits qu'à l'export (itération, fichier CSV
+de fin de session, API) ; les totaux se calculent directement sur les tableaux.
+"""
+from array import array
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+FIELDNAMES = ['drink_id', 'drink_name', 'quantity', 'unit_price', 'base_price', 'total_price', 'profit_loss', 'timestamp']
+
+
+def _epoch_ms(timestamp) -> int:
+    """Date ISO, epoch (s) ou None (maintenant) -> epoch en millisecondes"""
+    if timestamp is None or timestamp == '':
+        return int(datetime.now().timestamp() * 1000)
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp * 1000)
+    try:
+        return int(datetime.fromisoformat(str(timestamp)).timestamp() * 1000)
+    except ValueError:
+        return 0
+
+
+class SalesStore:
+    __slots__ = ('drink_ids', 'name_index', 'quantities', 'unit_prices', 'base_prices', 'timestamps',
+                 'names', '_name_ids')
+
+    def __init__(self):
+        self.drink_ids = array('i')
+        self.name_index = array('i')
+        self.quantities = array('i')
+        self.unit_prices = array('d')
+        self.base_prices = array('d')
+        self.timestamps = array('q')  # epoch ms
+        self.names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.drink_ids)
+
+    def _intern(self, name: str) -> int:
+        index = self._name_ids.get(name)
+        if index is None:
+            index = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def add(self, drink_id: int, drink_name: str, quantity: int, unit_price: float, base_price: float, timestamp=None):
+        """
+        Ajoute une vente au prix affiché (arrondi) ; timestamp : date ISO, epoch ou None pour maintenant.
+        Tout ou rien : les valeurs sont converties avant d'écrire, et si un ajout échoue quand même
+        les colonnes déjà allongées sont ramenées à leur longueur, pour rester alignées.
+        """
+        values = (int(drink_id), None, int(quantity), float(unit_price), float(base_price), _epoch_ms(timestamp))
+        columns = self._all_columns()
+        length = len(self)
+        try:
+            for column, value in zip(columns, values):
+                column.append(self._intern(drink_name) if value is None else value)
+        except Exception:
+            for column in columns:
+                del column[length:]
+            raise
+
+    def remove(self, drink_id: int, quantity: int, timestamp) -> bool:
+        """
+        Retire la vente `quantity` x `drink_id` enregistrée à `timestamp` (achat annulé, l'heure
+        venant de la pile d'annulation) ; False si aucune ne correspond
+        """
+        stamp = _epoch_ms(timestamp)
+        for i in range(len(self) - 1, -1, -1):
+            if self.timestamps[i] == stamp and self.drink_ids[i] == drink_id and self.quantities[i] == quantity:
+                for column in self._all_columns():
+                    del column[i]
+                return True
+        return False
+
+    def _all_columns(self) -> Tuple[array, ...]:
+        return (self.drink_ids, self.name_index, self.quantities, self.unit_prices, self.base_prices, self.timestamps)
+
+    # --- Vues ---
+
+    def row(self, i: int) -> Dict:
+        quantity = self.quantities[i]
+        unit_price = self.unit_prices[i]
+        base_price = self.base_prices[i]
+        return {
+            'drink_id': self.drink_ids[i],
+            'drink_name': self.names[self.name_index[i]],
+            'quantity': quantity,
+            'unit_price': unit_price,
+            'base_price': base_price,
+            'total_price': unit_price * quantity,
+            'profit_loss': (unit_price - base_price) * quantity,
+            'timestamp': datetime.fromtimestamp(self.timestamps[i] / 1000).isoformat(),
+        }
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Une vente à la fois, au format historique (dict) : pour l'export seulement"""
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def _columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Copies numpy des tableaux. Pas de vue sur les tableaux eux-mêmes : tant qu'une vue existe,
+        le tableau refuse de grandir (BufferError) et une vente ajoutée en même temps échouerait.
+        La copie se fait par tranche (atomique) jusqu'à la longueur de la dernière colonne remplie
+        par add(), pour que les trois copies soient alignées.
+        """
+        n = len(self.timestamps)
+        return (np.frombuffer(self.quantities[:n], dtype=np.int32),
+                np.frombuffer(self.unit_prices[:n]),
+                np.frombuffer(self.base_prices[:n]))
+
+    def totals(self) -> Tuple[float, float, int]:
+        """(chiffre d'affaires, gain/perte sur le prix de base, unités vendues)"""
+        quantities, unit_prices, base_prices = self._columns()
+        return (float(np.dot(unit_prices, quantities)),
+                float(np.dot(unit_prices - base_prices, quantities)),
+                int(quantities.sum()))
+
+    def by_drink(self) -> Dict[int, Dict]:
+        """Totaux par boisson : {drink_id: {'drink_name', 'quantity', 'total_price', 'profit_loss'}}"""
+        result = {}
+        for i in range(len(self)):
+            entry = result.get(self.drink_ids[i])
+            if entry is None:
+                entry = result[self.drink_ids[i]] = {'drink_name': self.names[self.name_index[i]], 'quantity': 0,
+                                                     'total_price': 0.0, 'profit_loss': 0.0}
+            quantity = self.quantities[i]
+            entry['quantity'] += quantity
+            entry['total_price'] += self.unit_prices[i] * quantity
+            entry['profit_loss'] += (self.unit_prices[i] - self.base_prices[i]) * quantity
+        return result
+
+    # --- Persistance (current_session.json) ---
+
+    def to_json(self) -> Dict:
+        """Format colonnes : des listes de nombres, bien plus courtes à sérialiser que des dicts"""
+        return {
+            'names': self.names,
+            'drink_id': self.drink_ids.tolist(),
+            'name': self.name_index.tolist(),
+            'quantity': self.quantities.tolist(),
+            'unit_price': self.unit_prices.tolist(),
+            'base_price': self.base_prices.tolist(),
+            'timestamp': self.timestamps.tolist(),
+        }
+
+    @classmethod
+    def from_json(cls, data) -> 'SalesStore':
+        """Format colonnes, ou ancienne liste de ventes (dicts)"""
+        store = cls()
+        if isinstance(data, dict):
+            store.names = list(data.get('names', []))
+            store._name_ids = {name: i for i, name in enumerate(store.names)}
+            store.drink_ids.extend(data.get('drink_id', []))
+            store.name_index.extend(data.get('name', []))
+            store.quantities.extend(data.get('quantity', []))
+            store.unit_prices.extend(data.get('unit_price', []))
+            store.base_prices.extend(data.get('base_price', []))
+            store.timestamps.extend(data.get('timestamp', []))
+        else:
+            for sale in data or []:
+                store.add(sale['drink_id'], sale['drink_name'], sale['quantity'], sale['unit_price'],
+                          sale['base_price'], sale.get('timestamp'))
+        return store
+
+    @property
+    def nbytes(self) -> int:
+        """Octets occupés par les colonnes (hors noms internés)"""
+        return sum(column.itemsize * len(column) for column in self._all_columns())
@@ -1,61 +1,155 @@
-from fastapi import FastAPI, HTTPException, Request, Depends, status
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+import time
+BOOT_STARTED = time.perf_counter()  # Début du démarrage, imports compris (voir startup_seconds)
+
+from fastapi import FastAPI, HTTPException, Request, Depends, Query, status
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 import os
+import asyncio
 import secrets
 import uvicorn
-import io
 import json
 import threading
-import time
 import csv
 from csv_data import CSVDataManager
+from idempotency import IdempotencyIndex
+from price_store import PriceStore
+from candles import CandleStore
+from timeline import PriceTimeline
+from leaderboard import Leaderboards
+import metrics
+import admission
+import profiler
+import iostats
+from iostats import atomic_open, tracked_open
+import logs
+import session_files
+import wire
+import pricing
+from sales_store import SalesStore, FIELDNAMES as SALE_FIELDNAMES
+from assets import StaticAssets
 app = FastAPI()
 
-data_manager = CSVDataManager()
+logs.setup_logging(os.environ.get('BIERE_LOG_FILE', 'server.log'))
+log = logs.get_logger('server')
+
+# BIERE_WAL_FSYNC=0 : ne pas attendre le disque à chaque opération (plus rapide, moins sûr en cas de coupure)
+data_manager = CSVDataManager(fsync=os.environ.get('BIERE_WAL_FSYNC', '1') not in ('', '0', 'false', 'False'))
 data_manager.volatility = 1.0 # Initialiser l'attribut de volatilité
 
+# Modèle de prix du lieu (data/pricing.json, lieu choisi par BIERE_VENUE) ; une session peut le remplacer
+PRICING_CONFIG_FILE = os.path.join(data_manager.data_dir, 'pricing.json')
+venue_pricing = pricing.load_config(PRICING_CONFIG_FILE, os.environ.get('BIERE_VENUE'))
+
+def apply_pricing(name, params=None):
+    """Active un modèle de prix ; retombe sur le modèle classique si la configuration est invalide"""
+    try:
+        data_manager.set_pricing_model(name, params)
+    except ValueError as e:
+        log.error("Modèle de prix invalide (%s), modèle classique utilisé: %s", name, e)
+        data_manager.set_pricing_model('classic')
+
+apply_pricing(*venue_pricing)
+
+# Clés d'idempotence des achats déjà traités (rejeu des ventes hors ligne)
+idempotency_index = IdempotencyIndex(os.path.join(data_manager.data_dir, 'idempotency_keys.jsonl'))
+
+# Historique des prix de la soirée, alimenté à chaque changement de prix (/prices/history)
+price_store = PriceStore(os.path.join(data_manager.data_dir, 'price_ticks.csv'))
+data_manager.add_price_listener(lambda drink_id, price, quantity, stamp: price_store.record(drink_id, price, stamp))
+
+# Bougies OHLC 1/5/15 min tenues à jour à chaque changement de prix (/prices/candles)
+candle_store = CandleStore(os.path.join(data_manager.data_dir, 'candles.csv'))
+data_manager.add_price_listener(candle_store.update)
+
+# Chronologie des prix en événements + points de contrôle (/prices/at) ; la première observation
+# rattrape ce qui a changé pendant l'arrêt (drinks.csv modifié à la main, reprise du journal)
+price_timeline = PriceTimeline(data_manager.data_dir)
+data_manager.add_market_listener(price_timeline.observe)
+price_timeline.observe(data_manager.snapshot(), 'reload')
+
+# Classements (hausses / baisses depuis l'ouverture, plus commandées) tenus à jour à chaque prix (/prices/leaders)
+leaderboards = Leaderboards(window_seconds=float(os.environ.get('BIERE_TRADED_WINDOW', 900)))
+data_manager.add_price_listener(leaderboards.on_price)
+
+def open_leaderboards(since: Optional[float] = None):
+    """Ouverture des classements : maintenant, ou à `since` avec les prix d'alors (chronologie)"""
+    current = {drink.id: drink.price for drink in data_manager.snapshot().drinks}
+    opening = dict(current)
+    if since is not None:
+        opening.update({drink['id']: drink['price'] for drink in price_timeline.board_at(since)['drinks']})
+    leaderboards.reset_open(opening, current, since)
+
 current_refresh_interval = 10000
 market_volatility = 1.0
+# Demi-vie (secondes) du retour des prix vers le prix de base, 0 = désactivé
+price_half_life = float(os.environ.get('BIERE_HALF_LIFE', 0))
+data_manager.decay_half_life = price_half_life
 active_drinks = set()
 timer_start_time = datetime.now()
 market_timer_start = datetime.now()  # Timer global du marché, indépendant des clients
 
 # --- Début de la gestion des verrous pour la concurrence ---
-timer_state_lock = threading.Lock()
-session_state_lock = threading.Lock()
+timer_state_lock = threading.RLock()  # Réentrant : load_timer_state appelle save_timer_state
+session_state_lock = threading.RLock()  # Réentrant : une vente ajoute puis sauvegarde sous le même verrou
 # --- Fin de la gestion des verrous ---
 
+# Signature (mtime, taille) des fichiers d'état déjà chargés : on ne les relit que s'ils ont changé
+state_file_stamps = {'timer_state': None, 'session': None}
+state_cache_stats = {'timer_state': {'hits': 0, 'misses': 0}, 'session': {'hits': 0, 'misses': 0}}
+last_state_save = None  # Horodatage (epoch) de la dernière sauvegarde périodique réussie
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+def _state_file_unchanged(name, path):
+    """Vrai si le fichier d'état est identique à celui déjà chargé (compte les hits/misses du cache)"""
+    stamp = _file_stamp(path)
+    if stamp is not None and stamp == state_file_stamps[name]:
+        state_cache_stats[name]['hits'] += 1
+        return True
+    state_cache_stats[name]['misses'] += 1
+    return False
+
 # Fonction pour charger/sauvegarder l'état du timer persistant
 def load_timer_state():
     """Charger l'état du timer depuis le fichier de sauvegarde"""
-    global market_timer_start, current_refresh_interval, market_volatility
+    global market_timer_start, current_refresh_interval, market_volatility, price_half_life
     with timer_state_lock:
         try:
+            if _state_file_unchanged('timer_state', 'data/timer_state.json'):
+                return
             if os.path.exists('data/timer_state.json'):
-                with open('data/timer_state.json', 'r') as f:
+                state_file_stamps['timer_state'] = _file_stamp('data/timer_state.json')
+                with tracked_open('data/timer_state.json', 'r') as f:
                     timer_data = json.load(f)
                     market_timer_start = datetime.fromisoformat(timer_data.get('market_timer_start', datetime.now().isoformat()))
                     current_refresh_interval = timer_data.get('refresh_interval', 10000)
                     market_volatility = timer_data.get('market_volatility', 1.0)
                     data_manager.volatility = market_volatility # Transmettre au data_manager
+                    price_half_life = timer_data.get('price_half_life', price_half_life)
+                    data_manager.decay_half_life = price_half_life
                     # Réduire les logs au démarrage
                     if not hasattr(load_timer_state, '_logged'):
-                        print(f"⏰ Timer universel chargé: démarré le {market_timer_start}, intervalle {current_refresh_interval}ms")
+                        log.info("⏰ Timer universel chargé: démarré le %s, intervalle %sms", market_timer_start, current_refresh_interval)
                         load_timer_state._logged = True
             else:
                 if not hasattr(load_timer_state, '_logged'):
-                    print(f"⏰ Aucun état de timer sauvegardé trouvé, démarrage nouveau timer universel")
+                    log.info("⏰ Aucun état de timer sauvegardé trouvé, démarrage nouveau timer universel")
                     load_timer_state._logged = True
                 # Créer immédiatement un état initial
                 save_timer_state()
         except Exception as e:
-            print(f"❌ Erreur lors du chargement du timer: {e}")
+            log.error("❌ Erreur lors du chargement du timer: %s", e)
             market_timer_start = datetime.now()
             save_timer_state()
 
@@ -69,36 +163,46 @@ def save_timer_state():
                 'market_timer_start': market_timer_start.isoformat(),
                 'refresh_interval': current_refresh_interval,
                 'market_volatility': market_volatility,
+                'price_half_life': price_half_life,
                 'last_saved': datetime.now().isoformat()
             }
-            with open('data/timer_state.json', 'w') as f:
+            with atomic_open('data/timer_state.json', 'w') as f:
                 json.dump(timer_data, f, indent=2)
+            state_file_stamps['timer_state'] = _file_stamp('data/timer_state.json')
             # Réduire les logs : seulement afficher de temps en temps
             if not hasattr(save_timer_state, '_last_log') or (datetime.now() - save_timer_state._last_log).seconds > 300:
-                print(f"💾 État du timer universel sauvegardé: {market_timer_start.isoformat()}")
+                log.info("💾 État du timer universel sauvegardé: %s", market_timer_start.isoformat())
                 save_timer_state._last_log = datetime.now()
+            return True
         except Exception as e:
-            print(f"❌ Erreur lors de la sauvegarde du timer: {e}")
+            log.error("❌ Erreur lors de la sauvegarde du timer: %s", e)
+            return False
 
 # Variables de session
 current_session = None
-session_sales = []  # Liste des ventes de la session en cours
+session_sales = SalesStore()  # Ventes de la session en cours (colonnes compactes)
 
 def load_session_if_exists():
     """Charger la session sauvegardée s'il y en a une"""
     global current_session, session_sales
     with session_state_lock:
         try:
+            if _state_file_unchanged('session', 'data/current_session.json'):
+                return
             if os.path.exists('data/current_session.json'):
-                with open('data/current_session.json', 'r') as f:
+                state_file_stamps['session'] = _file_stamp('data/current_session.json')
+                with tracked_open('data/current_session.json', 'r') as f:
                     session_data = json.load(f)
                     current_session = session_data.get('session')
                     # S'assurer que is_active est bien un booléen
                     if current_session:
                         current_session['is_active'] = bool(current_session.get('is_active'))
-                    session_sales = session_data.get('sales', [])
+                        # Modèle de prix propre à la session
+                        if current_session.get('pricing'):
+                            apply_pricing(current_session['pricing']['model'], current_session['pricing'].get('params'))
+                    session_sales = SalesStore.from_json(session_data.get('sales', []))
         except Exception as e:
-            print(f"Erreur lors du chargement de la session: {e}")
+            log.error("Erreur lors du chargement de la session: %s", e)
 
 def save_session():
     """Sauvegarder la session courante"""
@@ -108,40 +212,142 @@ def save_session():
             try:
                 session_data = {
                     'session': current_session,
-                    'sales': session_sales
+                    'sales': session_sales.to_json()
                 }
-                with open('data/current_session.json', 'w') as f:
-                    json.dump(session_data, f, indent=2)
+                with atomic_open('data/current_session.json', 'w') as f:
+                    json.dump(session_data, f, separators=(',', ':'))
+                state_file_stamps['session'] = _file_stamp('data/current_session.json')
             except Exception as e:
-                print(f"Erreur lors de la sauvegarde de la session: {e}")
+                log.error("Erreur lors de la sauvegarde de la session: %s", e)
+                return False
+    return True
 
 # Sauvegarde périodique pour la robustesse en cas de crash
 def periodic_save_thread():
     """Thread qui sauvegarde l'état du timer et de la session toutes les 30 secondes."""
+    global last_state_save
     while True:
         time.sleep(30)
-        save_timer_state()
-        save_session()
+        timer_saved = save_timer_state()
+        session_saved = save_session()
+        price_store.flush()
+        candle_store.flush()
+        price_timeline.flush()
+        if data_manager.journal.pending:
+            data_manager.checkpoint()
+        if timer_saved and session_saved:
+            last_state_save = time.time()
 
 # --- Démarrage de l'application ---
 
+startup_seconds = None  # Import du module -> fin du lifespan, mesuré une fois au démarrage
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gère le cycle de vie de l'application (démarrage et arrêt)."""
     # Code à exécuter au démarrage
     load_timer_state()
     load_session_if_exists()
+    price_timeline.set_half_life(data_manager.decay_half_life)  # BIERE_HALF_LIFE ou timer_state.json
+
+    # Classements : ouverture au début de la session en cours, ventes récentes reprises de l'historique
+    session_start = None
+    if current_session and current_session.get('is_active') and current_session.get('start_time'):
+        session_start = datetime.fromisoformat(current_session['start_time']).timestamp()
+    open_leaderboards(session_start)
+    window_start = datetime.now() - timedelta(seconds=leaderboards.window_seconds)
+    for entry in data_manager.get_history_range(start=window_start.isoformat()):
+        if entry['event'] == 'buy' and entry['drink_id'] is not None and entry['quantity'] > 0:
+            leaderboards.record_sale(entry['drink_id'], int(entry['quantity']),
+                                     datetime.fromisoformat(entry['timestamp']).timestamp())
+
+    # Point de départ des courbes pour les boissons sans historique
+    for drink in data_manager.get_all_prices():
+        if price_store.last(drink['id']) is None:
+            price_store.record(drink['id'], drink['price'])
+            candle_store.update(drink['id'], drink['price'])
     
     save_thread = threading.Thread(target=periodic_save_thread, daemon=True)
     save_thread.start()
-    print("🔄 Sauvegarde périodique de l'état démarrée (30s)")
+    log.info("🔄 Sauvegarde périodique de l'état démarrée (30s)")
+
+    global startup_seconds
+    startup_seconds = time.perf_counter() - BOOT_STARTED
+    log.info("🚀 Serveur prêt en %.0f ms", startup_seconds * 1000)
     
     yield
-    # Code à exécuter à l'arrêt (si nécessaire)
+    # Code à exécuter à l'arrêt
+    price_store.flush()
+    candle_store.flush(include_current=True)
+    price_timeline.flush()
+    data_manager.checkpoint()
 
 # --- Fin du Démarrage ---
 
 app = FastAPI(title="Wall Street Bar", lifespan=lifespan)
+
+# File d'admission des écritures (voir admission.py) ; ajoutée avant les métriques pour que
+# la latence mesurée compte l'attente dans la file
+write_admission = admission.AdmissionController(
+    max_concurrent=int(os.environ.get('BIERE_WRITE_CONCURRENCY', 4)),
+    max_queue=int(os.environ.get('BIERE_WRITE_QUEUE', 64)),
+    max_wait=float(os.environ.get('BIERE_WRITE_MAX_WAIT', 2.0)),
+)
+app.add_middleware(admission.AdmissionMiddleware, controller=write_admission)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Comptabilité des I/O fichiers par requête (en-têtes X-IO-* si BIERE_DEBUG=1)
+DEBUG_MODE = os.environ.get('BIERE_DEBUG', '0') not in ('', '0', 'false', 'False')
+io_accounting = iostats.IOAccounting(
+    opens_budget=int(os.environ['BIERE_IO_OPENS_BUDGET']) if os.environ.get('BIERE_IO_OPENS_BUDGET') else None
+)
+app.add_middleware(iostats.IOAccountingMiddleware, accounting=io_accounting, debug=DEBUG_MODE)
+
+# Profileur par échantillonnage (capture à la demande ou sur requête lente)
+sampling_profiler = profiler.SamplingProfiler()
+slow_request_trigger = profiler.SlowRequestTrigger(
+    sampling_profiler,
+    output_dir=os.path.join(data_manager.data_dir, 'profiles'),
+    threshold_ms=float(os.environ['BIERE_SLOW_REQUEST_MS']) if os.environ.get('BIERE_SLOW_REQUEST_MS') else None
+)
+app.add_middleware(profiler.SlowRequestMiddleware, trigger=slow_request_trigger)
+app.add_middleware(logs.RequestContextMiddleware)  # Ajouté en dernier : englobe tous les autres
+
+# --- Jauges calculées au moment de la collecte /metrics ---
+def _cache_hit_ratios():
+    caches = {**state_cache_stats, **data_manager.cache_stats}
+    return {(name,): (stats['hits'] / (stats['hits'] + stats['misses']) if stats['hits'] + stats['misses'] else None)
+            for name, stats in caches.items()}
+
+def _cache_lookups():
+    caches = {**state_cache_stats, **data_manager.cache_stats}
+    return {(name, result): stats[key] for name, stats in caches.items()
+            for result, key in (('hit', 'hits'), ('miss', 'misses'))}
+
+metrics.registry.gauge('biere_session_sales', 'Ventes enregistrées dans la session en cours',
+                       callback=lambda: len(session_sales))
+metrics.registry.gauge('biere_history_entries', "Entrées dans l'historique des transactions",
+                       callback=lambda: data_manager.get_history_size())
+metrics.registry.gauge('biere_active_happy_hours', 'Happy Hours actives',
+                       callback=lambda: len(data_manager.active_happy_hours))
+metrics.registry.gauge('biere_admission_active', "Écritures en cours d'exécution",
+                       callback=lambda: write_admission.active)
+metrics.registry.gauge('biere_admission_queued', "Écritures en attente dans la file d'admission",
+                       callback=lambda: write_admission.queued)
+metrics.registry.gauge('biere_startup_seconds', "Durée du démarrage (imports et chargement de l'état)",
+                       callback=lambda: startup_seconds)
+metrics.registry.gauge('biere_cache_hit_ratio', 'Taux de succès des caches', ('cache',), callback=_cache_hit_ratios)
+metrics.registry.gauge('biere_cache_lookups', 'Accès aux caches par résultat', ('cache', 'result'), callback=_cache_lookups)
+def _io_by_route(field):
+    return lambda: {(route,): agg[field] for route, agg in io_accounting.snapshot()['routes'].items()}
+
+for _field, _doc in (('opens', 'Fichiers ouverts'), ('bytes_read', 'Octets lus'),
+                     ('bytes_written', 'Octets écrits'), ('rewrites', 'Réécritures complètes de fichiers')):
+    metrics.registry.gauge(f'biere_io_{_field}', f'{_doc} (cumul par route)', ('route',), callback=_io_by_route(_field))
+
+metrics.registry.gauge('biere_seconds_since_last_state_save',
+                       'Secondes depuis la dernière sauvegarde périodique réussie (timer + session)',
+                       callback=lambda: time.time() - last_state_save if last_state_save else None)
 security = HTTPBasic()
 
 ADMIN_USERNAME = "admin"
@@ -171,6 +377,22 @@ def check_session_active():
 class BuyRequest(BaseModel):
     drink_id: int
     quantity: int = 1
+    idempotency_key: Optional[str] = None
+
+class SlowRequestTriggerRequest(BaseModel):
+    threshold_ms: Optional[float] = None  # None ou 0 pour désactiver
+    capture_seconds: float = 10.0
+    cooldown_seconds: float = 300.0
+
+class OfflineSale(BaseModel):
+    drink_id: int
+    quantity: int = 1
+    timestamp: str  # Heure de la vente sur la tablette (ISO 8601)
+    idempotency_key: Optional[str] = None
+    unit_price: Optional[float] = None  # Prix affiché à la tablette au moment de la vente
+
+class BulkBuyRequest(BaseModel):
+    sales: List[OfflineSale]
 
 class IntervalRequest(BaseModel):
     interval_ms: int
@@ -178,6 +400,9 @@ class IntervalRequest(BaseModel):
 class VolatilityRequest(BaseModel):
     factor: float
 
+class HalfLifeRequest(BaseModel):
+    seconds: float  # 0 pour désactiver le retour vers le prix de base
+
 class PriceItem(BaseModel):
     id: int
     name: str
@@ -205,6 +430,12 @@ class CreateDrinkRequest(BaseModel):
 
 class SessionStartRequest(BaseModel):
     session_name: str
+    pricing_model: Optional[str] = None  # Modèle de prix de la session (défaut : celui du lieu)
+    pricing_params: Optional[dict] = None
+
+class PricingRequest(BaseModel):
+    model: str
+    params: Optional[dict] = None
 
 class SessionSale(BaseModel):
     drink_id: int
@@ -226,10 +457,12 @@ class SessionStats(BaseModel):
     is_active: bool
     sales: List[SessionSale]
 @app.get("/prices")
-async def get_prices():
+async def get_prices(request: Request):
     load_timer_state()  # Recharger l'état du timer pour être à jour
     try:
-        prices = data_manager.get_all_prices()
+        # Une seule carte du marché pour toute la réponse (voir MarketSnapshot)
+        snapshot = data_manager.snapshot()
+        prices = data_manager.get_all_prices(snapshot)
         
         # Calculer le temps écoulé depuis le début du cycle du timer
         current_time = datetime.now()
@@ -241,20 +474,21 @@ async def get_prices():
         else:
             remaining_ms = 0  # Mode manuel, pas de temps restant
         
-        return {
+        return wire.negotiate(request, {
             "prices": prices,
+            "version": snapshot.version,
             "active_drinks": list(active_drinks),
             "timer_start": timer_start_time.isoformat(),
             "interval_ms": current_refresh_interval,
             "server_time": current_time.isoformat(),
             "timer_remaining_ms": remaining_ms,
             "market_timer_start": market_timer_start.isoformat()
-        }
+        })
     except Exception as e:
-        print(f"Erreur dans get_prices: {e}")
+        log.exception("Erreur dans get_prices: %s", e)
         # En cas d'erreur, retourner une structure valide
         current_time = datetime.now()
-        return {
+        return wire.negotiate(request, {
             "prices": [],
             "active_drinks": [],
             "timer_start": current_time.isoformat(),
@@ -262,7 +496,127 @@ async def get_prices():
             "server_time": current_time.isoformat(),
             "timer_remaining_ms": current_refresh_interval,
             "market_timer_start": market_timer_start.isoformat()
-        }
+        })
+
+def _parse_time_param(value: Optional[str], name: str) -> Optional[float]:
+    """Accepte un epoch (secondes ou millisecondes) ou une date ISO ; retourne un epoch en secondes"""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+        return number / 1000 if number > 1e11 else number
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Paramètre '{name}' invalide (epoch ou date ISO attendu)")
+
+@app.get("/prices/history")
+async def get_price_history(request: Request, drink_id: Optional[int] = None, start: Optional[str] = Query(None, alias='from'),
+                            end: Optional[str] = Query(None, alias='to'), points: int = 300):
+    """
+    Historique des prix sur une plage de temps, réduit côté serveur à `points` points par boisson.
+    Sans drink_id, renvoie toutes les boissons. Les points sont des paires [epoch_ms, prix].
+    """
+    start_ts = _parse_time_param(start, 'from')
+    end_ts = _parse_time_param(end, 'to')
+    if start_ts is not None and end_ts is not None and end_ts < start_ts:
+        raise HTTPException(status_code=400, detail="'to' doit être postérieur à 'from'")
+    points = max(2, min(points, 5000))
+
+    names = {d['id']: d['name'] for d in data_manager.get_all_prices()}
+    drink_ids = [drink_id] if drink_id is not None else sorted(set(price_store.drink_ids()) | set(names))
+    if drink_id is not None and drink_id not in names and drink_id not in price_store.drink_ids():
+        raise HTTPException(status_code=404, detail="Boisson introuvable")
+
+    series = []
+    for current_id in drink_ids:
+        result = price_store.query(current_id, start_ts, end_ts, points)
+        series.append({
+            "drink_id": current_id,
+            "name": names.get(current_id),
+            "total": result['total'],
+            "points": [[int(t * 1000), round(p, 4)] for t, p in result['points']]
+        })
+    return wire.negotiate(request, {
+        "from": int(start_ts * 1000) if start_ts is not None else None,
+        "to": int(end_ts * 1000) if end_ts is not None else None,
+        "points": points,
+        "series": series
+    })
+
+@app.get("/prices/at")
+async def get_prices_at(request: Request, at: str = Query(..., alias='t')):
+    """
+    Carte complète telle qu'elle était à l'instant `t` (epoch ou date ISO) : fiches, prix à `t`
+    (decay compris, `written_price` pour le dernier prix écrit), prix affiché et Happy Hours,
+    reconstruits depuis le dernier point de contrôle avant `t`.
+    """
+    at_ts = _parse_time_param(at, 't')
+    result = await run_in_threadpool(price_timeline.board_at, at_ts)
+    drinks = []
+    for drink in result['drinks']:
+        display_price = drink['min_price'] if drink['happy_hour'] else drink['price']
+        drinks.append({
+            **{key: value for key, value in drink.items() if key not in ('happy_hour', 'updated_at')},
+            'display_price': display_price,
+            'price_rounded': data_manager.round_to_ten_cents(display_price),
+            'is_happy_hour': drink['happy_hour'],
+            'updated_at': int(drink['updated_at'] * 1000) if drink.get('updated_at') else None,
+        })
+    return wire.negotiate(request, {
+        "at": int(at_ts * 1000),
+        "checkpoint": int(result['checkpoint'] * 1000) if result['checkpoint'] is not None else None,
+        "replayed": result['replayed'],
+        "half_life": result['half_life'],
+        "drinks": drinks
+    })
+
+@app.get("/prices/leaders")
+async def get_price_leaders(request: Request, k: int = 5):
+    """
+    Plus fortes hausses et baisses depuis l'ouverture, boissons les plus commandées sur la
+    fenêtre glissante (15 min) : classements tenus à jour à chaque prix, lus en O(k).
+    """
+    k = max(1, min(k, 50))
+    drinks = data_manager.snapshot().by_id
+    result = leaderboards.top(k, keep=drinks.__contains__)
+    for ranking in ('gainers', 'losers', 'most_traded'):
+        for entry in result[ranking]:
+            entry['name'] = drinks[entry['drink_id']].name
+    return wire.negotiate(request, {**result, "opened_at": int(result['opened_at'] * 1000)})
+
+CANDLE_RESOLUTIONS = {'1m': 60, '5m': 300, '15m': 900}
+
+@app.get("/prices/candles")
+async def get_price_candles(request: Request, drink_id: Optional[int] = None, resolution: str = '1m',
+                            start: Optional[str] = Query(None, alias='from'),
+                            end: Optional[str] = Query(None, alias='to'), limit: int = 100):
+    """
+    Bougies OHLC calculées par le serveur, pour une boisson ou toutes.
+    resolution: 1m, 5m ou 15m (ou le nombre de secondes). Chaque bougie est
+    [début_epoch_ms, open, high, low, close, volume] ; la dernière peut être en cours.
+    """
+    seconds = CANDLE_RESOLUTIONS.get(resolution)
+    if seconds is None and resolution.isdigit() and int(resolution) in candle_store.resolutions:
+        seconds = int(resolution)
+    if seconds is None:
+        raise HTTPException(status_code=400, detail=f"Résolution invalide (valeurs: {', '.join(CANDLE_RESOLUTIONS)})")
+    start_ts = _parse_time_param(start, 'from')
+    end_ts = _parse_time_param(end, 'to')
+    limit = max(1, min(limit, 2000))
+
+    drink_ids = [drink_id] if drink_id is not None else candle_store.drink_ids()
+    series = []
+    for current_id in drink_ids:
+        candles = candle_store.query(current_id, seconds, start_ts, end_ts, limit)
+        series.append({
+            "drink_id": current_id,
+            "candles": [[int(c[0] * 1000), round(c[1], 4), round(c[2], 4), round(c[3], 4), round(c[4], 4), c[5]]
+                        for c in candles]
+        })
+    return wire.negotiate(request, {"resolution": seconds, "series": series})
 
 @app.get("/diagnostic")
 async def get_diagnostic():
@@ -275,9 +629,11 @@ async def get_diagnostic():
         # Test basique de lecture CSV
         csv_status = "OK"
         csv_count = 0
+        market_version = None
         try:
-            prices = data_manager.get_all_prices()
-            csv_count = len(prices)
+            snapshot = data_manager.snapshot()
+            csv_count = len(snapshot.drinks)
+            market_version = snapshot.version
         except Exception as e:
             csv_status = f"ERROR: {e}"
         
@@ -287,6 +643,8 @@ async def get_diagnostic():
             "working_directory": os.getcwd(),
             "csv_status": csv_status,
             "csv_drinks_count": csv_count,
+            "market_version": market_version,
+            "startup_ms": round(startup_seconds * 1000, 1) if startup_seconds is not None else None,
             "drinks_file_exists": os.path.exists("data/drinks.csv"),
             "history_file_exists": os.path.exists("data/history.csv"),
             "active_drinks": list(active_drinks),
@@ -301,6 +659,65 @@ async def get_diagnostic():
             "timestamp": datetime.now().isoformat()
         }
 
+@app.get("/metrics")
+def get_metrics():
+    """Métriques au format texte Prometheus (latences par route, compteurs métier, jauges)"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/admin/profile")
+async def admin_profile(seconds: float = 10.0, admin: str = Depends(get_current_admin)):
+    """
+    Profiler tout le serveur (tous les threads) pendant `seconds` secondes.
+    Retourne les piles au format collapsed, à passer à flamegraph.pl ou speedscope.
+    """
+    if seconds <= 0 or seconds > 120:
+        raise HTTPException(status_code=400, detail="Durée invalide (0-120 secondes)")
+    if not sampling_profiler.start(reason=f'admin:{admin}'):
+        raise HTTPException(status_code=409, detail="Une capture de profil est déjà en cours")
+    try:
+        await asyncio.sleep(seconds)  # La boucle continue de servir les requêtes pendant la capture
+    finally:
+        result = sampling_profiler.stop()
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    return Response(content=profiler.to_collapsed(result), media_type="text/plain",
+                    headers={"Content-Disposition": f"attachment; filename={filename}",
+                             "X-Profile-Samples": str(result['samples'])})
+
+@app.get("/admin/profile/trigger")
+async def get_slow_request_trigger(admin: str = Depends(get_current_admin)):
+    """Configuration du déclencheur automatique et captures disponibles"""
+    return {"trigger": slow_request_trigger.config(), "captures": profiler.list_captures(slow_request_trigger.output_dir)}
+
+@app.post("/admin/profile/trigger")
+async def set_slow_request_trigger(request: SlowRequestTriggerRequest, admin: str = Depends(get_current_admin)):
+    """Activer/désactiver la capture automatique quand une route dépasse un seuil de latence"""
+    if request.capture_seconds <= 0 or request.capture_seconds > 120:
+        raise HTTPException(status_code=400, detail="Durée de capture invalide (0-120 secondes)")
+    slow_request_trigger.threshold_ms = request.threshold_ms or None
+    slow_request_trigger.capture_seconds = request.capture_seconds
+    slow_request_trigger.cooldown_seconds = max(0.0, request.cooldown_seconds)
+    return {"status": "ok", "trigger": slow_request_trigger.config()}
+
+@app.get("/admin/profile/captures/{filename}")
+async def download_profile_capture(filename: str, admin: str = Depends(get_current_admin)):
+    """Télécharger un profil capturé automatiquement"""
+    if not filename.endswith('.collapsed') or '/' in filename or '..' in filename:
+        raise HTTPException(status_code=400, detail="Nom de fichier invalide")
+    file_path = os.path.join(slow_request_trigger.output_dir, filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Profil non trouvé")
+    return FileResponse(file_path, media_type="text/plain", filename=filename)
+
+@app.get("/admin/io-stats")
+async def get_io_stats(admin: str = Depends(get_current_admin)):
+    """I/O fichiers agrégées par route (amplification d'écriture)"""
+    return io_accounting.snapshot()
+
+@app.post("/admin/io-stats/reset")
+async def reset_io_stats(admin: str = Depends(get_current_admin)):
+    io_accounting.reset()
+    return {"status": "reset"}
+
 @app.get("/config/interval")
 async def get_refresh_interval():
     return {"interval_ms": current_refresh_interval}
@@ -321,6 +738,45 @@ async def set_volatility(request: VolatilityRequest, admin: str = Depends(get_cu
     save_timer_state() # Sauvegarde immédiate
     return {"status": "ok", "factor": market_volatility}
 
+@app.get("/admin/config/half-life")
+async def get_half_life(admin: str = Depends(get_current_admin)):
+    """Demi-vie du retour des prix vers le prix de base (0 = désactivé)."""
+    return {"seconds": price_half_life}
+
+@app.post("/admin/config/half-life")
+async def set_half_life(request: HalfLifeRequest, admin: str = Depends(get_current_admin)):
+    """Définir la demi-vie du retour vers le prix de base (de 1 minute à 24 heures, 0 pour désactiver)."""
+    global price_half_life
+    if request.seconds < 0:
+        raise HTTPException(status_code=400, detail="La demi-vie doit être positive")
+    price_half_life = 0.0 if request.seconds == 0 else max(60.0, min(request.seconds, 86400.0))
+    data_manager.set_decay_half_life(price_half_life)
+    price_timeline.set_half_life(price_half_life)
+    save_timer_state()
+    return {"status": "ok", "seconds": price_half_life}
+
+@app.get("/admin/pricing")
+async def get_pricing(admin: str = Depends(get_current_admin)):
+    """Modèle de prix actif et modèles disponibles"""
+    return {
+        "active": data_manager.pricing_model.describe(),
+        "venue": {"name": os.environ.get('BIERE_VENUE'), "model": venue_pricing[0], "params": venue_pricing[1]},
+        "available": pricing.available_models()
+    }
+
+@app.post("/admin/pricing")
+async def set_pricing(request: PricingRequest, admin: str = Depends(get_current_admin)):
+    """Changer de modèle de prix ; pendant une session, le choix est gardé avec la session"""
+    load_session_if_exists()
+    try:
+        data_manager.set_pricing_model(request.model, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if current_session and current_session.get('is_active'):
+        current_session['pricing'] = data_manager.pricing_model.describe()
+        save_session()
+    return {"status": "ok", "active": data_manager.pricing_model.describe()}
+
 @app.get("/sync/timer")
 async def get_timer_sync():
     """Endpoint pour synchroniser le timer entre tous les clients"""
@@ -388,70 +844,8 @@ async def get_initial_admin_data(admin: str = Depends(get_current_admin)):
         # 3. Get active happy hours
         active_happy_hours = data_manager.get_active_happy_hours()
 
-        # 4. Get previous sessions (logic from list_previous_sessions)
-        import glob
-        import pandas as pd
-        
-        sessions = []
-        session_files = glob.glob("data/session_*.csv")
-        
-        for file_path in session_files:
-            try:
-                if not os.path.exists(file_path):
-                    continue
-                filename = os.path.basename(file_path)
-                if filename.startswith("session_session_"):
-                    timestamp_str = filename.replace("session_session_", "").replace(".csv", "")
-                    created_at = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-                else:
-                    created_at = datetime.fromtimestamp(os.path.getctime(file_path))
-                
-                df = pd.read_csv(file_path)
-                df = df.dropna(how='all').fillna(0)
-                
-                if len(df) > 0:
-                    data_rows = df[df['drink_id'] != 'SESSION_SUMMARY']
-                    summary_rows = df[df['drink_id'] == 'SESSION_SUMMARY']
-                    
-                    total_sales = data_rows['total_price'].sum()
-                    total_profit_loss = data_rows['profit_loss'].sum()
-                    total_drinks_sold = data_rows['quantity'].sum()
-                    
-                    session_name = "Session inconnue"
-                    if len(summary_rows) > 0:
-                        session_info = summary_rows.iloc[0]['drink_name']
-                        if session_info and 'Session: ' in str(session_info):
-                            session_name = str(session_info).replace('Session: ', '')
-                        elif session_info and 'Barman: ' in str(session_info):
-                             session_name = str(session_info).replace('Barman: ', '')
-                        else:
-                            session_name = str(session_info)
-
-                    duration_hours = None
-                    if len(summary_rows) > 0:
-                        try:
-                            start_str = str(summary_rows.iloc[0]['unit_price'])
-                            end_str = str(summary_rows.iloc[0]['base_price'])
-                            if start_str.startswith('Start: ') and end_str.startswith('End: '):
-                                start_time = pd.to_datetime(start_str.replace('Start: ', ''))
-                                end_time = pd.to_datetime(end_str.replace('End: ', ''))
-                                duration_hours = (end_time - start_time).total_seconds() / 3600
-                        except Exception:
-                            duration_hours = None
-                else:
-                    total_sales, total_profit_loss, total_drinks_sold, session_name, duration_hours = 0, 0, 0, "Session vide", None
-
-                sessions.append({
-                    "filename": filename,
-                    "created_at": created_at.isoformat(),
-                    "session_name": session_name,
-                    "total_sales": float(total_sales) if not pd.isna(total_sales) else 0.0,
-                    "total_profit_loss": float(total_profit_loss) if not pd.isna(total_profit_loss) else 0.0,
-                    "total_drinks_sold": int(total_drinks_sold) if not pd.isna(total_drinks_sold) else 0,
-                    "duration_hours": float(duration_hours) if duration_hours is not None and not pd.isna(duration_hours) else None
-                })
-            except Exception:
-                continue
+        # 4. Get previous sessions (résumés en cache, voir session_files.py)
+        sessions = session_files.list_sessions()
         
         # 5. Get current session status
         current_session_status = None
@@ -488,14 +882,38 @@ async def set_refresh_interval(request: IntervalRequest, admin: str = Depends(ge
 
 @app.post("/buy")
 async def buy(request: Request):
+    try:
+        data = await request.json()
+        if not isinstance(data, dict):
+            raise ValueError("Le corps de la requête doit être un objet JSON")
+        drink_id = int(data.get("drink_id"))
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    logs.bind(drink_id=drink_id)
+    # Le travail sur fichiers se fait dans le pool de threads : la boucle reste libre pour les lectures (/prices)
+    idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    return await run_in_threadpool(process_buy, data, idempotency_key)
+
+def process_buy(data: dict, idempotency_key: Optional[str]):
     load_timer_state()  # Recharger l'état du timer
     load_session_if_exists()  # Recharger l'état de la session
     global active_drinks, session_sales # Garder pour la modification
+    owned = False  # Clé d'idempotence réservée par cette requête, à libérer à la fin
     
     try:
-        data = await request.json()
         drink_id = int(data.get("drink_id"))
         quantity = int(data.get("quantity", 1))
+
+        # Une tablette qui renvoie la même vente (réseau coupé) reçoit la réponse d'origine ;
+        # si la première tentative est encore en cours, on attend sa réponse (clé réservée)
+        if idempotency_key:
+            try:
+                previous = idempotency_index.claim(str(idempotency_key))
+            except TimeoutError:
+                return JSONResponse(status_code=409, content={"detail": "Vente déjà en cours de traitement, réessayez"})
+            if previous is not None:
+                return {**previous, "replayed": True}
+            owned = True
         
         active_drinks.add(drink_id)
         
@@ -508,34 +926,23 @@ async def buy(request: Request):
         displayed_price = current_drink['price_rounded']  # Prix affiché arrondi aux 10 centimes
         base_price = current_drink['base_price']
         
+        # Même heure pour la vente de la session et la pile d'annulation : une annulation retire cette vente-là
+        sold_at = time.time()
         if current_refresh_interval == 0:
             # Mode immédiat : effet de marché complet
-            updated_drink = data_manager.apply_buy(drink_id, quantity)
+            updated_drink = data_manager.apply_buy(drink_id, quantity, sold_at)
         else:
             # Mode timer : seul le prix de la boisson achetée augmente simplement
-            updated_drink = data_manager.apply_buy_simple(drink_id, quantity)
+            updated_drink = data_manager.apply_buy_simple(drink_id, quantity, sold_at)
         
         # Enregistrer la vente dans la session si une session est active
         if current_session:
             # Utiliser le prix affiché (arrondi) pour le calcul du profit/loss et du total
-            total_price = displayed_price * quantity
-            profit_loss = (displayed_price - base_price) * quantity
+            with session_state_lock:
+                session_sales.add(drink_id, current_drink['name'], quantity, displayed_price, base_price, sold_at)
+                save_session()  # Sauvegarder l'état de la session après chaque vente
             
-            sale = {
-                "drink_id": drink_id,
-                "drink_name": current_drink['name'],
-                "quantity": quantity,
-                "unit_price": displayed_price,  # Utiliser le prix affiché arrondi
-                "base_price": base_price,
-                "total_price": total_price,
-                "profit_loss": profit_loss,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            session_sales.append(sale)
-            save_session()  # Sauvegarder l'état de la session après chaque vente
-            
-        return {
+        result = {
             "status": "ok", 
             "drink_id": drink_id, 
             "quantity": quantity, 
@@ -543,15 +950,137 @@ async def buy(request: Request):
             "mode": "immediate" if current_refresh_interval == 0 else "market",
             "active_drinks": list(active_drinks)
         }
+        if idempotency_key:
+            idempotency_index.remember(str(idempotency_key), result)
+        metrics.buys_total.inc(mode=result["mode"], source="live")
+        return result
     except ValueError as e:
         return JSONResponse(status_code=400, content={"detail": str(e)})
     except Exception as e:
+        log.exception("Erreur lors de l'achat: %s", e)
         return JSONResponse(status_code=500, content={"detail": str(e)})
+    finally:
+        if owned:
+            idempotency_index.release(str(idempotency_key))  # Sans effet si la réponse a été enregistrée
+
+@app.post("/buy/batch")
+def buy_batch(request: BulkBuyRequest):
+    """
+    Rejouer en une passe les ventes saisies hors ligne par une tablette.
+    Les ventes sont appliquées dans l'ordre de leur horodatage, les doublons (clé
+    d'idempotence déjà vue) sont ignorés, et le marché, l'historique et la session
+    ne sont écrits qu'une seule fois pour tout le lot.
+    Fonction synchrone : FastAPI l'exécute dans le pool de threads, hors de la boucle d'événements.
+    """
+    load_timer_state()
+    load_session_if_exists()
+    logs.bind(batch_size=len(request.sales))
+
+    # Trier par horodatage (tri stable : l'ordre d'envoi départage les égalités)
+    indexed = []
+    results = [None] * len(request.sales)
+    for position, sale in enumerate(request.sales):
+        try:
+            sale_time = datetime.fromisoformat(sale.timestamp)
+            if sale_time.tzinfo is not None:
+                sale_time = sale_time.astimezone().replace(tzinfo=None)
+        except ValueError:
+            results[position] = {"index": position, "status": "error", "detail": "Horodatage invalide"}
+            continue
+        if sale.quantity <= 0:
+            results[position] = {"index": position, "status": "error", "detail": "Quantité invalide"}
+            continue
+        indexed.append((sale_time, position, sale))
+    indexed.sort(key=lambda item: (item[0], item[1]))
+
+    # Réserver les clés du lot, dans l'ordre trié : deux lots qui partagent des clés ne peuvent
+    # pas s'attendre mutuellement. Une clé en cours dans une autre requête est attendue.
+    previous_results = {}
+    claimed = []
+    try:
+        for key in sorted({sale.idempotency_key for _, _, sale in indexed if sale.idempotency_key}):
+            try:
+                previous_results[key] = idempotency_index.claim(key)
+            except TimeoutError:
+                raise HTTPException(status_code=409, detail="Vente déjà en cours de traitement, réessayez")
+            if previous_results[key] is None:
+                claimed.append(key)
+        return _apply_batch(indexed, results, previous_results)
+    finally:
+        for key in claimed:
+            idempotency_index.release(key)  # Sans effet pour les clés enregistrées
+
+def _apply_batch(indexed, results, previous_results):
+    # Écarter les doublons : déjà traités ou répétés dans le même lot
+    to_apply = []
+    seen_keys = set()
+    for sale_time, position, sale in indexed:
+        key = sale.idempotency_key
+        if key:
+            previous = previous_results.get(key)
+            if previous is not None or key in seen_keys:
+                results[position] = {"index": position, "status": "duplicate", "idempotency_key": key,
+                                     "original": previous}
+                continue
+            seen_keys.add(key)
+        to_apply.append((sale_time, position, sale))
+
+    mode = "immediate" if current_refresh_interval == 0 else "market"
+    applied = data_manager.apply_buys_batch(
+        [{"drink_id": sale.drink_id, "quantity": sale.quantity, "sold_at": sale_time.timestamp(),
+          "unit_price": sale.unit_price} for sale_time, _, sale in to_apply],
+        immediate=current_refresh_interval == 0
+    )
+
+    new_keys = {}
+    new_sales = []
+    for (sale_time, position, sale), outcome in zip(to_apply, applied):
+        if 'error' in outcome:
+            results[position] = {"index": position, "status": "error", "detail": outcome['error'],
+                                 "idempotency_key": sale.idempotency_key}
+            continue
+        active_drinks.add(sale.drink_id)
+        displayed_price = sale.unit_price if sale.unit_price is not None else outcome['price_rounded']
+        if current_session:
+            new_sales.append((sale.drink_id, outcome['name'], sale.quantity,
+                              displayed_price, outcome['base_price'], sale_time.isoformat()))
+        line = {
+            "status": "ok",
+            "drink_id": sale.drink_id,
+            "quantity": sale.quantity,
+            "new_price": outcome['new_price'],
+            "mode": mode
+        }
+        if sale.idempotency_key:
+            new_keys[sale.idempotency_key] = line
+        results[position] = {"index": position, "idempotency_key": sale.idempotency_key, **line}
+
+    applied_count = sum(1 for r in results if r["status"] == "ok")
+    if applied_count:
+        metrics.buys_total.inc(applied_count, mode=mode, source="offline_batch")
+    if new_sales:
+        with session_state_lock:
+            for new_sale in new_sales:
+                session_sales.add(*new_sale)
+            save_session()
+    idempotency_index.remember_many(new_keys)
+
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+    errors = sum(1 for r in results if r["status"] == "error")
+    log.info("Lot hors ligne rejoué: %s appliquées, %s doublons, %s erreurs", applied_count, duplicates, errors)
+
+    return {
+        "status": "ok",
+        "applied": applied_count,
+        "duplicates": duplicates,
+        "errors": errors,
+        "results": results
+    }
 
 @app.get("/history")
-async def get_history():
+async def get_history(request: Request):
     history = data_manager.get_history(limit=10)
-    return {"history": history}
+    return wire.negotiate(request, {"history": history})
 
 @app.get('/health')
 def health():
@@ -577,6 +1106,7 @@ async def get_session_status():
 @app.post('/reset')
 def reset():
     data_manager.reset_prices()
+    metrics.market_events_total.inc(event='reset', level='')
     return {'status': 'reset'}
 
 # ==========================================
@@ -592,6 +1122,12 @@ async def start_session(request: SessionStartRequest, admin: str = Depends(get_c
         raise HTTPException(status_code=400, detail="Une session est déjà active")
     
     session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    if request.pricing_model:
+        try:
+            data_manager.set_pricing_model(request.pricing_model, request.pricing_params)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
     current_session = {
         "session_id": session_id,
@@ -599,22 +1135,26 @@ async def start_session(request: SessionStartRequest, admin: str = Depends(get_c
         "start_time": datetime.now().isoformat(),
         "is_active": True
     }
+    if request.pricing_model:
+        current_session["pricing"] = data_manager.pricing_model.describe()
     
-    session_sales = []
+    session_sales = SalesStore()
     save_session() # Sauvegarde immédiate de la nouvelle session
+    open_leaderboards()  # Les hausses et baisses se comptent depuis le début de la session
+    log.info("Session démarrée: %s", request.session_name, extra={'session_id': session_id})
     
     return {"status": "success", "session": current_session}
 
 @app.get("/admin/session/current")
-async def get_current_session(admin: str = Depends(get_current_admin)):
+def get_current_session(admin: str = Depends(get_current_admin)):
     """Obtenir les statistiques de la session courante"""
     if not current_session:
         return {"session": None, "stats": None}
     
-    # Calculer les statistiques
-    total_sales = sum(sale['total_price'] for sale in session_sales)
-    total_profit_loss = sum(sale['profit_loss'] for sale in session_sales)
-    drinks_sold = sum(sale['quantity'] for sale in session_sales)
+    # Calculer les statistiques (sous le verrou : /buy ajoute des ventes depuis d'autres threads)
+    with session_state_lock:
+        total_sales, total_profit_loss, drinks_sold = session_sales.totals()
+        sales = [SessionSale(**sale) for sale in session_sales]
     
     stats = SessionStats(
         session_id=current_session.get('session_id'),
@@ -624,97 +1164,101 @@ async def get_current_session(admin: str = Depends(get_current_admin)):
         total_profit_loss=total_profit_loss,
         drinks_sold=drinks_sold,
         is_active=current_session.get('is_active', False),
-        sales=[SessionSale(**sale) for sale in session_sales]
+        sales=sales
     )
     
     return {"session": current_session, "stats": stats}
 
 @app.post("/admin/session/end")
-async def end_session(admin: str = Depends(get_current_admin)):
+def end_session(admin: str = Depends(get_current_admin)):
     """Terminer la session courante et sauvegarder dans un fichier CSV"""
     global current_session, session_sales
     
-    if not current_session or not current_session.get('is_active'):
-        raise HTTPException(status_code=400, detail="Aucune session active")
+    # Sous le verrou : aucune vente ne s'ajoute pendant l'écriture du fichier
+    with session_state_lock:
+        if not current_session or not current_session.get('is_active'):
+            raise HTTPException(status_code=400, detail="Aucune session active")
     
-    # Calculer les totaux finaux
-    total_sales = sum(sale['total_price'] for sale in session_sales)
-    total_profit_loss = sum(sale['profit_loss'] for sale in session_sales)
-    drinks_sold = sum(sale['quantity'] for sale in session_sales)
+        # Calculer les totaux finaux
+        total_sales, total_profit_loss, drinks_sold = session_sales.totals()
     
-    # Créer le fichier CSV de la session
-    session_id = current_session.get('session_id')
-    if not session_id:
-        # Générer un ID si manquant (cas de reprise de session ancienne)
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        current_session['session_id'] = session_id
-
-    # Si c'est une session reprise, utiliser le nom de fichier original
-    resumed_from = current_session.get('resumed_from')
-    if resumed_from:
-        session_filename = f"data/{resumed_from}"
-    else:
-        session_filename = f"data/session_{session_id}.csv"
+        # Créer le fichier CSV de la session
+        session_id = current_session.get('session_id')
+        if not session_id:
+            # Générer un ID si manquant (cas de reprise de session ancienne)
+            session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+            current_session['session_id'] = session_id
+
+        # Si c'est une session reprise, utiliser le nom de fichier original
+        resumed_from = current_session.get('resumed_from')
+        if resumed_from:
+            session_filename = f"data/{resumed_from}"
+        else:
+            session_filename = f"data/session_{session_id}.csv"
     
-    try:
-        with open(session_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['drink_id', 'drink_name', 'quantity', 'unit_price', 'base_price', 
-                         'total_price', 'profit_loss', 'timestamp']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        try:
+            with tracked_open(session_filename, 'w', newline='', encoding='utf-8') as csvfile:
+                fieldnames = SALE_FIELDNAMES
+                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             
-            # En-tête avec infos de session
-            writer.writeheader()
+                # En-tête avec infos de session
+                writer.writeheader()
             
-            # Ligne de résumé de session
-            start_time = current_session.get("start_time") or current_session.get("created_at", datetime.now().isoformat())
-            writer.writerow({
-                'drink_id': 'SESSION_SUMMARY',
-                'drink_name': f'Session: {current_session["session_name"]}',
-                'quantity': drinks_sold,
-                'unit_price': f'Start: {start_time}',
-                'base_price': f'End: {datetime.now().isoformat()}',
-                'total_price': total_sales,
-                'profit_loss': total_profit_loss,
-                'timestamp': '' # Anciennement 'Starting Cash'
-            })
+                # Ligne de résumé de session
+                start_time = current_session.get("start_time") or current_session.get("created_at", datetime.now().isoformat())
+                writer.writerow({
+                    'drink_id': 'SESSION_SUMMARY',
+                    'drink_name': f'Session: {current_session["session_name"]}',
+                    'quantity': drinks_sold,
+                    'unit_price': f'Start: {start_time}',
+                    'base_price': f'End: {datetime.now().isoformat()}',
+                    'total_price': total_sales,
+                    'profit_loss': total_profit_loss,
+                    'timestamp': '' # Anciennement 'Starting Cash'
+                })
             
-            # Ligne vide pour séparer
-            writer.writerow({k: '' for k in fieldnames})
+                # Ligne vide pour séparer
+                writer.writerow({k: '' for k in fieldnames})
             
-            # Toutes les ventes
-            for sale in session_sales:
-                writer.writerow(sale)
+                # Toutes les ventes
+                for sale in session_sales:
+                    writer.writerow(sale)
     
-        # Marquer la session comme terminée
-        current_session['is_active'] = False
-        current_session['end_time'] = datetime.now().isoformat()
-        current_session['total_sales'] = total_sales
-        current_session['total_profit_loss'] = total_profit_loss
-        current_session['drinks_sold'] = drinks_sold
+            # Marquer la session comme terminée
+            current_session['is_active'] = False
+            current_session['end_time'] = datetime.now().isoformat()
+            current_session['total_sales'] = total_sales
+            current_session['total_profit_loss'] = total_profit_loss
+            current_session['drinks_sold'] = drinks_sold
         
-        # Supprimer le fichier de session temporaire
-        if os.path.exists('data/current_session.json'):
-            os.remove('data/current_session.json')
-            print("Fichier de session temporaire supprimé.")
+            # Supprimer le fichier de session temporaire
+            if os.path.exists('data/current_session.json'):
+                os.remove('data/current_session.json')
+                log.info("Fichier de session temporaire supprimé.", extra={'session_id': session_id})
         
-        session_data = {
-            "session": current_session,
-            "stats": {
-                "total_sales": total_sales,
-                "total_profit_loss": total_profit_loss,
-                "drinks_sold": drinks_sold,
-                "session_file": session_filename
+            session_data = {
+                "session": current_session,
+                "stats": {
+                    "total_sales": total_sales,
+                    "total_profit_loss": total_profit_loss,
+                    "drinks_sold": drinks_sold,
+                    "session_file": session_filename
+                }
             }
-        }
         
-        # Réinitialiser pour la prochaine session
-        current_session = None
-        session_sales = []
+            log.info("Session terminée: %s ventes, CA %.2f€", len(session_sales), total_sales,
+                     extra={'session_id': session_id, 'session_file': session_filename})
+
+            # Réinitialiser pour la prochaine session
+            if current_session.get('pricing'):
+                apply_pricing(*venue_pricing)
+            current_session = None
+            session_sales = SalesStore()
         
-        return {"status": "success", "message": f"Session sauvegardée dans {session_filename}", "data": session_data}
+            return {"status": "success", "message": f"Session sauvegardée dans {session_filename}", "data": session_data}
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erreur lors de la sauvegarde: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Erreur lors de la sauvegarde: {str(e)}")
 
 @app.post("/admin/session/resume")
 async def resume_session(admin: str = Depends(get_current_admin)):
@@ -735,128 +1279,12 @@ async def resume_session(admin: str = Depends(get_current_admin)):
 @app.get("/admin/sessions/list")
 async def list_previous_sessions(admin: str = Depends(get_current_admin)):
     """Lister toutes les sessions précédentes"""
-    import glob
-    import os
-    import pandas as pd
-    
-    sessions = []
-    session_files = glob.glob("data/session_*.csv")
-    
-    for file_path in session_files:
-        try:
-            # Vérifier que le fichier existe toujours
-            if not os.path.exists(file_path):
-                continue
-                
-            filename = os.path.basename(file_path)
-            # Parse le nom de fichier pour extraire les infos
-            if filename.startswith("session_session_"):
-                timestamp_str = filename.replace("session_session_", "").replace(".csv", "")
-                created_at = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-            else:
-                # Fallback sur les stats du fichier
-                created_at = datetime.fromtimestamp(os.path.getctime(file_path))
-            
-            # Lire les données de la session depuis le CSV
-            try:
-                df = pd.read_csv(file_path)
-                
-                # Nettoyer les données : supprimer les lignes vides et les valeurs NaN
-                df = df.dropna(how='all')  # Supprimer les lignes complètement vides
-                df = df.fillna(0)  # Remplacer les NaN par 0
-                
-                if len(df) > 0:
-                    # Filtrer les lignes qui ne sont pas SESSION_SUMMARY pour les calculs
-                    data_rows = df[df['drink_id'] != 'SESSION_SUMMARY']
-                    summary_rows = df[df['drink_id'] == 'SESSION_SUMMARY']
-                    
-                    # Gérer les valeurs NaN avec fillna() et valeurs par défaut
-                    total_sales = data_rows['total_price'].fillna(0).sum()
-                    total_profit_loss = data_rows['profit_loss'].fillna(0).sum() 
-                    total_drinks_sold = data_rows['quantity'].fillna(0).sum()
-                    
-                    # Extraire le nom de session depuis SESSION_SUMMARY
-                    if len(summary_rows) > 0:
-                        session_info = summary_rows.iloc[0]['drink_name']  # "Session: Alice" ou "Barman: Alice" (rétrocompatibilité)
-                        if session_info and session_info.startswith('Session: '):
-                            session_name = session_info.replace('Session: ', '')
-                        elif session_info and session_info.startswith('Barman: '):
-                            session_name = session_info.replace('Barman: ', '')
-                        else:
-                            session_name = session_info or "Session inconnue"
-                    else:
-                        # Fallback: extraire depuis le nom de fichier
-                        if filename.startswith("session_session_"):
-                            timestamp_str = filename.replace("session_session_", "").replace(".csv", "")
-                            session_name = f"Session {timestamp_str}"
-                        else:
-                            session_name = filename.replace("session_", "").replace(".csv", "")
-                    
-                    # Calculer la durée depuis SESSION_SUMMARY si disponible
-                    duration_hours = None
-                    if len(summary_rows) > 0:
-                        try:
-                            # Extraire les timestamps de début/fin du SESSION_SUMMARY
-                            start_str = str(summary_rows.iloc[0]['unit_price'])  # Start: timestamp
-                            end_str = str(summary_rows.iloc[0]['base_price'])    # End: timestamp
-                            
-                            if start_str and end_str and start_str.startswith('Start: ') and end_str.startswith('End: '):
-                                start_time_str = start_str.replace('Start: ', '')
-                                end_time_str = end_str.replace('End: ', '')
-                                
-                                start_time = pd.to_datetime(start_time_str)
-                                end_time = pd.to_datetime(end_time_str)
-                                duration_hours = (end_time - start_time).total_seconds() / 3600
-                        except Exception as e:
-                            print(f"Erreur calcul durée session {filename}: {e}")
-                            duration_hours = None
-                    
-                    # Fallback: calculer depuis les ventes si pas de SESSION_SUMMARY
-                    if duration_hours is None and len(data_rows) > 1:
-                        try:
-                            first_sale = pd.to_datetime(data_rows['timestamp'].iloc[0])
-                            last_sale = pd.to_datetime(data_rows['timestamp'].iloc[-1])
-                            duration_hours = (last_sale - first_sale).total_seconds() / 3600
-                        except:
-                            duration_hours = None
-                else:
-                    total_sales = 0
-                    total_profit_loss = 0
-                    total_drinks_sold = 0
-                    session_name = "Session vide"
-                    duration_hours = None
-                    
-            except Exception as e:
-                # Si erreur de lecture CSV, utiliser des valeurs par défaut
-                total_sales = 0
-                total_profit_loss = 0
-                total_drinks_sold = 0
-                session_name = "Données indisponibles"
-                duration_hours = None
-            
-            sessions.append({
-                "filename": filename,
-                "created_at": created_at.isoformat(),
-                "session_name": session_name,  # Changé de barman_name à session_name
-                "total_sales": float(total_sales) if not pd.isna(total_sales) else 0.0,
-                "total_profit_loss": float(total_profit_loss) if not pd.isna(total_profit_loss) else 0.0,
-                "total_drinks_sold": int(total_drinks_sold) if not pd.isna(total_drinks_sold) else 0,
-                "duration_hours": float(duration_hours) if duration_hours is not None and not pd.isna(duration_hours) else None
-            })
-            
-        except Exception as e:
-            print(f"Erreur lors de l'analyse de {file_path}: {e}")
-            continue
-    
-    return {"sessions": sessions}
+    return {"sessions": session_files.list_sessions()}
 
 @app.post("/admin/session/resume/{filename:path}")
 async def resume_specific_session(filename: str, admin: str = Depends(get_current_admin)):
     """Reprendre une session spécifique à partir de son fichier CSV."""
     global current_session, session_sales
-    
-    import os
-    import pandas as pd
 
     if current_session and current_session.get('is_active'):
         raise HTTPException(status_code=409, detail="Une autre session est déjà active. Veuillez la terminer d'abord.")
@@ -869,24 +1297,19 @@ async def resume_specific_session(filename: str, admin: str = Depends(get_curren
         raise HTTPException(status_code=404, detail=f"Session {filename} non trouvée.")
 
     try:
-        df = pd.read_csv(file_path)
-        df = df.dropna(how='all').fillna(0)
-        
-        summary_rows = df[df['drink_id'] == 'SESSION_SUMMARY']
-        if summary_rows.empty:
+        summary, sales = session_files.load_session(file_path)
+        if summary is None:
             raise HTTPException(status_code=400, detail="Fichier de session invalide (pas de résumé).")
 
-        summary = summary_rows.iloc[0]
-        
-        session_name_info = summary['drink_name']
-        if session_name_info and 'Session: ' in str(session_name_info):
-            session_name = str(session_name_info).replace('Session: ', '')
+        session_name_info = summary.get('drink_name') or ''
+        if 'Session: ' in session_name_info:
+            session_name = session_name_info.replace('Session: ', '')
         else:
             session_name = "Session Reprise"
 
-        start_time_info = summary['unit_price']
-        if start_time_info and 'Start: ' in str(start_time_info):
-            start_time = str(start_time_info).replace('Start: ', '')
+        start_time_info = summary.get('unit_price') or ''
+        if 'Start: ' in start_time_info:
+            start_time = start_time_info.replace('Start: ', '')
         else:
             start_time = datetime.now().isoformat()
 
@@ -898,22 +1321,22 @@ async def resume_specific_session(filename: str, admin: str = Depends(get_curren
             "resumed_from": filename
         }
 
-        sales_df = df[df['drink_id'] != 'SESSION_SUMMARY'].dropna(subset=['drink_id'])
-        sales_df['quantity'] = pd.to_numeric(sales_df['quantity'], errors='coerce').fillna(0).astype(int)
-        sales_df['unit_price'] = pd.to_numeric(sales_df['unit_price'], errors='coerce').fillna(0).astype(float)
-        sales_df['base_price'] = pd.to_numeric(sales_df['base_price'], errors='coerce').fillna(0).astype(float)
-        sales_df['total_price'] = pd.to_numeric(sales_df['total_price'], errors='coerce').fillna(0).astype(float)
-        sales_df['profit_loss'] = pd.to_numeric(sales_df['profit_loss'], errors='coerce').fillna(0).astype(float)
-        
-        session_sales = sales_df.to_dict('records')
+        # Remplir directement les colonnes du magasin de ventes, sans dict intermédiaire par vente
+        session_sales = SalesStore()
+        for sale in sales:
+            session_sales.add(*sale)
         
         save_session()
 
         return {"status": "resumed", "session": current_session}
 
+    except HTTPException:
+        current_session = None
+        session_sales = SalesStore()
+        raise
     except Exception as e:
         current_session = None
-        session_sales = []
+        session_sales = SalesStore()
         raise HTTPException(status_code=500, detail=f"Erreur lors de la reprise de session: {str(e)}")
 
 @app.delete("/admin/session/delete/{filename:path}")
@@ -939,9 +1362,6 @@ async def delete_session(filename: str, admin: str = Depends(get_current_admin))
 @app.get("/admin/session/export/{filename:path}")
 async def export_session_treasury(filename: str, admin: str = Depends(get_current_admin)):
     """Exporter la trésorerie d'une session en CSV."""
-    import os
-    import pandas as pd
-
     # Sécurité
     if not filename.endswith('.csv') or '..' in filename:
         raise HTTPException(status_code=400, detail="Nom de fichier invalide")
@@ -951,40 +1371,10 @@ async def export_session_treasury(filename: str, admin: str = Depends(get_curren
         raise HTTPException(status_code=404, detail="Session non trouvée")
 
     try:
-        df = pd.read_csv(file_path)
-        
-        # Filtrer les ventes réelles
-        sales_df = df[df['drink_id'] != 'SESSION_SUMMARY'].dropna(subset=['drink_id'])
-        sales_df['quantity'] = pd.to_numeric(sales_df['quantity'], errors='coerce').fillna(0)
-        sales_df['total_price'] = pd.to_numeric(sales_df['total_price'], errors='coerce').fillna(0)
-        sales_df['profit_loss'] = pd.to_numeric(sales_df['profit_loss'], errors='coerce').fillna(0)
-
-        # Agréger les données par boisson
-        treasury_df = sales_df.groupby('drink_name').agg(
-            Quantite_Vendue=('quantity', 'sum'),
-            Chiffre_Affaires_Total=('total_price', 'sum'),
-            Profit_Perte_Total=('profit_loss', 'sum')
-        ).reset_index()
-
-        # Renommer la colonne
-        treasury_df.rename(columns={'drink_name': 'Boisson'}, inplace=True)
-
-        # Ajouter une ligne de totaux
-        total_row = pd.DataFrame({
-            'Boisson': ['TOTAL'],
-            'Quantite_Vendue': [treasury_df['Quantite_Vendue'].sum()],
-            'Chiffre_Affaires_Total': [treasury_df['Chiffre_Affaires_Total'].sum()],
-            'Profit_Perte_Total': [treasury_df['Profit_Perte_Total'].sum()]
-        })
-        
-        treasury_df = pd.concat([treasury_df, total_row], ignore_index=True)
-
-        output = io.StringIO()
-        treasury_df.to_csv(output, index=False, sep=';', encoding='utf-8-sig')
-        output.seek(0)
+        content = session_files.treasury_csv(file_path)
 
         download_filename = f"tresorerie_{filename}"
-        return StreamingResponse(iter([output.getvalue()]), media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={download_filename}"})
+        return StreamingResponse(iter([content]), media_type="text/csv", headers={"Content-Disposition": f"attachment; filename={download_filename}"})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération du CSV: {str(e)}")
@@ -992,6 +1382,7 @@ async def export_session_treasury(filename: str, admin: str = Depends(get_curren
 @app.post('/crash')
 def crash():
     data_manager.trigger_crash()
+    metrics.market_events_total.inc(event='crash', level='medium')
     return {'status': 'crash_triggered'}
 
 @app.get('/admin/status')
@@ -1009,8 +1400,8 @@ async def admin_status(admin: str = Depends(get_current_admin)):
 
 @app.get('/admin/drinks')
 async def admin_get_drinks(admin: str = Depends(get_current_admin)):
-    drinks = data_manager.get_all_prices()
-    return {'drinks': drinks}
+    snapshot = data_manager.snapshot()
+    return {'drinks': data_manager.get_all_prices(snapshot), 'version': snapshot.version}
 
 @app.post('/admin/drinks')
 async def admin_create_drink(payload: CreateDrinkRequest, admin: str = Depends(get_current_admin)):
@@ -1076,6 +1467,7 @@ async def admin_update_price(drink_id: int, request: Request, admin: str = Depen
     data_manager.update_drink_price(drink_id, new_price)
     change = new_price - old_price
     data_manager.add_history_entry(drink_id, drink['name'], new_price, 0, change, 'manual_update')
+    metrics.market_events_total.inc(event='manual_update', level='')
     
     return {
         'status': 'updated',
@@ -1086,9 +1478,20 @@ async def admin_update_price(drink_id: int, request: Request, admin: str = Depen
     }
 
 @app.get('/admin/history')
-async def admin_get_history(limit: int = 10, admin: str = Depends(get_current_admin)):
-    history = data_manager.get_history(limit=limit)
-    return {'history': history}
+async def admin_get_history(limit: int = 10, start: Optional[str] = Query(None, alias='from'),
+                            end: Optional[str] = Query(None, alias='to'), admin: str = Depends(get_current_admin)):
+    """Dernières entrées, ou entrées d'une plage de dates (from/to : epoch ou ISO) archive comprise"""
+    start_ts = _parse_time_param(start, 'from')
+    end_ts = _parse_time_param(end, 'to')
+    if start_ts is None and end_ts is None:
+        history = data_manager.get_history(limit=limit)
+    else:
+        # L'historique est horodaté en heure locale ISO
+        history = data_manager.get_history_range(
+            datetime.fromtimestamp(start_ts).isoformat() if start_ts is not None else None,
+            datetime.fromtimestamp(end_ts).isoformat() if end_ts is not None else None,
+            limit=limit)
+    return {'history': history, 'total': data_manager.get_history_size()}
 
 @app.post('/admin/history/update/{entry_id}')
 async def admin_update_history(entry_id: int, request: Request, admin: str = Depends(get_current_admin)):
@@ -1117,12 +1520,45 @@ async def admin_clear_history(admin: str = Depends(get_current_admin)):
     data_manager.clear_history()
     return {'status': 'cleared'}
 
+def _session_sales_of(sales):
+    """Ventes d'une transaction annulée / rétablie qui appartiennent à la session en cours"""
+    if not current_session or not current_session.get('is_active'):
+        return []
+    session_start = datetime.fromisoformat(current_session['start_time']).timestamp()
+    # Les ventes sans heure (pile écrite avant qu'elle y soit gardée) ne peuvent pas être retrouvées
+    return [sale for sale in sales if len(sale) >= 6 and sale[5] >= session_start]
+
 @app.post("/admin/history/undo")
 async def admin_undo_transaction(admin: str = Depends(get_current_admin)):
     undone = data_manager.undo_last_transaction()
     if not undone:
         raise HTTPException(status_code=404, detail="Aucune transaction à annuler")
-    return {"status": "undone", "details": undone}
+    sales = _session_sales_of(undone['sales'])
+    if sales:
+        # L'achat annulé ne compte plus dans le chiffre de la session : sa vente, retrouvée par son heure
+        with session_state_lock:
+            for drink_id, _, quantity, _, _, sold_at in sales:
+                session_sales.remove(drink_id, quantity, sold_at)
+            save_session()
+    return {"status": "undone", "details": undone, "stack": data_manager.undo_log.status()}
+
+@app.post("/admin/history/redo")
+async def admin_redo_transaction(admin: str = Depends(get_current_admin)):
+    redone = data_manager.redo_last_transaction()
+    if not redone:
+        raise HTTPException(status_code=404, detail="Aucune transaction à rétablir")
+    sales = _session_sales_of(redone['sales'])
+    if sales:
+        with session_state_lock:
+            for sale in sales:
+                session_sales.add(*sale)  # Heure d'origine de la vente
+            save_session()
+    return {"status": "redone", "details": redone, "stack": data_manager.undo_log.status()}
+
+@app.get("/admin/history/undo")
+async def admin_undo_status(admin: str = Depends(get_current_admin)):
+    """Taille des piles annuler / rétablir et prochaines transactions concernées"""
+    return data_manager.undo_log.status()
 
 @app.post('/admin/market/crash')
 async def admin_trigger_crash(level: str = "medium", admin: str = Depends(get_current_admin)):
@@ -1135,6 +1571,8 @@ async def admin_trigger_crash(level: str = "medium", admin: str = Depends(get_cu
         raise HTTPException(status_code=400, detail=f"Niveau invalide. Utilisez: {', '.join(valid_levels)}")
     
     data_manager.trigger_crash(level)
+    metrics.market_events_total.inc(event='crash', level=level)
+    log.info("Crash du marché déclenché (%s)", level, extra={'admin': admin})
     return {'status': 'crash_triggered', 'level': level, 'admin': admin}
 
 @app.post('/admin/market/boom')
@@ -1148,11 +1586,15 @@ async def admin_trigger_boom(level: str = "medium", admin: str = Depends(get_cur
         raise HTTPException(status_code=400, detail=f"Niveau invalide. Utilisez: {', '.join(valid_levels)}")
     
     data_manager.trigger_boom(level)
+    metrics.market_events_total.inc(event='boom', level=level)
+    log.info("Boom du marché déclenché (%s)", level, extra={'admin': admin})
     return {'status': 'boom_triggered', 'level': level, 'admin': admin}
 
 @app.post('/admin/market/reset')
 async def admin_reset_market(admin: str = Depends(get_current_admin)):
     data_manager.reset_prices()
+    metrics.market_events_total.inc(event='reset', level='')
+    log.info("Prix du marché réinitialisés", extra={'admin': admin})
     return {'status': 'market_reset', 'admin': admin}
 
 @app.post('/admin/happy-hour/start')
@@ -1166,9 +1608,28 @@ async def admin_start_happy_hour(request: Request, admin: str = Depends(get_curr
     
     if duration <= 0 or duration > 7200:  # Maximum 2 heures
         raise HTTPException(status_code=400, detail="Durée invalide (1-7200 secondes)")
+
+    # Programmation optionnelle : start_at (date ISO ou epoch) ou delay (secondes)
+    start_at = None
+    start_ts = _parse_time_param(str(data['start_at']), 'start_at') if data.get('start_at') not in (None, '') else None
+    if start_ts is None and data.get('delay'):
+        try:
+            start_ts = time.time() + float(data['delay'])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Paramètre 'delay' invalide")
+    if start_ts is not None:
+        if start_ts - time.time() > 7 * 24 * 3600:
+            raise HTTPException(status_code=400, detail="Programmation limitée à 7 jours")
+        start_at = datetime.fromtimestamp(start_ts)
     
     try:
-        result = data_manager.start_happy_hour(drink_id, duration)
+        result = data_manager.start_happy_hour(drink_id, duration, start_at)
+        if result['scheduled']:
+            metrics.happy_hours_total.inc(action='schedule')
+            log.info("Happy Hour programmée à %s pour %ss", result['start_time'], duration, extra={'drink_id': drink_id})
+            return {'status': 'happy_hour_scheduled', 'data': result, 'admin': admin}
+        metrics.happy_hours_total.inc(action='start')
+        log.info("Happy Hour démarrée pour %ss", duration, extra={'drink_id': drink_id})
         return {'status': 'happy_hour_started', 'data': result, 'admin': admin}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1178,17 +1639,19 @@ async def admin_stop_happy_hour(drink_id: int, admin: str = Depends(get_current_
     success = data_manager.stop_happy_hour(drink_id)
     if not success:
         raise HTTPException(status_code=404, detail="Happy Hour non trouvée pour cette boisson")
+    metrics.happy_hours_total.inc(action='stop')
     return {'status': 'happy_hour_stopped', 'drink_id': drink_id, 'admin': admin}
 
 @app.post('/admin/happy-hour/stop-all')
 async def admin_stop_all_happy_hours(admin: str = Depends(get_current_admin)):
     count = data_manager.stop_all_happy_hours()
+    metrics.happy_hours_total.inc(count, action='stop')
     return {'status': 'all_happy_hours_stopped', 'count': count, 'admin': admin}
 
 @app.get('/admin/happy-hour/active')
 async def admin_get_active_happy_hours(admin: str = Depends(get_current_admin)):
     active_hours = data_manager.get_active_happy_hours()
-    return {'active_happy_hours': active_hours}
+    return {'active_happy_hours': active_hours, 'scheduled_happy_hours': data_manager.get_scheduled_happy_hours()}
 
 @app.get('/happy-hour/active')
 async def get_public_active_happy_hours():
@@ -1220,7 +1683,8 @@ client_path = os.path.join(os.path.dirname(__file__), 'client')
 if os.path.isdir(client_path):
     # This mount should be the last thing in the file. It will serve index.html for "/"
     # and will pass requests to API routes if no file is found.
-    app.mount("/", StaticFiles(directory=client_path, html=True), name="static")
+    # Fichiers empreintés et pré-compressés en mémoire (rechargés à chaud si BIERE_DEBUG=1)
+    app.mount("/", StaticAssets(client_path, reload=DEBUG_MODE), name="static")
 
 if __name__ == "__main__":
     uvicorn.run("server:app", host="0.0.0.0", port=8000, reload=False)
\ No newline at end of file
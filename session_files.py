@@ -0,0 +1,188 @@
+"""
+Lecture des fichiers de session terminée (data/session_*.csv) avec le module csv, sans pandas.
+
+Un fichier de session, écrit par /admin/session/end, contient une ligne SESSION_SUMMARY
+(nom de session, "Start: ..." / "End: ..."), une ligne vide puis les ventes. Chaque fonction
+le lit en un seul passage, ligne par ligne : la liste des sessions, la reprise et l'export de
+trésorerie ne paient plus l'import de pandas (plusieurs centaines de ms au premier chargement
+de la page admin sur un Raspberry Pi) pour des fichiers de quelques centaines de lignes.
+
+Les résumés de la liste sont gardés en cache tant que le fichier ne change pas.
+"""
+import csv
+import glob
+import io
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from iostats import tracked_open
+from logs import get_logger
+
+log = get_logger('sessions')
+
+SUMMARY_ID = 'SESSION_SUMMARY'
+
+_summaries: Dict[str, Tuple[Tuple[int, int], Dict]] = {}  # {chemin: (signature du fichier, résumé)}
+
+
+def _number(value, cast=float):
+    """Valeur numérique d'une cellule ; 0 si vide ou illisible (comme fillna(0))"""
+    try:
+        return cast(float(value)) if value not in (None, '') else cast(0)
+    except ValueError:
+        return cast(0)
+
+
+def _parse_time(value) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+def read_rows(path: str) -> Iterator[Dict]:
+    """Lignes non vides du fichier (la ligne de séparation est sautée)"""
+    with tracked_open(path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if any(value not in (None, '') for value in row.values()):
+                yield row
+
+
+def session_name_of(summary: Optional[Dict], default: str) -> str:
+    info = (summary or {}).get('drink_name') or ''
+    for prefix in ('Session: ', 'Barman: '):  # "Barman: " : rétrocompatibilité
+        if info.startswith(prefix):
+            return info[len(prefix):]
+    return info or default
+
+
+def summarize(path: str) -> Dict:
+    """Totaux, nom et durée d'une session, en un passage sur le fichier"""
+    filename = os.path.basename(path)
+    summary = None
+    total_sales = total_profit_loss = 0.0
+    total_drinks_sold = 0
+    first_sale = last_sale = None
+    count = sales = 0
+    for row in read_rows(path):
+        count += 1
+        if row.get('drink_id') == SUMMARY_ID:
+            summary = summary or row
+            continue
+        total_sales += _number(row.get('total_price'))
+        total_profit_loss += _number(row.get('profit_loss'))
+        total_drinks_sold += _number(row.get('quantity'), int)
+        sales += 1
+        if first_sale is None:
+            first_sale = row.get('timestamp')
+        last_sale = row.get('timestamp')
+
+    if not count:
+        return {'session_name': "Session vide", 'total_sales': 0.0, 'total_profit_loss': 0.0,
+                'total_drinks_sold': 0, 'duration_hours': None}
+
+    if summary is not None:
+        default_name = "Session inconnue"
+    elif filename.startswith("session_session_"):
+        # Pas de résumé : nom tiré du fichier
+        default_name = f"Session {filename.replace('session_session_', '').replace('.csv', '')}"
+    else:
+        default_name = filename.replace("session_", "").replace(".csv", "")
+
+    # Durée depuis SESSION_SUMMARY ("Start: ..." / "End: ..."), sinon depuis la première et la dernière vente
+    duration_hours = None
+    if summary is not None:
+        start_str, end_str = summary.get('unit_price') or '', summary.get('base_price') or ''
+        if start_str.startswith('Start: ') and end_str.startswith('End: '):
+            start, end = _parse_time(start_str[7:]), _parse_time(end_str[5:])
+            if start and end:
+                duration_hours = (end - start).total_seconds() / 3600
+    if duration_hours is None and sales > 1:
+        start, end = _parse_time(first_sale), _parse_time(last_sale)
+        if start and end:
+            duration_hours = (end - start).total_seconds() / 3600
+
+    return {
+        'session_name': session_name_of(summary, default_name),
+        'total_sales': total_sales,
+        'total_profit_loss': total_profit_loss,
+        'total_drinks_sold': total_drinks_sold,
+        'duration_hours': duration_hours,
+    }
+
+
+def list_sessions(data_dir: str = 'data') -> List[Dict]:
+    """Sessions terminées avec leurs totaux ; seuls les fichiers nouveaux ou modifiés sont relus"""
+    sessions = []
+    for path in glob.glob(os.path.join(data_dir, "session_*.csv")):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        filename = os.path.basename(path)
+        try:
+            created_at = datetime.strptime(filename.replace("session_session_", "").replace(".csv", ""), "%Y%m%d_%H%M%S")
+        except ValueError:
+            # Fallback sur les stats du fichier
+            created_at = datetime.fromtimestamp(st.st_ctime)
+
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = _summaries.get(path)
+        if cached is not None and cached[0] == stamp:
+            info = cached[1]
+        else:
+            try:
+                info = summarize(path)
+            except Exception as e:
+                # Si erreur de lecture CSV, utiliser des valeurs par défaut
+                log.warning("Erreur lors de l'analyse de %s: %s", path, e)
+                info = {'session_name': "Données indisponibles", 'total_sales': 0.0, 'total_profit_loss': 0.0,
+                        'total_drinks_sold': 0, 'duration_hours': None}
+            _summaries[path] = (stamp, info)
+        sessions.append({'filename': filename, 'created_at': created_at.isoformat(), **info})
+    return sessions
+
+
+def load_session(path: str) -> Tuple[Optional[Dict], Iterator[Tuple]]:
+    """
+    (ligne SESSION_SUMMARY ou None, ventes) ; les ventes sont des tuples
+    (drink_id, drink_name, quantity, unit_price, base_price, timestamp) prêts pour SalesStore.add.
+    """
+    rows = list(read_rows(path))
+    summary = next((row for row in rows if row.get('drink_id') == SUMMARY_ID), None)
+
+    def sales():
+        for row in rows:
+            drink_id = row.get('drink_id')
+            if drink_id == SUMMARY_ID:
+                continue
+            try:
+                drink_id = int(float(drink_id))
+            except (TypeError, ValueError):
+                continue
+            yield (drink_id, row.get('drink_name') or '', _number(row.get('quantity'), int),
+                   _number(row.get('unit_price')), _number(row.get('base_price')), row.get('timestamp') or None)
+    return summary, sales()
+
+
+def treasury_csv(path: str) -> str:
+    """Trésorerie par boisson (quantité, chiffre d'affaires, gain/perte) et ligne TOTAL, séparateur ';'"""
+    totals: Dict[str, List] = {}
+    for row in read_rows(path):
+        if row.get('drink_id') in (SUMMARY_ID, None, ''):
+            continue
+        entry = totals.setdefault(row.get('drink_name') or '', [0, 0.0, 0.0])
+        entry[0] += _number(row.get('quantity'), int)
+        entry[1] += _number(row.get('total_price'))
+        entry[2] += _number(row.get('profit_loss'))
+
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['Boisson', 'Quantite_Vendue', 'Chiffre_Affaires_Total', 'Profit_Perte_Total'])
+    for name in sorted(totals):
+        quantity, revenue, profit = totals[name]
+        writer.writerow([name, quantity, round(revenue, 2), round(profit, 2)])
+    writer.writerow(['TOTAL', sum(t[0] for t in totals.values()), round(sum(t[1] for t in totals.values()), 2),
+                     round(sum(t[2] for t in totals.values()), 2)])
+    return output.getvalue()
@@ -0,0 +1,270 @@
+"""
+Chronologie des prix en événements, pour retrouver la carte exacte à n'importe quel instant
+(litige au bar, récap de soirée).
+
+Chaque carte publiée par CSVDataManager est comparée à la dernière carte connue : une ligne
+par boisson modifiée est ajoutée à timeline.jsonl ({t, e, id, d}), avec le type d'événement
+(buy, balance, crash_*, boom_*, reset, manual_update, undo, happy_hour_start...) et les champs
+qui ont changé. Les événements sont écrits par lots (flush()) et, tous les `checkpoint_every`
+événements ou toutes les `checkpoint_seconds` secondes, la carte complète est ajoutée à
+timeline_checkpoints.jsonl avec la position correspondante dans le fichier d'événements.
+
+Pour la carte à l'instant T : dernier point de contrôle avant T (bisect), puis rejeu des seuls
+événements écrits après lui, jusqu'à T.
+
+Le prix enregistré est le prix écrit ; le retour vers le prix de base (decay) se calculant
+à la lecture, seuls les changements de demi-vie sont des événements ({t, e: half_life, d}).
+board_at applique ensuite la même formule que CSVDataManager, depuis la dernière écriture du
+prix (ou l'activation du decay) jusqu'à T : on retrouve le prix affiché à T.
+
+Les événements attendent le prochain flush() (sauvegarde périodique de server.py, toutes les
+30 s) : un arrêt brutal perd au plus ces 30 s. Les prix repris du journal au redémarrage sont
+alors enregistrés comme 'reload', à l'heure du redémarrage. Les changements de demi-vie, rares,
+sont écrits tout de suite.
+"""
+import json
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+
+from iostats import repair_tail, tracked_open
+from logs import get_logger
+
+log = get_logger('timeline')
+
+FIELDS = ('name', 'price', 'base_price', 'min_price', 'max_price', 'alcohol_degree')
+
+
+def _apply(board: Dict[int, Dict], decay: Dict, event: Dict):
+    """Applique un événement à une carte {drink_id: fiche} et au réglage du decay {seconds, since}"""
+    kind = event['e']
+    if kind == 'half_life':
+        decay.update(seconds=event['d']['seconds'], since=event['t'])
+        return
+    drink_id = event['id']
+    if kind == 'drink_deleted':
+        board.pop(drink_id, None)
+        return
+    drink = board.setdefault(drink_id, {'happy_hour': False})
+    if kind == 'happy_hour_start':
+        drink['happy_hour'] = True
+    elif kind == 'happy_hour_end':
+        drink['happy_hour'] = False
+    else:
+        drink.update(event.get('d', {}))
+        if 'price' in event.get('d', {}):
+            drink['updated_at'] = event['t']
+
+
+def _decayed_price(drink: Dict, decay: Dict, at: float) -> float:
+    """Prix affiché à `at` : base + (prix - base) * 2^(-écoulé / demi-vie), comme CSVDataManager"""
+    price, base = drink.get('price'), drink.get('base_price')
+    if not decay['seconds'] or price is None or base is None or price == base:
+        return price
+    elapsed = at - max(drink.get('updated_at', 0.0), decay['since'])
+    if elapsed <= 0:
+        return price
+    return base + (price - base) * 0.5 ** (elapsed / decay['seconds'])
+
+
+class PriceTimeline:
+    def __init__(self, data_dir: str, checkpoint_every: int = 2000, checkpoint_seconds: float = 300.0):
+        self.events_path = os.path.join(data_dir, 'timeline.jsonl')
+        self.checkpoints_path = os.path.join(data_dir, 'timeline_checkpoints.jsonl')
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self._board: Dict[int, Dict] = {}  # Dernière carte connue (événements en attente compris)
+        self._decay = {'seconds': 0.0, 'since': 0.0}  # Demi-vie en cours et heure du changement
+        self._pending: List[str] = []
+        self._last_stamp = 0.0
+        self._events_size = 0
+        # Index des points de contrôle : heure et position de la ligne dans timeline_checkpoints.jsonl
+        self._checkpoint_times = array('d')
+        self._checkpoint_lines = array('q')
+        self._since_checkpoint = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Relit l'index des points de contrôle et reconstruit la dernière carte"""
+        with self._lock:
+            self._events_size = self._repair(self.events_path)
+            self._repair(self.checkpoints_path)
+            if os.path.exists(self.checkpoints_path):
+                with tracked_open(self.checkpoints_path, 'rb') as f:
+                    position = 0
+                    for line in f:
+                        try:
+                            checkpoint = json.loads(line)
+                        except ValueError:
+                            position += len(line)
+                            continue
+                        self._checkpoint_times.append(checkpoint['t'])
+                        self._checkpoint_lines.append(position)
+                        position += len(line)
+            if self._checkpoint_times:
+                self._last_stamp = self._checkpoint_times[-1]
+            self._board, self._decay, replayed, last = self._rebuild(None, self._events_size, len(self._checkpoint_times) - 1)
+            self._last_stamp = max(self._last_stamp, last)
+            self._since_checkpoint = replayed
+            log.info("Chronologie des prix chargée: %s boissons, %s points de contrôle, %s événements rejoués",
+                     len(self._board), len(self._checkpoint_times), replayed)
+
+    @staticmethod
+    def _repair(path: str) -> int:
+        """Coupe une dernière ligne incomplète ; retourne la taille du fichier"""
+        size, removed = repair_tail(path)
+        if removed:
+            log.warning("%s: dernière ligne incomplète retirée", path)
+        return size
+
+    def observe(self, snapshot, event: str, causes: Optional[Dict[int, str]] = None):
+        """
+        Listener de CSVDataManager : enregistre les différences entre la carte publiée et la
+        dernière carte connue. `causes` donne un type par boisson (achat) ; `event` sinon.
+        """
+        causes = causes or {}
+        with self._lock:
+            stamp = max(time.time(), self._last_stamp)  # Fichier trié par temps, même si l'horloge recule
+            events = []
+            for drink in snapshot.drinks:
+                known = self._board.get(drink.id)
+                if known is None:
+                    changed = {field: getattr(drink, field) for field in FIELDS}
+                    events.append({'t': stamp, 'e': 'drink_added', 'id': drink.id, 'd': changed})
+                else:
+                    changed = {field: getattr(drink, field) for field in FIELDS if known.get(field) != getattr(drink, field)}
+                    if changed:
+                        events.append({'t': stamp, 'e': causes.get(drink.id, event), 'id': drink.id, 'd': changed})
+                in_happy_hour = drink.id in snapshot.happy_hours
+                if in_happy_hour != (known or {}).get('happy_hour', False):
+                    events.append({'t': stamp, 'e': 'happy_hour_start' if in_happy_hour else 'happy_hour_end', 'id': drink.id})
+            for drink_id in self._board.keys() - snapshot.by_id.keys():
+                events.append({'t': stamp, 'e': 'drink_deleted', 'id': drink_id})
+            if not events:
+                return
+            for record in events:
+                _apply(self._board, self._decay, record)
+                self._pending.append(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+            self._last_stamp = stamp
+
+    def set_half_life(self, seconds: float):
+        """Enregistre un changement de demi-vie du decay (0 = désactivé), écrit sans attendre"""
+        with self._lock:
+            if seconds == self._decay['seconds']:
+                return
+            stamp = max(time.time(), self._last_stamp)
+            record = {'t': stamp, 'e': 'half_life', 'd': {'seconds': seconds}}
+            _apply(self._board, self._decay, record)
+            self._pending.append(json.dumps(record, separators=(',', ':')))
+            self._last_stamp = stamp
+            self._flush()
+
+    def flush(self) -> int:
+        """Écrit les événements en attente en un seul ajout, puis un point de contrôle s'il est dû"""
+        with self._lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        pending, self._pending = self._pending, []
+        if pending:
+            data = ('\n'.join(pending) + '\n').encode('utf-8')
+            try:
+                with tracked_open(self.events_path, 'ab') as f:
+                    f.write(data)
+            except OSError as e:
+                self._pending = pending + self._pending
+                log.error("Erreur lors de l'écriture de la chronologie des prix: %s", e)
+                return 0
+            self._events_size += len(data)
+            self._since_checkpoint += len(pending)
+
+        last_checkpoint = self._checkpoint_times[-1] if self._checkpoint_times else 0.0
+        if self._since_checkpoint and (self._since_checkpoint >= self.checkpoint_every
+                                       or time.time() - last_checkpoint >= self.checkpoint_seconds):
+            self._write_checkpoint()
+        return len(pending)
+
+    def _write_checkpoint(self):
+        stamp = max(time.time(), self._last_stamp)
+        line = (json.dumps({'t': stamp, 'offset': self._events_size, 'board': self._board, 'decay': self._decay},
+                           separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+        try:
+            with tracked_open(self.checkpoints_path, 'ab') as f:
+                position = f.tell()
+                f.write(line)
+        except OSError as e:
+            log.error("Erreur lors de l'écriture d'un point de contrôle de la chronologie: %s", e)
+            return
+        self._checkpoint_times.append(stamp)
+        self._checkpoint_lines.append(position)
+        self._last_stamp = stamp
+        self._since_checkpoint = 0
+
+    def _rebuild(self, at: Optional[float], end: int, index: int):
+        """
+        (carte à l'instant `at` (None : la plus récente), réglage du decay, événements rejoués,
+        heure du dernier), depuis le point de contrôle numéro `index` (-1 : depuis le début du fichier)
+        """
+        board, decay, offset, last = {}, {'seconds': 0.0, 'since': 0.0}, 0, 0.0
+        if index >= 0:
+            with tracked_open(self.checkpoints_path, 'rb') as f:
+                f.seek(self._checkpoint_lines[index])
+                checkpoint = json.loads(f.readline())
+            board = {int(drink_id): drink for drink_id, drink in checkpoint['board'].items()}
+            decay.update(checkpoint.get('decay', {}))
+            offset, last = checkpoint['offset'], checkpoint['t']
+
+        replayed = 0
+        if offset < end:
+            with tracked_open(self.events_path, 'rb') as f:
+                f.seek(offset)
+                while offset < end:
+                    line = f.readline()
+                    if not line:
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if at is not None and record['t'] > at:
+                        break
+                    _apply(board, decay, record)
+                    last = record['t']
+                    replayed += 1
+        return board, decay, replayed, last
+
+    def board_at(self, at: float) -> Dict:
+        """
+        Carte complète à l'instant `at` (epoch) : dernier point de contrôle avant, puis rejeu.
+        `price` est le prix affiché à `at` (decay compris), `written_price` le dernier prix écrit.
+        """
+        with self._lock:
+            self._flush()
+            end = self._events_size
+            checkpoints = len(self._checkpoint_times)
+            index = bisect_right(self._checkpoint_times, at) - 1
+            checkpoint = self._checkpoint_times[index] if index >= 0 else None
+        # Lecture hors du verrou : les fichiers ne font que grandir, on s'arrête à `end`
+        board, decay, replayed, _ = self._rebuild(at, end, index)
+        log.debug("Carte à %s reconstruite: %s événements rejoués sur %s points de contrôle", at, replayed, checkpoints)
+        return {
+            'drinks': [{'id': drink_id, **drink, 'written_price': drink.get('price'),
+                        'price': _decayed_price(drink, decay, at)} for drink_id, drink in sorted(board.items())],
+            'half_life': decay['seconds'],
+            'checkpoint': checkpoint,
+            'replayed': replayed,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'events_bytes': self._events_size,
+                'pending': len(self._pending),
+                'checkpoints': len(self._checkpoint_times),
+                'since_checkpoint': self._since_checkpoint,
+            }
@@ -0,0 +1,137 @@
+"""
+Pile annuler / rétablir des transactions, bornée et indexée par transaction_id.
+
+Chaque transaction garde les prix avant/après de toutes les boissons touchées et ses lignes
+d'historique : annuler ou rétablir ne relit pas history.csv, les prix sont remis en une seule
+écriture de drinks.csv.
+
+La pile vit en mémoire (OrderedDict : empiler, dépiler, oublier la plus ancienne et retrouver
+une transaction par son id sont en O(1)). Elle est persistée par ajout d'une ligne JSON par
+opération dans data/undo_log.jsonl, rejouées au démarrage ; le journal est réécrit en une
+seule ligne d'état quand il devient trop long.
+"""
+import json
+import os
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from iostats import repair_tail, tracked_open
+from logs import get_logger
+
+log = get_logger('undo')
+
+
+class UndoLog:
+    def __init__(self, path: str, capacity: int = 100):
+        self.path = path
+        self.capacity = capacity
+        self.undo_stack: 'OrderedDict[int, Dict]' = OrderedDict()  # {transaction_id: transaction}
+        self.redo_stack: deque = deque(maxlen=capacity)
+        self._lines = 0
+        self.load()
+
+    def load(self):
+        """Rejoue le journal ; une fin de fichier coupée est retirée, les autres lignes illisibles ignorées"""
+        if not os.path.exists(self.path):
+            return
+        if repair_tail(self.path)[1]:
+            log.warning("%s: dernière ligne incomplète retirée", self.path)
+        with tracked_open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self._lines += 1
+                self._apply(record)
+        log.info("Pile d'annulation chargée: %s à annuler, %s à rétablir", len(self.undo_stack), len(self.redo_stack))
+
+    def _apply(self, record: Dict):
+        op = record.get('op')
+        if op == 'push':
+            self._push(record['tx'])
+        elif op == 'undo':
+            self._pop_undo()
+        elif op == 'redo':
+            self._pop_redo()
+        elif op == 'state':
+            self.undo_stack = OrderedDict((tx['transaction_id'], tx) for tx in record['undo'][-self.capacity:])
+            self.redo_stack = deque(record['redo'], maxlen=self.capacity)
+
+    def _push(self, tx: Dict):
+        # Id déjà présent (journal écrit avant les numéros uniques) : la transaction remonte en haut de pile
+        self.undo_stack[tx['transaction_id']] = tx
+        self.undo_stack.move_to_end(tx['transaction_id'])
+        while len(self.undo_stack) > self.capacity:
+            self.undo_stack.popitem(last=False)
+        self.redo_stack.clear()  # Une nouvelle transaction invalide ce qui était rétablissable
+
+    def _pop_undo(self) -> Optional[Dict]:
+        if not self.undo_stack:
+            return None
+        tx = self.undo_stack.popitem(last=True)[1]
+        self.redo_stack.append(tx)
+        return tx
+
+    def _pop_redo(self) -> Optional[Dict]:
+        if not self.redo_stack:
+            return None
+        tx = self.redo_stack.pop()
+        self.undo_stack[tx['transaction_id']] = tx
+        self.undo_stack.move_to_end(tx['transaction_id'])
+        return tx
+
+    def _append(self, record: Dict):
+        if self._lines >= 4 * self.capacity:
+            self._compact()
+        with tracked_open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._lines += 1
+
+    def _compact(self):
+        """Remplace le journal par une seule ligne d'état (écriture atomique)"""
+        tmp = self.path + '.tmp'
+        with tracked_open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'op': 'state', 'undo': list(self.undo_stack.values()),
+                                'redo': list(self.redo_stack)}, separators=(',', ':')) + '\n')
+        os.replace(tmp, self.path)
+        self._lines = 1
+
+    def record(self, transaction_id: int, label: str, changes: List, history_rows: List, sales: Optional[List] = None):
+        """
+        Empile une transaction (ValueError si son id est déjà dans la pile).
+        changes: [[drink_id, prix avant, prix après], ...] ; history_rows: lignes ajoutées à history.csv ;
+        sales: [[drink_id, nom, quantité, prix payé, prix de base, epoch de la vente], ...] pour un achat
+        """
+        if transaction_id in self.undo_stack:
+            raise ValueError(f"Transaction {transaction_id} déjà dans la pile d'annulation")
+        tx = {'transaction_id': transaction_id, 'label': label, 'changes': changes, 'history': history_rows,
+              'sales': sales or []}
+        self._push(tx)
+        self._append({'op': 'push', 'tx': tx})
+
+    def undo(self) -> Optional[Dict]:
+        tx = self._pop_undo()
+        if tx is not None:
+            self._append({'op': 'undo', 'id': tx['transaction_id']})
+        return tx
+
+    def redo(self) -> Optional[Dict]:
+        tx = self._pop_redo()
+        if tx is not None:
+            self._append({'op': 'redo', 'id': tx['transaction_id']})
+        return tx
+
+    def get(self, transaction_id: int) -> Optional[Dict]:
+        return self.undo_stack.get(transaction_id)
+
+    def status(self) -> Dict:
+        last_undo = next(reversed(self.undo_stack.values()), None)
+        last_redo = self.redo_stack[-1] if self.redo_stack else None
+        return {
+            'undo': len(self.undo_stack),
+            'redo': len(self.redo_stack),
+            'capacity': self.capacity,
+            'next_undo': last_undo['label'] if last_undo else None,
+            'next_redo': last_redo['label'] if last_redo else None,
+        }
@@ -0,0 +1,86 @@
+"""
+Négociation du format de réponse : JSON par défaut, MessagePack si le client le demande.
+
+Les écrans d'affichage envoient `Accept: application/msgpack` pour recevoir /prices et
+l'historique des prix en binaire (plus petit, plus rapide à décoder sur une tablette).
+Une fois décodée, la structure est identique à la réponse JSON. Pour gagner vraiment de la
+place :
+- les listes d'objets ayant les mêmes clés (la liste des boissons, l'historique) sont
+  envoyées comme une table (extension TABLE_EXT : [clés, lignes]) ; les clés ne
+  sont transmises qu'une fois et le décodeur client reconstruit les objets ;
+- les flottants sont encodés sur 32 bits (largement assez pour des prix en euros).
+Si le paquet `msgpack` n'est pas installé, le serveur répond simplement en JSON.
+"""
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # Dépendance optionnelle
+    msgpack = None
+
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+TABLE_EXT = 1
+
+
+def _pack(obj) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True, use_single_float=True)
+
+
+def _compact(obj):
+    """Remplace récursivement les listes d'objets homogènes par des tables"""
+    if isinstance(obj, dict):
+        return {key: _compact(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        if len(obj) >= 2 and all(isinstance(item, dict) for item in obj):
+            keys = list(obj[0])
+            if all(list(item) == keys for item in obj):
+                rows = [[_compact(item[key]) for key in keys] for item in obj]
+                return msgpack.ExtType(TABLE_EXT, _pack([keys, rows]))
+        return [_compact(item) for item in obj]
+    return obj
+
+
+def packb(content) -> bytes:
+    """Encode un contenu déjà sérialisable en JSON"""
+    return _pack(_compact(jsonable_encoder(content)))
+
+
+def _quality(accept: str, media_types) -> float:
+    """Plus grand facteur q accordé à l'un des types dans l'en-tête Accept (0 si absent)"""
+    best = 0.0
+    for part in accept.split(','):
+        fields = [f.strip() for f in part.split(';')]
+        if fields[0].lower() not in media_types:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        best = max(best, q)
+    return best
+
+
+def wants_msgpack(request: Request) -> bool:
+    if msgpack is None:
+        return False
+    accept = request.headers.get('accept', '')
+    if 'msgpack' not in accept:
+        return False
+    return _quality(accept, MSGPACK_TYPES) > _quality(accept, ('application/json',))
+
+
+def negotiate(request: Request, content, status_code: int = 200) -> Response:
+    """Réponse MessagePack si demandée, JSON sinon (en-tête Vary pour les caches)"""
+    if wants_msgpack(request):
+        body = packb(content)
+        response = Response(body, status_code=status_code, media_type=MSGPACK_MEDIA_TYPE)
+    else:
+        response = JSONResponse(content, status_code=status_code)
+    response.headers['Vary'] = 'Accept'
+    return response